@@ -0,0 +1,303 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, update, delete, exists, func, tuple_, or_
+from models import (User, Client, Product, Expense, Invoice, InvoiceItem, Quote, QuoteItem, Payment,
+                    RecurringInvoice, RecurringInvoiceItem, Activity, generate_uuid)
+from payments import BALANCE_EPSILON, PaymentError, check_status_change
+import product_sales
+import mailer
+import webhooks
+from datetime import datetime
+from collections import defaultdict
+import os
+
+# Opérations groupées : un SELECT pour la sélection, un UPDATE/DELETE
+# ensembliste limité au tenant, puis activités, règlements et événements
+# insérés en lot, le tout dans une seule transaction par lot. Chaque ID
+# reçoit son résultat (updated/deleted, unchanged, not_found, conflict...).
+
+# Configuration
+BULK_MAX_IDS = int(os.getenv("BULK_MAX_IDS", "1000"))  # Au-delà : variante en tâche de fond
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))  # Lot (et transaction) des tâches de fond
+
+INVOICE_STATUSES = ("Brouillon", "Envoyé", "Payé", "En retard", "Annulé")
+
+INVOICE_COLUMNS = ("id", "user_id", "invoice_number", "client_id", "quote_id", "recurring_id", "status", "date",
+                   "due_date", "amount", "tax_amount", "discount", "amount_paid", "balance_due", "notes",
+                   "payment_terms", "version")
+
+# Ressource -> (modèle, colonne du libellé, description de l'activité, colonnes qui la référencent)
+DELETABLE = {
+    "client": (Client, Client.name, "Client supprimé: {}",
+               [Invoice.client_id, Quote.client_id, RecurringInvoice.client_id, Expense.client_id, Payment.client_id]),
+    "product": (Product, Product.name, "Produit/Service supprimé: {}",
+                [InvoiceItem.product_id, QuoteItem.product_id, RecurringInvoiceItem.product_id]),
+    "expense": (Expense, Expense.title, "Dépense supprimée: {}", []),
+}
+
+class BulkError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def check_ids(ids: list, limit: int = BULK_MAX_IDS) -> list:
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        raise BulkError(400, "No IDs given")
+    if len(ids) > limit:
+        raise BulkError(400, f"At most {limit} IDs per request: use the /jobs variant")
+    return ids
+
+def _outcome(resource_id: str, outcome: str, detail: str = None) -> dict:
+    result = {"id": resource_id, "outcome": outcome}
+    if detail:
+        result["detail"] = detail
+    return result
+
+def _activity_rows(user_id: str, activity_type: str, rows: list, now: datetime) -> list:
+    return [{
+        "id": generate_uuid(),
+        "user_id": user_id,
+        "description": description,
+        "activity_type": activity_type,
+        "related_id": related_id,
+        "created_at": now,
+    } for related_id, description in rows]
+
+# ============ STATUT DES FACTURES ============
+def _as_datetime(value):
+    # Filtres relus depuis les paramètres JSON d'une tâche de fond
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def invoice_filter_clauses(user_id: str, filters: dict) -> list:
+    filters = {key: _as_datetime(value) if key in ("date_from", "date_to", "due_before") else value
+               for key, value in filters.items()}
+    clauses = [Invoice.user_id == user_id]
+    if filters.get("status"):
+        clauses.append(Invoice.status == filters["status"])
+    if filters.get("client_id"):
+        clauses.append(Invoice.client_id == filters["client_id"])
+    if filters.get("date_from"):
+        clauses.append(Invoice.date >= filters["date_from"])
+    if filters.get("date_to"):
+        clauses.append(Invoice.date <= filters["date_to"])
+    if filters.get("due_before"):
+        clauses.append(Invoice.due_date < filters["due_before"])
+    return clauses
+
+def _pending_clauses(status: str) -> list:
+    # Factures qui changeraient réellement de statut
+    clauses = [Invoice.status != status]
+    if status == "Payé":
+        clauses.append(Invoice.status != "Annulé")
+    else:
+        # Payées par des règlements : laissées telles quelles (voir check_status_change)
+        clauses.append(or_(Invoice.status != "Payé", func.coalesce(Invoice.amount_paid, 0) <= BALANCE_EPSILON))
+    return clauses
+
+def _select_invoices(db: Session, clauses: list, limit: int = None) -> list:
+    query = select(*[getattr(Invoice, column) for column in INVOICE_COLUMNS]).where(*clauses).order_by(Invoice.date, Invoice.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [dict(row._mapping) for row in db.execute(query)]
+
+def select_invoices(db: Session, user_id: str, status: str, ids: list = None, filters: dict = None,
+                    limit: int = BULK_MAX_IDS) -> tuple:
+    """Invoices to change (by IDs or filter), with the outcome of the IDs left aside"""
+    if status not in INVOICE_STATUSES:
+        raise BulkError(400, f"Unknown invoice status: {status}")
+    if (ids is None) == (filters is None):
+        raise BulkError(400, "Give either ids or filter")
+    if filters is not None:
+        rows = _select_invoices(db, invoice_filter_clauses(user_id, filters) + _pending_clauses(status), limit + 1)
+        if len(rows) > limit:
+            raise BulkError(400, f"More than {limit} invoices match: use the /jobs variant")
+        return rows, []
+
+    ids = check_ids(ids, limit)
+    found = {row["id"]: row for row in _select_invoices(db, [Invoice.user_id == user_id, Invoice.id.in_(ids)])}
+    rows, skipped = [], []
+    for invoice_id in ids:
+        row = found.get(invoice_id)
+        if row is None:
+            skipped.append(_outcome(invoice_id, "not_found"))
+        elif row["status"] == status:
+            skipped.append(_outcome(invoice_id, "unchanged"))
+        elif status == "Payé" and row["status"] == "Annulé":
+            skipped.append(_outcome(invoice_id, "invalid", "Cannot record a payment on a cancelled invoice"))
+        else:
+            try:
+                check_status_change(row["status"], row["amount_paid"], status)
+            except PaymentError as e:
+                skipped.append(_outcome(invoice_id, "invalid", e.detail))
+                continue
+            rows.append(row)
+    return rows, skipped
+
+def _status_description(number: str, status: str) -> str:
+    if status == "Payé":
+        return f"Facture {number} payée"
+    if status == "Envoyé":
+        return f"Facture {number} envoyée"
+    return f"Facture {number} passée en {status}"
+
+def apply_invoice_status(db: Session, user: User, rows: list, status: str, send_email: bool = True,
+                         now: datetime = None) -> list:
+    """Change the selected invoices in one guarded UPDATE, side effects in bulk (caller commits)"""
+    if not rows:
+        return []
+    now = now or datetime.utcnow()
+    values = {"status": status, "version": Invoice.version + 1}
+    if status == "Payé":
+        # Comme settle() : le solde restant est réglé ce jour
+        values.update(amount_paid=Invoice.amount_paid + func.coalesce(Invoice.balance_due, 0), balance_due=0.0)
+    # Garde sur (id, version) : une facture modifiée depuis la sélection est laissée telle quelle
+    updated = set(db.execute(
+        update(Invoice).where(
+            Invoice.user_id == user.id,
+            tuple_(Invoice.id, Invoice.version).in_([(row["id"], row["version"]) for row in rows])
+        ).values(**values).returning(Invoice.id).execution_options(synchronize_session=False)
+    ).scalars())
+
+    results, changed, payments, events, activities = [], [], [], [], []
+    for row in rows:
+        if row["id"] not in updated:
+            results.append(_outcome(row["id"], "conflict", "Invoice was modified concurrently"))
+            continue
+        results.append(_outcome(row["id"], "updated"))
+        old_status = row["status"]
+        invoice = {**row, "status": status, "version": row["version"] + 1}
+        if status == "Payé":
+            balance = row["balance_due"] or 0.0
+            invoice.update(amount_paid=row["amount_paid"] + balance, balance_due=0.0)
+            payment = None
+            if balance > BALANCE_EPSILON:
+                payment = {
+                    "id": generate_uuid(),
+                    "invoice_id": row["id"],
+                    "client_id": row["client_id"],
+                    "user_id": user.id,
+                    "amount": balance,
+                    "payment_date": now,
+                    "method": None,
+                    "reference": None,
+                    "created_at": now,
+                }
+                payments.append(payment)
+                events.append(webhooks.payment_event("payment.created", payment))
+            events.append(webhooks.invoice_paid_event(invoice, payment["id"] if payment else None))
+        events.append(webhooks.invoice_event("invoice.status_changed", invoice, old_status=old_status))
+        activities.append((row["id"], _status_description(row["invoice_number"], status)))
+        changed.append((invoice, old_status))
+
+    if payments:
+        db.execute(insert(Payment), payments)
+    if activities:
+        db.execute(insert(Activity), _activity_rows(user.id, "invoice", activities, now))
+    webhooks.emit(db, events)
+    for month in {product_sales.month_floor(invoice["date"]) for invoice, _ in changed if invoice["date"]}:
+        product_sales.invalidate(db, user.id, month)
+    if status == "Envoyé" and send_email:
+        mailer.queue(db, _invoice_emails(db, user, [invoice for invoice, old in changed if old != "Envoyé"]))
+    return results
+
+def _invoice_emails(db: Session, user: User, invoices: list) -> list:
+    if not invoices or not mailer.EMAIL_ENABLED:
+        return []
+    items = defaultdict(list)
+    for item in db.query(InvoiceItem).filter(InvoiceItem.invoice_id.in_([invoice["id"] for invoice in invoices])):
+        items[item.invoice_id].append(item)
+    clients = {client.id: client for client in db.query(Client.id, Client.name, Client.email).filter(
+        Client.id.in_({invoice["client_id"] for invoice in invoices})
+    )}
+    return [mailer.prepare("invoice", {
+        "id": invoice["id"],
+        "user_id": invoice["user_id"],
+        "number": invoice["invoice_number"],
+        "date": invoice["date"],
+        "due_date": invoice["due_date"],
+        "amount": invoice["amount"],
+        "tax_amount": invoice["tax_amount"],
+        "notes": invoice["notes"],
+        "payment_terms": invoice["payment_terms"],
+    }, items[invoice["id"]], clients.get(invoice["client_id"]), user) for invoice in invoices]
+
+def set_invoice_status(db: Session, user: User, status: str, ids: list = None, filters: dict = None,
+                       send_email: bool = True, now: datetime = None) -> list:
+    """Per-ID outcomes of a status change over IDs or a filter (caller commits)"""
+    rows, skipped = select_invoices(db, user.id, status, ids, filters)
+    results = skipped + apply_invoice_status(db, user, rows, status, send_email, now)
+    if ids is not None:
+        # Dans l'ordre des IDs reçus
+        position = {invoice_id: index for index, invoice_id in enumerate(ids)}
+        results.sort(key=lambda result: position[result["id"]])
+    return results
+
+def set_invoice_status_in_chunks(db: Session, user: User, status: str, ids: list = None, filters: dict = None,
+                                 send_email: bool = True, progress=None, chunk_size: int = BULK_CHUNK_SIZE) -> dict:
+    """Same change for large selections, one transaction per chunk (commits)"""
+    counts = defaultdict(int)
+    failures = []
+
+    def record(results: list):
+        for result in results:
+            counts[result["outcome"]] += 1
+            if result["outcome"] not in ("updated", "unchanged"):
+                failures.append(result)
+
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+        for start in range(0, len(ids), chunk_size):
+            if progress is not None:
+                progress(start, len(ids))
+            record(set_invoice_status(db, user, status, ids=ids[start:start + chunk_size], send_email=send_email))
+            db.commit()
+        if progress is not None:
+            progress(len(ids), len(ids))
+    else:
+        if status not in INVOICE_STATUSES:
+            raise BulkError(400, f"Unknown invoice status: {status}")
+        clauses = invoice_filter_clauses(user.id, filters) + _pending_clauses(status)
+        total = db.query(func.count(Invoice.id)).filter(*clauses).scalar()
+        done = 0
+        while True:
+            if progress is not None:
+                progress(done, total)
+            rows = _select_invoices(db, clauses, chunk_size)
+            results = apply_invoice_status(db, user, rows, status, send_email)
+            db.commit()
+            record(results)
+            done += len(rows)
+            # Fin de la sélection, ou lot entièrement en conflit : la suite sera reprise par un autre appel
+            if len(rows) < chunk_size or not any(result["outcome"] == "updated" for result in results):
+                break
+    return {"counts": dict(counts), "failures": failures[:BULK_MAX_IDS]}
+
+# ============ SUPPRESSIONS ============
+def delete_resources(db: Session, user_id: str, resource: str, ids: list, now: datetime = None) -> list:
+    """Delete the tenant's rows that nothing references, in one DELETE (caller commits)"""
+    model, label, description, references = DELETABLE[resource]
+    ids = check_ids(ids)
+    deleted = dict(db.execute(
+        delete(model).where(
+            model.id.in_(ids),
+            model.user_id == user_id,
+            *[~exists().where(column == model.id) for column in references]
+        ).returning(model.id, label).execution_options(synchronize_session=False)
+    ).all())
+    remaining = [resource_id for resource_id in ids if resource_id not in deleted]
+    in_use = set()
+    if remaining:
+        in_use = set(db.execute(select(model.id).where(model.id.in_(remaining), model.user_id == user_id)).scalars())
+
+    if deleted:
+        db.execute(insert(Activity), _activity_rows(
+            user_id, resource, [(resource_id, description.format(name)) for resource_id, name in deleted.items()],
+            now or datetime.utcnow()
+        ))
+    return [
+        _outcome(resource_id, "deleted") if resource_id in deleted
+        else _outcome(resource_id, "in_use", f"{model.__name__} is referenced by other records") if resource_id in in_use
+        else _outcome(resource_id, "not_found")
+        for resource_id in ids
+    ]
@@ -1,7 +1,12 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError, OperationalError, InterfaceError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.pool import StaticPool
+from fastapi import Depends, Request
+import threading
+import logging
+import time
 import os
 from dotenv import load_dotenv
 
@@ -9,18 +14,179 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./invoiceflow.db")
 
-engine = create_engine(
-    DATABASE_URL,
-    poolclass=StaticPool,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+# Pool per worker process; serve.py sizes these against the server's connection limit
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Read replicas (comma-separated URLs) for lag-tolerant read-only routes
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_HEALTH_INTERVAL = float(os.getenv("REPLICA_HEALTH_INTERVAL", "5"))  # secondes
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "30"))  # secondes, PostgreSQL uniquement
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))  # lecture sur le primaire après écriture
+
+# Tenant shards ("name=url" comma-separated). The primary stays the directory:
+# users.shard names each tenant's shard, NULL meaning the primary itself.
+SHARD_URLS = dict(
+    entry.strip().split("=", 1) for entry in os.getenv("SHARD_URLS", "").split(",") if entry.strip()
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+logger = logging.getLogger(__name__)
+
+def engine_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        options = {"connect_args": {"check_same_thread": False}}
+        # A single shared connection is only needed for in-memory databases
+        if url in ("sqlite://", "sqlite:///") or ":memory:" in url:
+            options["poolclass"] = StaticPool
+        return options
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+shard_engines = {
+    name: engine if url == DATABASE_URL else create_engine(url, **engine_options(url))
+    for name, url in SHARD_URLS.items()
+}
+
+# Tables kept on the primary (directory) whatever the tenant's shard
+GLOBAL_TABLES = {"users", "number_sequences", "jobs", "idempotency_keys", "rate_limit_buckets"}
+
+class TenantSession(Session):
+    """Binds tenant tables to the shard set by get_current_user; users stay on the primary"""
+
+    def tenant_shard(self):
+        return self.info.get("tenant", {}).get("shard")
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        shard = self.tenant_shard()
+        if shard is not None and (mapper is None or mapper.local_table.name not in GLOBAL_TABLES):
+            return shard_engines[shard]
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+SessionLocal = sessionmaker(class_=TenantSession, autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
+def shard_session(shard: str = None) -> TenantSession:
+    # Session pinned to one shard, for jobs iterating over every database
+    return SessionLocal(info={"tenant": {"shard": shard}})
+
+def shard_names() -> list:
+    # None is the primary; shards aliasing the primary are not listed twice
+    return [None] + [name for name, shard_engine in shard_engines.items() if shard_engine is not engine]
+
+def tenant_scope() -> dict:
+    # One per request (FastAPI caches dependencies), shared by every session of the request
+    return {}
+
+def set_tenant_shard(db: Session, shard: str):
+    db.info.setdefault("tenant", {})["shard"] = shard
+
+def get_db(scope: dict = Depends(tenant_scope)):
     db = SessionLocal()
+    db.info["tenant"] = scope
+    try:
+        yield db
+    finally:
+        db.close()
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = create_engine(url, **engine_options(url))
+        self.healthy = True
+        self.checked_at = 0.0
+
+    def check(self) -> bool:
+        try:
+            with self.engine.connect() as conn:
+                if self.engine.dialect.name == "postgresql":
+                    lag = conn.execute(text(
+                        "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+                    )).scalar()
+                    self.healthy = float(lag) <= REPLICA_MAX_LAG
+                else:
+                    conn.execute(text("SELECT 1"))
+                    self.healthy = True
+        except Exception as e:
+            logger.warning(f"Replica {self.engine.url.render_as_string(hide_password=True)} unhealthy: {e}")
+            self.healthy = False
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+class ReplicaRouter:
+    """Round-robin over healthy replicas; falls back to the primary when none is"""
+
+    def __init__(self, urls: list):
+        self.replicas = [Replica(url) for url in urls]
+        self._next = 0
+        self._last_write = {}
+        self._lock = threading.Lock()
+
+    def choose(self):
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[self._next % len(self.replicas)]
+                self._next += 1
+            if now - replica.checked_at >= REPLICA_HEALTH_INTERVAL:
+                replica.check()
+            if replica.healthy:
+                return replica
+        return None
+
+    def mark_unhealthy(self, replica: Replica):
+        replica.healthy = False
+        replica.checked_at = time.monotonic()
+
+    def record_write(self, user_id: str):
+        with self._lock:
+            self._last_write[user_id] = time.monotonic()
+
+    def recently_wrote(self, user_id: str) -> bool:
+        with self._lock:
+            last_write = self._last_write.get(user_id)
+            if last_write is not None and time.monotonic() - last_write >= REPLICA_STICKY_SECONDS:
+                del self._last_write[user_id]
+                last_write = None
+        return last_write is not None
+
+replica_router = ReplicaRouter(DATABASE_REPLICA_URLS)
+
+class RoutingSession(TenantSession):
+    """Reads go to the session's replica; any flush goes to the primary"""
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        # Replicas mirror the primary only: tenants living on a shard read from it
+        if replica is not None and not self._flushing and self.tenant_shard() is None:
+            return replica.engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+RoutingSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False, bind=engine)
+
+def get_read_db(request: Request, scope: dict = Depends(tenant_scope)):
+    # Replica unless the request asked for primary consistency (read-your-writes)
+    db = RoutingSessionLocal()
+    db.info["tenant"] = scope
+    replica = None
+    if replica_router.replicas and not getattr(request.state, "read_primary", False):
+        replica = replica_router.choose()
+    db.info["replica"] = replica
     try:
         yield db
+    except DBAPIError as e:
+        # Seules les pannes de connexion ou du pilote écartent le réplica ;
+        # les erreurs applicatives (404, 400...) remontent sans y toucher
+        if replica is not None and (e.connection_invalidated or isinstance(e, (OperationalError, InterfaceError))):
+            replica_router.mark_unhealthy(replica)
+        raise
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,386 @@
+from sqlalchemy import create_engine, insert
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from itertools import accumulate
+from pathlib import Path
+from dotenv import load_dotenv
+import calendar
+import random
+import time
+import uuid
+import csv
+import io
+import os
+import typer
+
+# Générateur de tenants synthétiques à fort volume. Écrit directement en base
+# (COPY sur PostgreSQL, INSERT multi-lignes ailleurs), sans passer par l'API.
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+DATAGEN_PASSWORD = "demo123"
+DATAGEN_EMAIL = "tenant{index:05d}@datagen.invoiceflow.fr"
+
+def distribution(weights: dict) -> tuple:
+    # Poids cumulés précalculés : tirage en O(log n) au lieu de O(n)
+    return list(weights), list(accumulate(weights.values()))
+
+# Distributions (poids relatifs) inspirées des valeurs utilisées dans models.py
+TAX_RATES = distribution({20.0: 80, 10.0: 10, 5.5: 7, 2.1: 1, 0.0: 2})
+LINE_COUNTS = distribution({1: 35, 2: 25, 3: 15, 4: 10, 5: 6, 6: 4, 8: 3, 12: 2})
+PAYMENT_TERMS = distribution({"30 jours": 60, "45 jours fin de mois": 20, "60 jours": 15, "Comptant": 5})
+OVERDUE_INVOICE_STATUSES = distribution({"Payé": 80, "En retard": 12, "Annulé": 3, "Envoyé": 5})
+OPEN_INVOICE_STATUSES = distribution({"Payé": 35, "Envoyé": 45, "Brouillon": 17, "Annulé": 3})
+QUOTE_STATUSES = distribution({"Accepté": 40, "Refusé": 20, "Expiré": 15, "Envoyé": 15, "Brouillon": 10})
+EXPENSE_CATEGORIES = distribution({"Transport": 25, "Repas": 25, "Matériel": 15, "Logiciels": 12, "Formation": 8,
+                                   "Télécom": 8, "Loyer": 4, "Autre": 3})
+EXPENSE_STATUSES = distribution({"Approuvé": 75, "En attente": 20, "Refusé": 5})
+PRODUCT_CATEGORIES = ["Développement", "Design", "Conseil", "Formation", "Maintenance", "Matériel", "Hébergement"]
+UNITS = distribution({"heure": 35, "jour": 30, "pièce": 25, "mois": 10})
+DISCOUNTS = distribution({0.0: 80, 5.0: 10, 10.0: 7, 15.0: 3})
+PAYMENT_METHODS = distribution({"Virement": 70, "Chèque": 12, "Carte": 10, "Prélèvement": 6, "Espèces": 2})
+PARTIAL_PAYMENT_RATE = 0.1  # Part des factures envoyées ou en retard avec un acompte
+
+COMPANY_PREFIXES = ["Groupe", "Société", "Atelier", "Cabinet", "Studio", "Maison", "Agence", "Compagnie"]
+COMPANY_NAMES = ["Durand", "Lefèvre", "Moreau", "Laurent", "Bernard", "Garnier", "Rousseau", "Fontaine",
+                 "Chevalier", "Girard", "Bonnet", "Dupont", "Lambert", "Mercier", "Faure", "Blanc"]
+COMPANY_SUFFIXES = ["SARL", "SAS", "SA", "EURL", "& Fils", "Conseil", "Industries", "Services"]
+
+def weighted(rng: random.Random, dist: tuple):
+    values, cum_weights = dist
+    return rng.choices(values, cum_weights=cum_weights)[0]
+
+def new_id(rng: random.Random) -> str:
+    # UUID dérivé du générateur : même graine, mêmes identifiants
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def add_months(date: datetime, months: int) -> datetime:
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    return date.replace(year=year, month=month, day=min(date.day, calendar.monthrange(year, month)[1]))
+
+class TableWriter:
+    """Buffers rows per table and flushes them with COPY or executemany"""
+
+    def __init__(self, conn, chunk_size: int, use_copy: bool):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.use_copy = use_copy
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, table, row: dict):
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.chunk_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        tables = [table] if table is not None else list(self.buffers)
+        for current in tables:
+            rows = self.buffers.get(current)
+            if not rows:
+                continue
+            if self.use_copy:
+                self._copy(current, rows)
+            else:
+                self.conn.execute(insert(current), rows)
+            self.counts[current.name] = self.counts.get(current.name, 0) + len(rows)
+            self.buffers[current] = []
+
+    def _copy(self, table, rows: list):
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([row[column] for column in columns])
+        buffer.seek(0)
+        cursor = self.conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer
+            )
+        finally:
+            cursor.close()
+
+def tenant_sizes(invoices: int, quote_ratio: float, expense_ratio: float) -> dict:
+    return {
+        "invoices": invoices,
+        "quotes": int(invoices * quote_ratio),
+        "expenses": int(invoices * expense_ratio),
+        "clients": max(5, invoices // 40),
+        "products": min(300, max(20, invoices // 200)),
+    }
+
+def generate_tenant(task: dict) -> dict:
+    from models import User, Client, Product, Invoice, InvoiceItem, Payment, Quote, QuoteItem, Expense, Activity
+
+    index = task["index"]
+    sizes = task["sizes"]
+    rng = random.Random(task["seed"] * 1_000_003 + index)
+    now = task["now"]
+    first_day = now - timedelta(days=365 * task["years"])
+    span_days = (now - first_day).days
+    engine = create_engine(task["database_url"])
+
+    def random_date() -> datetime:
+        return first_day + timedelta(days=rng.randint(0, span_days), seconds=rng.randint(8 * 3600, 19 * 3600))
+
+    with engine.begin() as conn:
+        writer = TableWriter(conn, task["chunk_size"], task["use_copy"] and engine.dialect.name == "postgresql")
+
+        user_id = new_id(rng)
+        writer.add(User.__table__, {
+            "id": user_id,
+            "email": DATAGEN_EMAIL.format(index=index),
+            "name": f"Tenant {index}",
+            "hashed_password": task["hashed_password"],
+            "is_active": True,
+            "company_name": f"{rng.choice(COMPANY_NAMES)} {rng.choice(COMPANY_SUFFIXES)}",
+            "siret": "".join(str(rng.randint(0, 9)) for _ in range(14)),
+            "created_at": first_day
+        })
+        writer.flush()
+
+        # Clients : taille suivant une loi de Pareto (quelques gros comptes)
+        clients = []
+        for i in range(sizes["clients"]):
+            client_id = new_id(rng)
+            name = f"{rng.choice(COMPANY_PREFIXES)} {rng.choice(COMPANY_NAMES)} {rng.choice(COMPANY_SUFFIXES)} {i + 1}"
+            clients.append((client_id, name))
+            writer.add(Client.__table__, {
+                "id": client_id,
+                "name": name,
+                "email": f"contact{i + 1}@client{index}-{i + 1}.fr",
+                "phone": f"0{rng.randint(1, 9)}{rng.randint(10000000, 99999999)}",
+                "status": "Actif" if rng.random() < 0.9 else "Inactif",
+                "siret": "".join(str(rng.randint(0, 9)) for _ in range(14)),
+                "user_id": user_id,
+                "created_at": first_day
+            })
+        client_distribution = (clients, list(accumulate(rng.paretovariate(1.16) for _ in clients)))
+
+        products = []
+        for i in range(sizes["products"]):
+            product_id = new_id(rng)
+            category = rng.choice(PRODUCT_CATEGORIES)
+            unit = weighted(rng, UNITS)
+            price = round(rng.lognormvariate(4.5, 1.0), 2)
+            products.append((product_id, f"{category} {i + 1}", price))
+            writer.add(Product.__table__, {
+                "id": product_id,
+                "name": f"{category} {i + 1}",
+                "price": price,
+                "unit": unit,
+                "category": category,
+                "is_service": unit in ("heure", "jour", "mois"),
+                "user_id": user_id,
+                "created_at": first_day
+            })
+        writer.flush()
+
+        def lines(document_id: str, key: str, table):
+            subtotal = 0.0
+            tax = 0.0
+            for _ in range(weighted(rng, LINE_COUNTS)):
+                if rng.random() < 0.7:
+                    product_id, description, price = rng.choice(products)
+                else:
+                    product_id, description, price = None, "Prestation spécifique", round(rng.lognormvariate(5, 1.2), 2)
+                quantity = float(rng.choice([1, 1, 1, 2, 3, 5, 10]))
+                tax_rate = weighted(rng, TAX_RATES)
+                total = quantity * price
+                subtotal += total
+                tax += total * tax_rate / 100
+                writer.add(table, {
+                    "id": new_id(rng),
+                    key: document_id,
+                    "product_id": product_id,
+                    "description": description,
+                    "quantity": quantity,
+                    "price": price,
+                    "tax_rate": tax_rate,
+                    "total": total
+                })
+            return subtotal, tax
+
+        def document(number: str, number_key: str, date_key: str, table, item_table, item_key, status: str,
+                     date: datetime, end_date: datetime, activity: str, activity_type: str, extra: dict,
+                     paid_ratio: float = None) -> dict:
+            document_id = new_id(rng)
+            client_id, client_name = weighted(rng, client_distribution)
+            discount = weighted(rng, DISCOUNTS)
+            subtotal, tax = lines(document_id, item_key, item_table)
+            amount = subtotal * (1 - discount / 100)
+            if paid_ratio is not None:
+                # Factures : règlements tenus à jour comme par l'API
+                amount_paid = round(amount * paid_ratio, 2) if paid_ratio < 1 else amount
+                extra = {**extra, "amount_paid": amount_paid, "balance_due": amount - amount_paid}
+            row = {
+                "id": document_id,
+                number_key: number,
+                "client_id": client_id,
+                "user_id": user_id,
+                "date": date,
+                date_key: end_date,
+                "amount": amount,
+                "tax_amount": tax * (1 - discount / 100),
+                "discount": discount,
+                "status": status,
+                "created_at": date,
+                **extra
+            }
+            writer.add(table, row)
+            if task["activities"]:
+                writer.add(Activity.__table__, {
+                    "id": new_id(rng),
+                    "user_id": user_id,
+                    "description": f"{activity} {number} créé(e) pour {client_name}",
+                    "activity_type": activity_type,
+                    "related_id": document_id,
+                    "created_at": date
+                })
+            return row
+
+        for i in range(sizes["invoices"]):
+            date = random_date()
+            terms = weighted(rng, PAYMENT_TERMS)
+            due_date = date + timedelta(days={"30 jours": 30, "45 jours fin de mois": 60, "60 jours": 60}.get(terms, 0))
+            status = weighted(rng, OVERDUE_INVOICE_STATUSES if due_date < now else OPEN_INVOICE_STATUSES)
+            if status == "Payé":
+                paid_ratio = 1.0
+            elif status in ("Envoyé", "En retard") and rng.random() < PARTIAL_PAYMENT_RATE:
+                paid_ratio = rng.uniform(0.2, 0.8)
+            else:
+                paid_ratio = 0.0
+            invoice = document(f"INV{str(task['invoice_offset'] + i + 1).zfill(3)}", "invoice_number", "due_date",
+                               Invoice.__table__, InvoiceItem.__table__, "invoice_id", status, date, due_date,
+                               "Facture", "invoice", {"payment_terms": terms}, paid_ratio)
+            if invoice["amount_paid"] > 0:
+                # Encaissé entre l'émission et l'échéance (ou aujourd'hui au plus tard)
+                paid_at = min(now, date + timedelta(days=rng.randint(0, max(0, (due_date - date).days)), hours=rng.randint(0, 8)))
+                writer.add(Payment.__table__, {
+                    "id": new_id(rng),
+                    "invoice_id": invoice["id"],
+                    "client_id": invoice["client_id"],
+                    "user_id": user_id,
+                    "amount": invoice["amount_paid"],
+                    "payment_date": paid_at,
+                    "method": weighted(rng, PAYMENT_METHODS),
+                    "created_at": paid_at
+                })
+
+        for i in range(sizes["quotes"]):
+            date = random_date()
+            expiry_date = add_months(date, 1)
+            status = weighted(rng, QUOTE_STATUSES)
+            if status in ("Brouillon", "Envoyé") and expiry_date < now:
+                status = "Expiré"
+            document(f"DEV{str(task['quote_offset'] + i + 1).zfill(3)}", "quote_number", "expiry_date",
+                     Quote.__table__, QuoteItem.__table__, "quote_id", status, date, expiry_date,
+                     "Devis", "quote", {})
+
+        for _ in range(sizes["expenses"]):
+            category = weighted(rng, EXPENSE_CATEGORIES)
+            is_billable = rng.random() < 0.15
+            writer.add(Expense.__table__, {
+                "id": new_id(rng),
+                "title": f"{category} {rng.randint(1, 999)}",
+                "amount": round(rng.lognormvariate(3.8, 1.0), 2),
+                "category": category,
+                "expense_date": random_date(),
+                "is_billable": is_billable,
+                "client_id": weighted(rng, client_distribution)[0] if is_billable else None,
+                "status": weighted(rng, EXPENSE_STATUSES),
+                "user_id": user_id,
+                "created_at": now
+            })
+
+        writer.flush()
+    engine.dispose()
+    return writer.counts
+
+def generate(database_url: str, tenants: int = 1, invoices_per_tenant: int = 1000, quote_ratio: float = 0.4,
+             expense_ratio: float = 0.3, years: int = 3, workers: int = 1, seed: int = 42,
+             chunk_size: int = 10_000, use_copy: bool = True, activities: bool = True, reset: bool = False,
+             password: str = DATAGEN_PASSWORD) -> dict:
+    os.environ["DATABASE_URL"] = database_url
+    from sqlalchemy import func, select
+    from database import Base
+    from models import Invoice, Quote
+    from auth import get_password_hash
+
+    engine = create_engine(database_url)
+    if reset:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        invoice_offset = conn.execute(select(func.count()).select_from(Invoice)).scalar()
+        quote_offset = conn.execute(select(func.count()).select_from(Quote)).scalar()
+    if engine.dialect.name == "sqlite" and workers > 1:
+        # SQLite n'accepte qu'un écrivain à la fois
+        workers = 1
+    engine.dispose()
+
+    # Plages de numéros réservées à l'avance : les numéros restent contigus
+    # (compatibles avec la numérotation par comptage) quel que soit l'ordre d'exécution
+    sizes = tenant_sizes(invoices_per_tenant, quote_ratio, expense_ratio)
+    hashed_password = get_password_hash(password)
+    now = datetime.utcnow().replace(microsecond=0)
+    tasks = [{
+        "index": index,
+        "sizes": sizes,
+        "seed": seed,
+        "now": now,
+        "years": years,
+        "database_url": database_url,
+        "chunk_size": chunk_size,
+        "use_copy": use_copy,
+        "activities": activities,
+        "hashed_password": hashed_password,
+        "invoice_offset": invoice_offset + index * sizes["invoices"],
+        "quote_offset": quote_offset + index * sizes["quotes"],
+    } for index in range(tenants)]
+
+    totals = {}
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = list(pool.imap_unordered(generate_tenant, tasks))
+    else:
+        results = [generate_tenant(task) for task in tasks]
+    for counts in results:
+        for table, count in counts.items():
+            totals[table] = totals.get(table, 0) + count
+    return totals
+
+app = typer.Typer(help="Generate high-volume synthetic InvoiceFlow tenants")
+
+@app.command()
+def main(
+    database_url: str = typer.Option(os.getenv("DATABASE_URL", "sqlite:///./invoiceflow.db"), help="Target database"),
+    tenants: int = typer.Option(1, help="Number of tenants (users)"),
+    invoices_per_tenant: int = typer.Option(1000, help="Invoices per tenant"),
+    quote_ratio: float = typer.Option(0.4, help="Quotes per invoice"),
+    expense_ratio: float = typer.Option(0.3, help="Expenses per invoice"),
+    years: int = typer.Option(3, help="History depth in years"),
+    workers: int = typer.Option(os.cpu_count() or 1, help="Parallel worker processes (forced to 1 on SQLite)"),
+    seed: int = typer.Option(42, help="Random seed; same seed, same data"),
+    chunk_size: int = typer.Option(10_000, help="Rows per COPY/INSERT batch"),
+    copy: bool = typer.Option(True, help="Use COPY on PostgreSQL"),
+    activities: bool = typer.Option(True, help="Also write activity rows"),
+    reset: bool = typer.Option(False, help="Drop and recreate all tables first"),
+    password: str = typer.Option(DATAGEN_PASSWORD, help="Password for every generated tenant"),
+):
+    started = time.perf_counter()
+    totals = generate(database_url, tenants, invoices_per_tenant, quote_ratio, expense_ratio, years, workers,
+                      seed, chunk_size, copy, activities, reset, password)
+    elapsed = time.perf_counter() - started
+    for table, count in sorted(totals.items()):
+        typer.echo(f"{table:20} {count:>12,}")
+    typer.echo(f"{sum(totals.values()):,} rows in {elapsed:.1f}s ({sum(totals.values()) / elapsed:,.0f} rows/s)")
+    typer.echo(f"Login: {DATAGEN_EMAIL.format(index=0)} / {password}")
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,168 @@
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select, insert, update, delete, or_, and_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from database import engine
+from models import IdempotencyKey, generate_uuid
+from auth import verify_token
+import hashlib
+import json
+import os
+import re
+
+# En-tête Idempotency-Key sur les POST : la première requête réserve la clé
+# (ligne in_progress, unique par utilisateur), les doublons concurrents
+# reçoivent 409, et une fois la réponse stockée une nouvelle tentative la
+# rejoue sans refaire le travail. Seules les réponses 2xx sont gardées :
+# après une erreur, la clé est libérée et la requête peut être refaite.
+
+# Routes de création couvertes (chemins complets) : les autres POST, dont
+# l'envoi de justificatif lu en flux, ne sont jamais mis en mémoire ici
+IDEMPOTENT_ROUTES = [re.compile(f"^/api{pattern}$") for pattern in (
+    "/clients",
+    "/products",
+    "/expenses",
+    "/quotes",
+    r"/quotes/[^/]+/convert",
+    "/invoices",
+    r"/invoices/[^/]+/payments",
+    "/recurring-invoices",
+    "/webhooks",
+    "/invoices/bulk-status/jobs",
+    "/bank/matches/confirm/jobs",
+    "/reports/products/jobs",
+)]
+
+# Configuration
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))  # Traitement abandonné au-delà
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+HEADER = "idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+STORED_HEADERS = ("content-type", "location")
+
+class IdempotencyError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def fingerprint(method: str, path: str, query: str, body: bytes) -> str:
+    digest = hashlib.sha256(f"{method} {path}?{query}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+def is_idempotent_route(path: str) -> bool:
+    return any(route.match(path) for route in IDEMPOTENT_ROUTES)
+
+def begin(user_id: str, key: str, request_fingerprint: str, now: datetime = None):
+    """Reserve the key; returns None to proceed, or the stored response to replay"""
+    now = now or datetime.utcnow()
+    keys = IdempotencyKey.__table__
+    values = {
+        "fingerprint": request_fingerprint,
+        "status": "in_progress",
+        "response_status": None,
+        "response_headers": None,
+        "response_body": None,
+        "locked_at": now,
+        "created_at": now,
+        "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS),
+    }
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(keys).values(id=generate_uuid(), user_id=user_id, key=key, **values))
+        return None
+    except IntegrityError:
+        pass
+
+    # Clé déjà vue : expirée ou abandonnée par un worker arrêté, elle est reprise
+    with engine.begin() as conn:
+        taken = conn.execute(update(keys).where(
+            keys.c.user_id == user_id,
+            keys.c.key == key,
+            or_(
+                keys.c.expires_at < now,
+                and_(keys.c.status == "in_progress",
+                     keys.c.locked_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS))
+            )
+        ).values(**values)).rowcount
+        if taken:
+            return None
+        row = conn.execute(select(keys).where(keys.c.user_id == user_id, keys.c.key == key)).first()
+    if row is None:
+        # Libérée entre-temps par une requête en erreur
+        return begin(user_id, key, request_fingerprint, now)
+    if row.fingerprint != request_fingerprint:
+        raise IdempotencyError(422, "Idempotency-Key was already used for a different request")
+    if row.status != "completed":
+        raise IdempotencyError(409, "A request with this Idempotency-Key is in progress")
+    return {
+        "status_code": row.response_status,
+        "headers": json.loads(row.response_headers or "{}"),
+        "body": row.response_body.encode() if row.response_body is not None else b"",
+    }
+
+def complete(user_id: str, key: str, status_code: int, headers: dict, body: bytes):
+    keys = IdempotencyKey.__table__
+    with engine.begin() as conn:
+        conn.execute(update(keys).where(keys.c.user_id == user_id, keys.c.key == key).values(
+            status="completed",
+            response_status=status_code,
+            response_headers=json.dumps(headers),
+            response_body=body.decode("utf-8", "replace"),
+            locked_at=None
+        ))
+
+def release(user_id: str, key: str):
+    keys = IdempotencyKey.__table__
+    with engine.begin() as conn:
+        conn.execute(delete(keys).where(
+            keys.c.user_id == user_id, keys.c.key == key, keys.c.status == "in_progress"
+        ))
+
+def run_idempotency_prune(now: datetime = None) -> dict:
+    keys = IdempotencyKey.__table__
+    with engine.begin() as conn:
+        removed = conn.execute(delete(keys).where(keys.c.expires_at < (now or datetime.utcnow()))).rowcount
+    return {"idempotency_keys_expired": removed}
+
+async def middleware(request: Request, call_next):
+    key = request.headers.get(HEADER)
+    if request.method != "POST" or not key or not is_idempotent_route(request.url.path):
+        return await call_next(request)
+    authorization = request.headers.get("authorization", "")
+    user_id = verify_token(authorization[7:]) if authorization.lower().startswith("bearer ") else None
+    if user_id is None:
+        # Non authentifié : la route répond 401
+        return await call_next(request)
+    if len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+        return JSONResponse({"detail": "Idempotency-Key is too long"}, status_code=400)
+
+    # Corps en cache dans la requête : la route le relit normalement
+    body = await request.body()
+    request_fingerprint = fingerprint(request.method, request.url.path, request.url.query, body)
+    try:
+        stored = await run_in_threadpool(begin, user_id, key, request_fingerprint)
+    except IdempotencyError as e:
+        headers = {"Retry-After": "1"} if e.status_code == 409 else None
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=headers)
+    if stored is not None:
+        return Response(stored["body"], status_code=stored["status_code"],
+                        headers={**stored["headers"], REPLAYED_HEADER: "true"})
+
+    try:
+        response = await call_next(request)
+        if not 200 <= response.status_code < 300:
+            await run_in_threadpool(release, user_id, key)
+            return response
+        content = b"".join([chunk async for chunk in response.body_iterator])
+    except BaseException:
+        await run_in_threadpool(release, user_id, key)
+        raise
+    headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+    await run_in_threadpool(complete, user_id, key, response.status_code, headers, content)
+    return Response(content, status_code=response.status_code, headers=dict(response.headers))
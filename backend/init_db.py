@@ -0,0 +1,65 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from database import engine, shard_engines, Base
+from payments import backfill_payments
+import models  # noqa: F401 - registers every table on Base.metadata
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Étape d'initialisation explicite, à lancer une fois avant les workers :
+# crée les tables manquantes puis ajoute les colonnes et index introduits
+# depuis (create_all ne modifie pas les tables existantes).
+
+def add_missing_columns(bind: Engine) -> list:
+    inspector = inspect(bind)
+    added = []
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=bind.dialect)}"
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    # Même rendu que CREATE TABLE : chaîne citée, text() brut
+                    default = default.replace("'", "''").join("''") if isinstance(default, str) else default.text
+                    ddl += f" DEFAULT {default}"
+                    if not column.nullable:
+                        ddl += " NOT NULL"
+                conn.execute(text(ddl))
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+def add_missing_indexes(bind: Engine) -> list:
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspect(bind).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                # Respecte ddl_if (index pg_trgm ignorés hors PostgreSQL)
+                index.create(bind, checkfirst=True)
+        created = {index["name"] for index in inspect(bind).get_indexes(table.name)} - existing
+        added.extend(sorted(created))
+    return added
+
+def init_db(bind: Engine = engine) -> dict:
+    Base.metadata.create_all(bind=bind)
+    result = {
+        "columns": add_missing_columns(bind),
+        "indexes": add_missing_indexes(bind),
+        "payments_backfilled": backfill_payments(bind),
+    }
+    logger.info(f"Database initialized: {result}")
+    return result
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    init_db()
+    for shard_engine in shard_engines.values():
+        if shard_engine is not engine:
+            init_db(shard_engine)
@@ -0,0 +1,387 @@
+from sqlalchemy import select, update, func
+from sqlalchemy.orm import Session
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from dotenv import load_dotenv
+import threading
+import tempfile
+import logging
+import random
+import signal
+import socket
+import fcntl
+import json
+import time
+import uuid
+import os
+import typer
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from database import SessionLocal, engine, shard_session
+from models import Job, User
+import product_sales
+import reconciliation
+import sharding
+import mailer
+import bulk
+
+# File de tâches durable : les routes enregistrent un job (réponse 202) que
+# les workers (python jobs.py work) exécutent. PostgreSQL : SELECT ... FOR
+# UPDATE SKIP LOCKED, chaque worker prend un job différent sans attendre ;
+# SQLite : un verrou de fichier sérialise la prise de job.
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "10"))  # Doublé à chaque échec
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "3600"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))  # secondes sans job avant de réessayer
+JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "5"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))  # Sans battement : worker perdu, job repris
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+JOB_TENANT_MOVE_DELAY = float(os.getenv("JOB_TENANT_MOVE_DELAY", "30"))  # Tenant en cours de déplacement
+JOB_LOCK_FILE = os.getenv(
+    "JOB_LOCK_FILE",
+    os.path.join(tempfile.gettempdir(), "invoiceflow-jobs.lock")
+)
+
+class JobError(Exception):
+    """Permanent failure: the job is not retried"""
+
+class LeaseLost(Exception):
+    """The job was taken back from this worker (heartbeat missed)"""
+
+HANDLERS = {}
+
+def handler(kind: str):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+def enqueue(db: Session, kind: str, params: dict, user_id: str = None,
+            max_attempts: int = JOB_MAX_ATTEMPTS, run_after: datetime = None) -> Job:
+    """Add a job to the queue (caller commits)"""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind}")
+    job = Job(
+        kind=kind,
+        params=json.dumps(params, default=str),
+        user_id=user_id,
+        max_attempts=max_attempts,
+        run_after=run_after or datetime.utcnow()
+    )
+    db.add(job)
+    return job
+
+def describe(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "progress_done": job.progress_done,
+        "progress_total": job.progress_total,
+        "progress_message": job.progress_message,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "run_after": job.run_after,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+def retry_delay(attempts: int) -> float:
+    # Exponentiel plafonné, avec gigue : les jobs d'une même panne ne
+    # reviennent pas tous ensemble
+    delay = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+# ============ DEQUEUE ============
+@contextmanager
+def _dequeue_lock():
+    fd = os.open(JOB_LOCK_FILE, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+def claim(worker_id: str, kinds: list = None, now: datetime = None):
+    """Take the next ready job; returns a detached snapshot or None"""
+    now = now or datetime.utcnow()
+    query = select(Job).where(Job.status == "queued", Job.run_after <= now)
+    if kinds:
+        query = query.where(Job.kind.in_(kinds))
+    query = query.order_by(Job.run_after).limit(1)
+
+    db = SessionLocal()
+    try:
+        if engine.dialect.name == "postgresql":
+            job = db.execute(query.with_for_update(skip_locked=True)).scalar_one_or_none()
+            return _start(db, job, worker_id, now)
+        with _dequeue_lock():
+            job = db.execute(query).scalar_one_or_none()
+            return _start(db, job, worker_id, now)
+    finally:
+        db.close()
+
+def _start(db: Session, job: Job, worker_id: str, now: datetime):
+    if job is None:
+        db.rollback()
+        return None
+    job.status = "running"
+    job.attempts += 1
+    job.locked_by = worker_id
+    job.heartbeat_at = now
+    job.started_at = job.started_at or now
+    snapshot = {
+        "id": job.id,
+        "kind": job.kind,
+        "params": json.loads(job.params or "{}"),
+        "user_id": job.user_id,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+    }
+    db.commit()
+    return snapshot
+
+def _update_owned(job_id: str, worker_id: str, **values) -> bool:
+    # Gardé par locked_by : un job repris par un autre worker n'est pas écrasé
+    with engine.begin() as conn:
+        return conn.execute(update(Job.__table__).where(
+            Job.__table__.c.id == job_id,
+            Job.__table__.c.locked_by == worker_id
+        ).values(**values)).rowcount > 0
+
+def requeue_stale(now: datetime = None) -> int:
+    """Give back running jobs whose worker stopped heart-beating"""
+    now = now or datetime.utcnow()
+    jobs = Job.__table__
+    stale = (jobs.c.status == "running", jobs.c.heartbeat_at < now - timedelta(seconds=JOB_LEASE_SECONDS))
+    with engine.begin() as conn:
+        failed = conn.execute(update(jobs).where(*stale, jobs.c.attempts >= jobs.c.max_attempts).values(
+            status="failed", error="Worker lost", locked_by=None, finished_at=now
+        )).rowcount
+        requeued = conn.execute(update(jobs).where(*stale).values(
+            status="queued", locked_by=None, run_after=now
+        )).rowcount
+    if failed or requeued:
+        logger.warning(f"Stale jobs: {requeued} requeued, {failed} failed")
+    return requeued
+
+# ============ EXECUTION ============
+class JobContext:
+    """Handed to handlers: the tenant's session and progress reporting"""
+
+    def __init__(self, job: dict, worker_id: str, db: Session):
+        self.job_id = job["id"]
+        self.user_id = job["user_id"]
+        self.attempt = job["attempts"]
+        self.max_attempts = job["max_attempts"]
+        self.worker_id = worker_id
+        self.db = db
+        self.progress_done = 0
+        self.progress_total = None
+        self.progress_message = None
+        self.lost = False
+
+    def progress(self, done: int, total: int = None, message: str = None):
+        # En mémoire : le battement de cœur du worker l'écrit en base, sans
+        # attendre la transaction du handler (SQLite n'a qu'un écrivain)
+        if self.lost:
+            raise LeaseLost(self.job_id)
+        self.progress_done = done
+        if total is not None:
+            self.progress_total = total
+        if message is not None:
+            self.progress_message = message[:200]
+
+def execute(job: dict, worker_id: str, active: dict = None):
+    now = datetime.utcnow()
+    db = None
+    try:
+        shard = None
+        if job["user_id"]:
+            with engine.connect() as conn:
+                user = conn.execute(select(User.__table__.c.shard, User.__table__.c.shard_state).where(
+                    User.__table__.c.id == job["user_id"]
+                )).first()
+            if user is None:
+                raise JobError("Unknown user")
+            if user.shard_state == "moving":
+                raise sharding.TenantMoving(job["user_id"])
+            shard = user.shard
+
+        if job["kind"] not in HANDLERS:
+            raise JobError(f"Unknown job kind {job['kind']}")
+        db = shard_session(shard)
+        if job["user_id"]:
+            # Déplacement commencé pendant le job : ses commits sont refusés
+            sharding.fence_session(db, job["user_id"])
+        context = JobContext(job, worker_id, db)
+        if active is not None:
+            active[job["id"]] = context
+        result = HANDLERS[job["kind"]](context, **job["params"])
+        _update_owned(
+            job["id"], worker_id, status="succeeded", result=json.dumps(result, default=str), error=None,
+            locked_by=None, finished_at=datetime.utcnow(),
+            progress_done=context.progress_total or context.progress_done, progress_total=context.progress_total
+        )
+    except LeaseLost:
+        logger.warning(f"Job {job['id']} taken back from {worker_id}")
+    except sharding.TenantMoving:
+        if db is not None:
+            db.rollback()
+        # Pas une tentative : le tenant sera disponible après le déplacement
+        _update_owned(job["id"], worker_id, status="queued", locked_by=None, attempts=job["attempts"] - 1,
+                      run_after=now + timedelta(seconds=JOB_TENANT_MOVE_DELAY))
+    except Exception as e:
+        if db is not None:
+            db.rollback()
+        permanent = isinstance(e, JobError) or job["attempts"] >= job["max_attempts"]
+        if permanent:
+            logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+            _update_owned(job["id"], worker_id, status="failed", error=str(e)[:2000], locked_by=None,
+                          finished_at=datetime.utcnow())
+        else:
+            delay = retry_delay(job["attempts"])
+            logger.warning(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed, retry in {delay:.0f}s: {e}")
+            _update_owned(job["id"], worker_id, status="queued", error=str(e)[:2000], locked_by=None,
+                          run_after=datetime.utcnow() + timedelta(seconds=delay))
+    finally:
+        if active is not None:
+            active.pop(job["id"], None)
+        if db is not None:
+            db.close()
+
+class Worker:
+    """Thread pool taking jobs from the queue, with a heartbeat for running ones"""
+
+    def __init__(self, concurrency: int = JOB_WORKER_CONCURRENCY, kinds: list = None,
+                 poll_interval: float = JOB_POLL_INTERVAL):
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.kinds = kinds
+        self.poll_interval = poll_interval
+        self.active = {}
+        self._stop = threading.Event()
+        self._reaped_at = 0.0
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def run(self):
+        threads = [threading.Thread(target=self._loop, args=(index,), name=f"job-worker-{index}")
+                   for index in range(self.concurrency)]
+        threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for thread in threads:
+            thread.start()
+        # Arrêt gracieux : plus de nouveau job, les jobs en cours se terminent
+        for thread in threads[:-1]:
+            thread.join()
+
+    def _loop(self, index: int):
+        worker_id = f"{self.id}/{index}"
+        while not self._stop.is_set():
+            try:
+                job = claim(worker_id, self.kinds)
+                if job is None:
+                    if time.monotonic() - self._reaped_at >= JOB_HEARTBEAT_INTERVAL:
+                        self._reaped_at = time.monotonic()
+                        requeue_stale()
+                    self._stop.wait(self.poll_interval)
+                    continue
+                execute(job, worker_id, self.active)
+            except Exception as e:
+                # Base indisponible : on réessaie au prochain tour
+                logger.error(f"Job worker {worker_id}: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _heartbeat(self):
+        # Démon : tourne jusqu'à la fin du processus, donc des derniers jobs
+        while True:
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+            for context in list(self.active.values()):
+                try:
+                    alive = _update_owned(
+                        context.job_id, context.worker_id, heartbeat_at=datetime.utcnow(),
+                        progress_done=context.progress_done, progress_total=context.progress_total,
+                        progress_message=context.progress_message
+                    )
+                    context.lost = not alive
+                except Exception as e:
+                    logger.warning(f"Heartbeat for job {context.job_id} failed: {e}")
+
+# ============ HANDLERS ============
+@handler("product_report")
+def product_report_job(context: JobContext, date_from: str, date_to: str, limit: int = 50):
+    return product_sales.product_report(
+        context.db, context.user_id, datetime.fromisoformat(date_from), datetime.fromisoformat(date_to), limit
+    )
+
+@handler("product_sales_refresh")
+def product_sales_refresh_job(context: JobContext):
+    return {"months_aggregated": product_sales.refresh_tenant(context.db, context.user_id)}
+
+@handler("bank_confirm")
+def bank_confirm_job(context: JobContext, matches: list):
+    try:
+        created = reconciliation.confirm_matches(context.db, context.user_id, matches, context.progress)
+    except reconciliation.ReconciliationError as e:
+        raise JobError(e.detail)
+    payment_ids = [payment.id for payment in created]
+    context.db.commit()
+    return {"payments": payment_ids}
+
+@handler("bulk_invoice_status")
+def bulk_invoice_status_job(context: JobContext, status: str, ids: list = None, filters: dict = None,
+                            send_email: bool = True):
+    user = context.db.query(User).filter(User.id == context.user_id).first()
+    try:
+        return bulk.set_invoice_status_in_chunks(
+            context.db, user, status, ids, filters, send_email, context.progress
+        )
+    except bulk.BulkError as e:
+        raise JobError(e.detail)
+
+@handler("send_email")
+def send_email_job(context: JobContext, email_id: str):
+    try:
+        return mailer.deliver(context.db, email_id, context.attempt >= context.max_attempts)
+    except mailer.Bounced as e:
+        raise JobError(str(e))
+
+app = typer.Typer(help="Background job queue")
+
+@app.command()
+def work(
+    concurrency: int = typer.Option(JOB_WORKER_CONCURRENCY, help="Jobs run in parallel by this process"),
+    kinds: str = typer.Option("", help="Comma-separated job kinds to take (default: all)"),
+    poll_interval: float = typer.Option(JOB_POLL_INTERVAL, help="Seconds to wait when the queue is empty"),
+):
+    """Run jobs until SIGTERM/SIGINT, then finish the running ones"""
+    worker = Worker(concurrency, [kind.strip() for kind in kinds.split(",") if kind.strip()] or None, poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    logger.info(f"Job worker {worker.id}: {concurrency} threads, kinds {worker.kinds or 'all'}")
+    worker.run()
+    mailer.pool.close()
+
+@app.command()
+def stats():
+    """Jobs per kind and status"""
+    with engine.connect() as conn:
+        rows = conn.execute(select(Job.kind, Job.status, func.count()).group_by(Job.kind, Job.status)).all()
+    for kind, status, count in sorted(rows):
+        typer.echo(f"{kind:24} {status:10} {count:>8,}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    app()
@@ -0,0 +1,404 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, update
+from email.message import EmailMessage
+from email.utils import make_msgid, formataddr, formatdate
+from email import message_from_binary_file, policy
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from html import escape
+from dotenv import load_dotenv
+import threading
+import smtplib
+import logging
+import json
+import ssl
+import sys
+import time
+import os
+import typer
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from database import shard_session, shard_names
+from models import OutboundEmail, Activity, Job, generate_uuid
+
+# Envoi des factures et devis par email : le message est rendu une fois,
+# quand le document passe à "Envoyé", et stocké dans outbound_emails ; un job
+# send_email par message le remet via un pool de connexions SMTP réutilisées
+# (python jobs.py work --kinds send_email), avec reprises sur les erreurs 4xx.
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EMAIL_ENABLED = os.getenv("EMAIL_ENABLED", "false").lower() == "true"
+EMAIL_FROM = os.getenv("EMAIL_FROM", "factures@invoiceflow.fr")
+EMAIL_BOUNCE_ADDRESS = os.getenv("EMAIL_BOUNCE_ADDRESS", "") or EMAIL_FROM  # Enveloppe : reçoit les avis de non-distribution
+EMAIL_SMTP_HOST = os.getenv("EMAIL_SMTP_HOST", "localhost")
+EMAIL_SMTP_PORT = int(os.getenv("EMAIL_SMTP_PORT", "587"))
+EMAIL_SMTP_USERNAME = os.getenv("EMAIL_SMTP_USERNAME", "")
+EMAIL_SMTP_PASSWORD = os.getenv("EMAIL_SMTP_PASSWORD", "")
+EMAIL_SMTP_SECURITY = os.getenv("EMAIL_SMTP_SECURITY", "starttls").lower()  # starttls, ssl, none
+EMAIL_SMTP_TIMEOUT = float(os.getenv("EMAIL_SMTP_TIMEOUT", "30"))
+EMAIL_SMTP_POOL_SIZE = int(os.getenv("EMAIL_SMTP_POOL_SIZE", "4"))  # Connexions par worker
+EMAIL_SMTP_MAX_MESSAGES = int(os.getenv("EMAIL_SMTP_MAX_MESSAGES", "100"))  # Par connexion, puis reconnexion
+EMAIL_SMTP_IDLE_SECONDS = float(os.getenv("EMAIL_SMTP_IDLE_SECONDS", "30"))  # Au-delà, le serveur a pu couper
+EMAIL_DOMAIN_CONCURRENCY = int(os.getenv("EMAIL_DOMAIN_CONCURRENCY", "2"))  # Envois simultanés par domaine destinataire
+EMAIL_DOMAIN_WAIT_SECONDS = float(os.getenv("EMAIL_DOMAIN_WAIT_SECONDS", "30"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+
+DOCUMENT_LABELS = {"invoice": "Facture", "quote": "Devis"}
+
+class Bounced(Exception):
+    """Permanent rejection (5xx): the message is not retried"""
+
+# ============ RENDERING ============
+def _euros(amount: float) -> str:
+    return f"{amount or 0:,.2f} €".replace(",", " ").replace(".", ",")
+
+def _day(date: datetime) -> str:
+    return date.strftime("%d/%m/%Y") if date else ""
+
+def document_fields(document_type: str, document) -> dict:
+    """Fields rendered in the email, from an Invoice or a Quote"""
+    is_invoice = document_type == "invoice"
+    return {
+        "id": document.id,
+        "user_id": document.user_id,
+        "number": document.invoice_number if is_invoice else document.quote_number,
+        "date": document.date,
+        "due_date": document.due_date if is_invoice else document.expiry_date,
+        "amount": document.amount,
+        "tax_amount": document.tax_amount,
+        "notes": document.notes,
+        "payment_terms": document.payment_terms if is_invoice else None,
+    }
+
+def render(document_type: str, document: dict, items: list, client, sender):
+    """Subject, plain text and HTML bodies"""
+    label = DOCUMENT_LABELS[document_type]
+    sender_name = sender.company_name or sender.name
+    subject = f"{label} {document['number']} - {sender_name}"
+    total = (document["amount"] or 0) + (document["tax_amount"] or 0)
+    if document_type == "invoice":
+        due = f"Échéance : {_day(document['due_date'])}" if document["due_date"] else None
+    else:
+        due = f"Devis valable jusqu'au {_day(document['due_date'])}" if document["due_date"] else None
+    lines = [(item.description, item.quantity, item.price, item.quantity * item.price) for item in items]
+    footer = [text for text in (due, document["payment_terms"], document["notes"]) if text]
+
+    body_text = "\n".join([
+        f"Bonjour {client.name},",
+        "",
+        f"Veuillez trouver ci-dessous votre {label.lower()} {document['number']} du {_day(document['date'])}.",
+        "",
+        *[f"  - {description} : {quantity:g} x {_euros(price)} = {_euros(line_total)}"
+          for description, quantity, price, line_total in lines],
+        "",
+        f"Total HT : {_euros(document['amount'])}",
+        f"TVA : {_euros(document['tax_amount'])}",
+        f"Total TTC : {_euros(total)}",
+        "",
+        *footer,
+        *([""] if footer else []),
+        "Cordialement,",
+        sender_name,
+    ])
+    rows = "".join(
+        f"<tr><td>{escape(description)}</td><td align=\"right\">{quantity:g}</td>"
+        f"<td align=\"right\">{_euros(price)}</td><td align=\"right\">{_euros(line_total)}</td></tr>"
+        for description, quantity, price, line_total in lines
+    )
+    body_html = (
+        f"<p>Bonjour {escape(client.name)},</p>"
+        f"<p>Veuillez trouver ci-dessous votre {label.lower()} <strong>{escape(document['number'])}</strong> du {_day(document['date'])}.</p>"
+        f"<table cellpadding=\"4\"><tr><th align=\"left\">Désignation</th><th>Qté</th><th>Prix unitaire</th><th>Total HT</th></tr>{rows}</table>"
+        f"<p>Total HT : {_euros(document['amount'])}<br>TVA : {_euros(document['tax_amount'])}<br>"
+        f"<strong>Total TTC : {_euros(total)}</strong></p>"
+        + "".join(f"<p>{escape(text)}</p>" for text in footer)
+        + f"<p>Cordialement,<br>{escape(sender_name)}</p>"
+    )
+    return subject, body_text, body_html
+
+def prepare(document_type: str, document: dict, items: list, client, sender):
+    """outbound_emails row for a document being sent, or None (disabled, no address)"""
+    if not EMAIL_ENABLED or client is None or "@" not in (client.email or ""):
+        return None
+    subject, body_text, body_html = render(document_type, document, items, client, sender)
+    return {
+        "id": generate_uuid(),
+        "user_id": document["user_id"],
+        "document_type": document_type,
+        "document_id": document["id"],
+        "document_number": document["number"],
+        "recipient": client.email.strip(),
+        "sender_name": sender.company_name or sender.name,
+        "reply_to": sender.email,
+        "subject": subject,
+        "body_text": body_text,
+        "body_html": body_html,
+        "message_id": make_msgid(domain=EMAIL_FROM.rsplit("@", 1)[-1]),
+        "status": "queued",
+        "attempts": 0,
+        "created_at": datetime.utcnow(),
+    }
+
+def queue(db: Session, rows: list) -> int:
+    """Store prepared emails and one send_email job each (caller commits)"""
+    rows = [row for row in rows if row]
+    if not rows:
+        return 0
+    now = datetime.utcnow()
+    db.execute(insert(OutboundEmail), rows)
+    # Les jobs vont sur la base principale (table globale)
+    db.execute(insert(Job), [{
+        "id": generate_uuid(),
+        "kind": "send_email",
+        "params": json.dumps({"email_id": row["id"]}),
+        "user_id": row["user_id"],
+        "max_attempts": EMAIL_MAX_ATTEMPTS,
+        "run_after": now,
+        "created_at": now,
+    } for row in rows])
+    return len(rows)
+
+def build_message(email: OutboundEmail) -> EmailMessage:
+    message = EmailMessage()
+    message["Subject"] = email.subject
+    message["From"] = formataddr((email.sender_name, EMAIL_FROM))
+    message["To"] = email.recipient
+    if email.reply_to:
+        message["Reply-To"] = email.reply_to
+    message["Date"] = formatdate(localtime=True)
+    message["Message-ID"] = email.message_id
+    message.set_content(email.body_text)
+    message.add_alternative(email.body_html, subtype="html")
+    return message
+
+# ============ SMTP ============
+class SMTPPool:
+    """SMTP connections kept open between messages, shared by a worker's threads"""
+
+    def __init__(self, size: int = EMAIL_SMTP_POOL_SIZE):
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []  # (connexion, messages envoyés, inactive depuis)
+
+    def _connect(self) -> smtplib.SMTP:
+        if EMAIL_SMTP_SECURITY == "ssl":
+            smtp = smtplib.SMTP_SSL(EMAIL_SMTP_HOST, EMAIL_SMTP_PORT, timeout=EMAIL_SMTP_TIMEOUT,
+                                    context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(EMAIL_SMTP_HOST, EMAIL_SMTP_PORT, timeout=EMAIL_SMTP_TIMEOUT)
+            if EMAIL_SMTP_SECURITY == "starttls":
+                smtp.starttls(context=ssl.create_default_context())
+        if EMAIL_SMTP_USERNAME:
+            smtp.login(EMAIL_SMTP_USERNAME, EMAIL_SMTP_PASSWORD)
+        return smtp
+
+    def _checkout(self):
+        expired = []
+        connection = None
+        with self._lock:
+            while self._idle:
+                smtp, sent, idle_since = self._idle.pop()
+                if time.monotonic() - idle_since < EMAIL_SMTP_IDLE_SECONDS:
+                    connection = (smtp, sent)
+                    break
+                expired.append(smtp)
+        for smtp in expired:
+            _close(smtp)
+        return connection
+
+    def _checkin(self, smtp: smtplib.SMTP, sent: int):
+        if sent >= EMAIL_SMTP_MAX_MESSAGES:
+            _close(smtp)
+            return
+        with self._lock:
+            self._idle.append((smtp, sent, time.monotonic()))
+
+    def send(self, message: EmailMessage, sender: str, recipients: list):
+        with self._slots:
+            connection = self._checkout()
+            reused = connection is not None
+            smtp, sent = connection or (self._connect(), 0)
+            try:
+                try:
+                    smtp.send_message(message, sender, recipients)
+                except smtplib.SMTPServerDisconnected:
+                    if not reused:
+                        raise
+                    # Fermée par le serveur pendant l'inactivité : une nouvelle connexion
+                    _close(smtp)
+                    smtp, sent = self._connect(), 0
+                    smtp.send_message(message, sender, recipients)
+            except smtplib.SMTPServerDisconnected:
+                _close(smtp)
+                raise
+            except smtplib.SMTPException:
+                # Message refusé : la session reste utilisable (smtplib a envoyé RSET)
+                self._checkin(smtp, sent)
+                raise
+            except OSError:
+                _close(smtp)
+                raise
+            self._checkin(smtp, sent + 1)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _, _ in idle:
+            _close(smtp)
+
+def _close(smtp: smtplib.SMTP):
+    try:
+        smtp.quit()
+    except Exception:
+        smtp.close()
+
+pool = SMTPPool()
+
+_domain_slots = {}
+_domain_lock = threading.Lock()
+
+@contextmanager
+def domain_slot(domain: str):
+    # Limite par domaine destinataire : les gros fournisseurs ralentissent
+    # ou refusent un expéditeur qui ouvre trop de sessions à la fois
+    with _domain_lock:
+        slot = _domain_slots.setdefault(domain, threading.BoundedSemaphore(EMAIL_DOMAIN_CONCURRENCY))
+    if not slot.acquire(timeout=EMAIL_DOMAIN_WAIT_SECONDS):
+        raise TimeoutError(f"Too many concurrent deliveries to {domain}")
+    try:
+        yield
+    finally:
+        slot.release()
+
+# ============ DELIVERY ============
+def _smtp_error(e: Exception) -> str:
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        code, reply = next(iter(e.recipients.values()))
+        return f"{code} {reply.decode(errors='replace') if isinstance(reply, bytes) else reply}"
+    if isinstance(e, smtplib.SMTPResponseException):
+        error = e.smtp_error.decode(errors="replace") if isinstance(e.smtp_error, bytes) else e.smtp_error
+        return f"{e.smtp_code} {error}"
+    return str(e) or e.__class__.__name__
+
+def _is_bounce(e: Exception) -> bool:
+    # 5xx sur le destinataire ou le contenu ; un refus de l'expéditeur est
+    # un problème de configuration, repris comme une erreur temporaire
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in e.recipients.values())
+    return isinstance(e, smtplib.SMTPDataError) and e.smtp_code >= 500
+
+def _bounce_activity(email: OutboundEmail, now: datetime) -> dict:
+    return {
+        "user_id": email.user_id,
+        "description": f"Email {DOCUMENT_LABELS.get(email.document_type, '')} {email.document_number} non distribué à {email.recipient}",
+        "activity_type": email.document_type,
+        "related_id": email.document_id,
+        "created_at": now,
+    }
+
+def deliver(db: Session, email_id: str, final_attempt: bool = False) -> dict:
+    """Send one queued email; raises Bounced on a permanent rejection"""
+    email = db.get(OutboundEmail, email_id)
+    if email is None:
+        # Job validé avant la ligne (autre base) : repris plus tard
+        raise LookupError(f"Email {email_id} not found")
+    if email.status != "queued":
+        return {"status": email.status}
+    message = build_message(email)
+    recipient, domain = email.recipient, email.recipient.rsplit("@", 1)[-1].lower()
+    email.attempts += 1
+    # Pas de transaction ouverte pendant la session SMTP
+    db.commit()
+
+    try:
+        with domain_slot(domain):
+            pool.send(message, EMAIL_BOUNCE_ADDRESS, [recipient])
+    except Exception as e:
+        now = datetime.utcnow()
+        email.error = _smtp_error(e)[:2000]
+        if _is_bounce(e):
+            email.status = "bounced"
+            email.bounced_at = now
+            db.execute(insert(Activity), [_bounce_activity(email, now)])
+            db.commit()
+            raise Bounced(email.error)
+        if final_attempt:
+            email.status = "failed"
+        db.commit()
+        raise RuntimeError(email.error) from e
+
+    email.status = "sent"
+    email.sent_at = datetime.utcnow()
+    email.error = None
+    db.commit()
+    return {"status": "sent", "recipient": recipient, "message_id": email.message_id}
+
+# ============ BOUNCES ============
+def original_message_id(report) -> str:
+    """Message-ID of the returned message in a delivery status notification"""
+    for part in report.walk():
+        if part.get_content_type() == "message/rfc822":
+            payload = part.get_payload()
+            returned = payload[0] if isinstance(payload, list) else payload
+            if returned.get("Message-ID"):
+                return returned["Message-ID"].strip()
+        elif part.get_content_type() == "text/rfc822-headers":
+            for line in part.get_payload(decode=True).decode(errors="replace").splitlines():
+                if line.lower().startswith("message-id:"):
+                    return line.split(":", 1)[1].strip()
+    return None
+
+def record_bounce(message_id: str, reason: str = None) -> bool:
+    """Mark a sent email bounced after an asynchronous non-delivery report"""
+    now = datetime.utcnow()
+    for shard in shard_names():
+        db = shard_session(shard)
+        try:
+            email = db.query(OutboundEmail).filter(OutboundEmail.message_id == message_id).first()
+            if email is None:
+                continue
+            if email.status != "bounced":
+                db.execute(update(OutboundEmail).where(OutboundEmail.id == email.id).values(
+                    status="bounced", bounced_at=now, error=(reason or "Bounced")[:2000]
+                ))
+                db.execute(insert(Activity), [_bounce_activity(email, now)])
+                db.commit()
+            return True
+        finally:
+            db.close()
+    return False
+
+app = typer.Typer(help="Outbound email")
+
+@app.command()
+def bounce():
+    """Read a bounce report (DSN) on stdin, e.g. piped from the bounce mailbox alias"""
+    report = message_from_binary_file(sys.stdin.buffer, policy=policy.default)
+    message_id = original_message_id(report)
+    if message_id is None:
+        typer.echo("No original Message-ID in the report", err=True)
+        raise typer.Exit(1)
+    found = record_bounce(message_id, str(report.get("Subject", "")) or None)
+    typer.echo(f"{message_id}: {'bounced' if found else 'unknown'}")
+
+@app.command()
+def test(recipient: str):
+    """Send a test message with the current SMTP settings"""
+    message = EmailMessage()
+    message["Subject"] = "InvoiceFlow - test SMTP"
+    message["From"] = EMAIL_FROM
+    message["To"] = recipient
+    message["Message-ID"] = make_msgid(domain=EMAIL_FROM.rsplit("@", 1)[-1])
+    message.set_content("Configuration SMTP valide.")
+    pool.send(message, EMAIL_BOUNCE_ADDRESS, [recipient])
+    pool.close()
+    typer.echo(f"Sent to {recipient} via {EMAIL_SMTP_HOST}:{EMAIL_SMTP_PORT}")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    app()
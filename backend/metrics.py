@@ -0,0 +1,199 @@
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from contextvars import ContextVar
+from bisect import bisect_left
+import threading
+import time
+
+# Prometheus text exposition format, kept dependency-free. Values are per
+# process: scrape each worker (or aggregate by instance label).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def collect(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self.header()
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            # Compteurs par intervalle, cumulés seulement à l'export
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self) -> list:
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._values.items())
+        lines = self.header()
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route, method and status code.", ("method", "route", "status")))
+http_request_duration_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency in seconds.", ("method", "route")))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served."))
+db_statements_per_request = registry.register(Histogram(
+    "db_statements_per_request", "SQL statements executed per HTTP request.", ("method", "route"), COUNT_BUCKETS))
+db_time_per_request_seconds = registry.register(Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL per HTTP request, in seconds.", ("method", "route"), LATENCY_BUCKETS))
+db_statement_duration_seconds = registry.register(Histogram(
+    "db_statement_duration_seconds", "SQL statement latency in seconds.", (), QUERY_BUCKETS))
+db_pool_connections = registry.register(Gauge(
+    "db_pool_connections", "Connection pool state by engine (primary, replica-N, shard-NAME) and kind "
+    "(size, checked_out, overflow, checked_in).", ("engine", "state")))
+
+class RequestStats:
+    __slots__ = ("route", "statements", "db_time")
+
+    def __init__(self, route: str = None):
+        self.route = route
+        self.statements = 0
+        self.db_time = 0.0
+
+# Statistiques SQL de la requête HTTP en cours (objet mutable partagé avec
+# les threads du threadpool, qui reçoivent une copie du contexte)
+current_request: ContextVar = ContextVar("current_request", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    db_statement_duration_seconds.observe(elapsed)
+    stats = current_request.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+def instrument_engine(engine: Engine, name: str = "primary"):
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    def collect_pool_stats():
+        pool = engine.pool
+        for state, reader in (("size", "size"), ("checked_out", "checkedout"),
+                              ("overflow", "overflow"), ("checked_in", "checkedin")):
+            if hasattr(pool, reader):
+                db_pool_connections.set(getattr(pool, reader)(), name, state)
+
+    registry.collectors.append(collect_pool_stats)
+
+def route_template(request: Request) -> str:
+    # Le gabarit de route (/api/invoices/{invoice_id}) borne la cardinalité
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+async def metrics_middleware(request: Request, call_next):
+    stats = RequestStats(request.url.path)
+    token = current_request.set(stats)
+    http_requests_in_flight.inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        http_requests_in_flight.dec()
+        current_request.reset(token)
+        route = route_template(request)
+        stats.route = route
+        http_requests_total.inc(request.method, route, str(status_code))
+        http_request_duration_seconds.observe(elapsed, request.method, route)
+        db_statements_per_request.observe(stats.statements, request.method, route)
+        db_time_per_request_seconds.observe(stats.db_time, request.method, route)
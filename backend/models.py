@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, ForeignKey, Text, Boolean, Index, Identity, DDL, event, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import uuid
@@ -7,6 +7,20 @@ from database import Base
 def generate_uuid():
     return str(uuid.uuid4())
 
+def trigram_index(name: str, column: str) -> Index:
+    # Index GIN pg_trgm pour l'autocomplétion (ignoré hors PostgreSQL)
+    return Index(
+        name, column,
+        postgresql_using="gin",
+        postgresql_ops={column: "gin_trgm_ops"}
+    ).ddl_if(dialect="postgresql")
+
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+)
+
 class User(Base):
     __tablename__ = "users"
     
@@ -20,6 +34,8 @@ class User(Base):
     address = Column(Text)
     phone = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
+    shard = Column(String, nullable=True)  # NULL = base principale (voir SHARD_URLS)
+    shard_state = Column(String, nullable=True)  # "moving" pendant un déplacement de tenant
     
     # Relations
     clients = relationship("Client", back_populates="user")
@@ -28,9 +44,15 @@ class User(Base):
     activities = relationship("Activity", back_populates="user")
     expenses = relationship("Expense", back_populates="user")
     products = relationship("Product", back_populates="user")
+    recurring_invoices = relationship("RecurringInvoice", back_populates="user")
 
 class Client(Base):
     __tablename__ = "clients"
+    __table_args__ = (
+        trigram_index("ix_clients_name_trgm", "name"),
+        trigram_index("ix_clients_email_trgm", "email"),
+        trigram_index("ix_clients_siret_trgm", "siret"),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     name = Column(String, nullable=False)
@@ -41,7 +63,8 @@ class Client(Base):
     siret = Column(String)
     contact_person = Column(String)
     notes = Column(Text)
-    user_id = Column(String, ForeignKey("users.id"))
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))  # ETag / If-Match
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relations
@@ -51,6 +74,10 @@ class Client(Base):
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        trigram_index("ix_products_name_trgm", "name"),
+        trigram_index("ix_products_category_trgm", "category"),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     name = Column(String, nullable=False)
@@ -59,7 +86,9 @@ class Product(Base):
     unit = Column(String, default="pièce")  # pièce, heure, jour, etc.
     category = Column(String)
     is_service = Column(Boolean, default=False)
-    user_id = Column(String, ForeignKey("users.id"))
+    cost = Column(Float, nullable=True)  # Coût unitaire (marge des rapports)
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))  # ETag / If-Match
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relations
@@ -67,6 +96,9 @@ class Product(Base):
 
 class Expense(Base):
     __tablename__ = "expenses"
+    __table_args__ = (
+        Index("ix_expenses_client_expense_date", "client_id", "expense_date"),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     title = Column(String, nullable=False)
@@ -74,11 +106,14 @@ class Expense(Base):
     amount = Column(Float, nullable=False)
     category = Column(String, nullable=False)  # Transport, Repas, Matériel, etc.
     expense_date = Column(DateTime, default=datetime.utcnow)
-    receipt_path = Column(String)  # Chemin vers le justificatif
+    receipt_path = Column(String)  # Chemin vers le justificatif (adresse SHA-256 sous RECEIPTS_DIR)
+    receipt_content_type = Column(String, nullable=True)
+    receipt_filename = Column(String, nullable=True)  # Nom d'origine du fichier envoyé
     is_billable = Column(Boolean, default=False)  # Refacturable au client
     client_id = Column(String, ForeignKey("clients.id"), nullable=True)
     status = Column(String, default="En attente")  # En attente, Approuvé, Refusé
     user_id = Column(String, ForeignKey("users.id"))
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))  # ETag / If-Match
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relations
@@ -87,6 +122,15 @@ class Expense(Base):
 
 class Invoice(Base):
     __tablename__ = "invoices"
+    __table_args__ = (
+        Index("ix_invoices_status_due_date", "status", "due_date"),
+        Index("uq_invoices_recurring_period", "recurring_id", "recurring_period", unique=True),
+        # Balance âgée : client et solde restant en fin de clé, parcours d'index seul
+        Index("ix_invoices_user_status_due_date", "user_id", "status", "due_date", "client_id", "balance_due"),
+        # Dashboard : totaux par statut et fenêtre des deux dernières périodes
+        Index("ix_invoices_user_status_date", "user_id", "status", "date", "balance_due"),
+        Index("ix_invoices_client_date", "client_id", "date"),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     invoice_number = Column(String, unique=True, nullable=False)
@@ -97,25 +141,33 @@ class Invoice(Base):
     amount = Column(Float, nullable=False)
     tax_amount = Column(Float, default=0.0)
     discount = Column(Float, default=0.0)
+    # Tenus à jour avec la table payments, dans la même transaction
+    amount_paid = Column(Float, nullable=False, default=0.0, server_default=text("0"))
+    balance_due = Column(Float, nullable=True)  # amount - amount_paid (rempli par init_db pour l'existant)
     status = Column(String, default="Brouillon")  # Brouillon, Envoyé, Payé, En retard, Annulé
     description = Column(Text)
     notes = Column(Text)
     payment_terms = Column(String)
     quote_id = Column(String, ForeignKey("quotes.id"), nullable=True)  # Si créé depuis un devis
+    recurring_id = Column(String, ForeignKey("recurring_invoices.id"), nullable=True)  # Si générée par un abonnement
+    recurring_period = Column(DateTime, nullable=True)  # Période facturée (idempotence)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))  # ETag / If-Match
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relations
     user = relationship("User", back_populates="invoices")
     client = relationship("Client", back_populates="invoices")
     items = relationship("InvoiceItem", back_populates="invoice")
+    payments = relationship("Payment", back_populates="invoice")
     quote = relationship("Quote")
+    recurring = relationship("RecurringInvoice")
 
 class InvoiceItem(Base):
     __tablename__ = "invoice_items"
     
     id = Column(String, primary_key=True, default=generate_uuid)
-    invoice_id = Column(String, ForeignKey("invoices.id"))
-    product_id = Column(String, ForeignKey("products.id"), nullable=True)
+    invoice_id = Column(String, ForeignKey("invoices.id"), index=True)
+    product_id = Column(String, ForeignKey("products.id"), nullable=True, index=True)
     description = Column(String, nullable=False)
     quantity = Column(Float, default=1)
     price = Column(Float, nullable=False)
@@ -126,8 +178,98 @@ class InvoiceItem(Base):
     invoice = relationship("Invoice", back_populates="items")
     product = relationship("Product")
 
+class Payment(Base):
+    __tablename__ = "payments"
+    __table_args__ = (
+        # Encaissements par période et par client (chiffre d'affaires, trésorerie) : parcours d'index seul
+        Index("ix_payments_user_payment_date", "user_id", "payment_date", "client_id", "amount"),
+        Index("ix_payments_client_payment_date", "client_id", "payment_date"),
+    )
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    invoice_id = Column(String, ForeignKey("invoices.id"), index=True, nullable=False)
+    client_id = Column(String, ForeignKey("clients.id"))  # Copié de la facture (relevés, top clients)
+    user_id = Column(String, ForeignKey("users.id"))
+    amount = Column(Float, nullable=False)
+    payment_date = Column(DateTime, default=datetime.utcnow)
+    method = Column(String)  # Virement, Chèque, Carte, Espèces, Prélèvement
+    reference = Column(String)
+    notes = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relations
+    invoice = relationship("Invoice", back_populates="payments")
+
+class BankTransaction(Base):
+    __tablename__ = "bank_transactions"
+    __table_args__ = (
+        # Une ligne déjà importée (même relevé réimporté) est ignorée
+        Index("uq_bank_transactions_user_fingerprint", "user_id", "fingerprint", unique=True),
+        Index("ix_bank_transactions_user_status_date", "user_id", "status", "date"),
+    )
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"))
+    import_id = Column(String, nullable=False)  # Lot d'import (un fichier)
+    date = Column(DateTime, nullable=False)  # Date d'opération
+    amount = Column(Float, nullable=False)  # Crédit > 0, débit < 0
+    label = Column(String, nullable=False)
+    reference = Column(String)  # FITID (OFX) ou référence de la banque
+    fingerprint = Column(String, nullable=False)
+    status = Column(String, default="À rapprocher")  # À rapprocher, Rapproché
+    payment_id = Column(String, ForeignKey("payments.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class RecurringInvoice(Base):
+    __tablename__ = "recurring_invoices"
+    __table_args__ = (
+        Index("ix_recurring_invoices_active_next_run", "is_active", "next_run_date"),
+    )
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    client_id = Column(String, ForeignKey("clients.id"))
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    cadence = Column(String, nullable=False, default="monthly")  # weekly, monthly, quarterly, yearly
+    start_date = Column(DateTime, nullable=False)
+    next_run_date = Column(DateTime, nullable=False)
+    end_date = Column(DateTime, nullable=True)
+    due_days = Column(Integer, default=30)  # Échéance en jours après émission
+    invoice_status = Column(String, default="Brouillon")  # Statut des factures générées
+    discount = Column(Float, default=0.0)
+    description = Column(Text)
+    notes = Column(Text)
+    payment_terms = Column(String)
+    is_active = Column(Boolean, default=True)
+    last_run_date = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relations
+    user = relationship("User", back_populates="recurring_invoices")
+    client = relationship("Client")
+    items = relationship("RecurringInvoiceItem", back_populates="recurring_invoice")
+
+class RecurringInvoiceItem(Base):
+    __tablename__ = "recurring_invoice_items"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    recurring_id = Column(String, ForeignKey("recurring_invoices.id"), index=True)
+    product_id = Column(String, ForeignKey("products.id"), nullable=True)
+    description = Column(String, nullable=False)
+    quantity = Column(Float, default=1)
+    price = Column(Float, nullable=False)
+    tax_rate = Column(Float, default=20.0)
+    total = Column(Float, nullable=False)
+    
+    # Relations
+    recurring_invoice = relationship("RecurringInvoice", back_populates="items")
+    product = relationship("Product")
+
 class Quote(Base):
     __tablename__ = "quotes"
+    __table_args__ = (
+        Index("ix_quotes_status_expiry_date", "status", "expiry_date"),
+        Index("ix_quotes_client_date", "client_id", "date"),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     quote_number = Column(String, unique=True, nullable=False)
@@ -141,6 +283,7 @@ class Quote(Base):
     status = Column(String, default="Brouillon")  # Brouillon, Envoyé, Accepté, Refusé, Expiré
     description = Column(Text)
     notes = Column(Text)
+    version = Column(Integer, nullable=False, default=1, server_default=text("1"))  # ETag / If-Match
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relations
@@ -175,4 +318,195 @@ class Activity(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relations
-    user = relationship("User", back_populates="activities")
\ No newline at end of file
+    user = relationship("User", back_populates="activities")
+
+class OutboundEmail(Base):
+    __tablename__ = "outbound_emails"
+    __table_args__ = (
+        Index("ix_outbound_emails_user_created_at", "user_id", "created_at"),
+        Index("ix_outbound_emails_document_id", "document_id"),
+        # Retrouver l'envoi d'un avis de non-distribution
+        Index("uq_outbound_emails_message_id", "message_id", unique=True),
+    )
+
+    # Email d'une facture ou d'un devis, rendu une fois à l'envoi et remis par les workers
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"))
+    document_type = Column(String, nullable=False)  # invoice, quote
+    document_id = Column(String, nullable=False)
+    document_number = Column(String)
+    recipient = Column(String, nullable=False)
+    sender_name = Column(String, nullable=False)  # From : société de l'émetteur
+    reply_to = Column(String)  # Email du compte, les réponses lui reviennent
+    subject = Column(String, nullable=False)
+    body_text = Column(Text, nullable=False)
+    body_html = Column(Text, nullable=False)
+    message_id = Column(String, nullable=False)  # En-tête Message-ID, identique à chaque tentative
+    status = Column(String, nullable=False, default="queued")  # queued, sent, failed, bounced
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)  # Dernière réponse SMTP
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+    bounced_at = Column(DateTime, nullable=True)
+
+class Webhook(Base):
+    __tablename__ = "webhooks"
+
+    # Abonnement d'un système externe (ERP) aux événements du compte
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    url = Column(String, nullable=False)
+    secret = Column(String, nullable=False)  # Clé HMAC de la signature
+    events = Column(String, nullable=False, default="*")  # Types séparés par des virgules, * = tous
+    is_active = Column(Boolean, default=True)  # Désactivé si l'URL répond 410
+    failure_count = Column(Integer, nullable=False, default=0)  # Échecs consécutifs
+    next_attempt_at = Column(DateTime, nullable=True)  # Reprise après un échec
+    locked_by = Column(String, nullable=True)  # Dispatcher en cours de livraison
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class OutboxEvent(Base):
+    __tablename__ = "outbox_events"
+    __table_args__ = (
+        # Événements pas encore répartis entre les webhooks, dans l'ordre
+        Index("ix_outbox_events_dispatched_at_sequence", "dispatched_at", "sequence"),
+    )
+
+    # Écrit dans la transaction de la modification qu'il décrit
+    id = Column(String, primary_key=True, default=generate_uuid)
+    # Ordre d'écriture : IDENTITY sous PostgreSQL, MAX + 1 sous SQLite (un seul écrivain)
+    sequence = Column(BigInteger, Identity(), nullable=False)
+    user_id = Column(String, ForeignKey("users.id"))
+    event_type = Column(String, nullable=False)  # invoice.created, invoice.paid, quote.converted...
+    resource_type = Column(String, nullable=False)
+    resource_id = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+    dispatched_at = Column(DateTime, nullable=True)
+
+class WebhookDelivery(Base):
+    __tablename__ = "webhook_deliveries"
+    __table_args__ = (
+        Index("uq_webhook_deliveries_webhook_event", "webhook_id", "event_id", unique=True),
+        # File d'un webhook : livrée dans l'ordre des événements
+        Index("ix_webhook_deliveries_webhook_status_sequence", "webhook_id", "status", "sequence"),
+    )
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"))
+    webhook_id = Column(String, ForeignKey("webhooks.id"), nullable=False)
+    event_id = Column(String, ForeignKey("outbox_events.id"), nullable=False)
+    sequence = Column(BigInteger, nullable=False)  # Celle de l'événement
+    status = Column(String, nullable=False, default="pending")  # pending, delivered, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    last_status_code = Column(Integer, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)  # Date de l'événement
+    delivered_at = Column(DateTime, nullable=True)
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # File d'attente : prochains jobs prêts, dans l'ordre d'échéance
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+        Index("ix_jobs_user_created_at", "user_id", "created_at"),
+    )
+    
+    # Tâches longues exécutées par les workers (python jobs.py work), base principale
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"), nullable=True)
+    kind = Column(String, nullable=False)
+    params = Column(Text, nullable=False, default="{}")  # JSON
+    status = Column(String, nullable=False, default="queued")  # queued, running, succeeded, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)  # Reporté après un échec
+    progress_done = Column(Integer, nullable=False, default=0)
+    progress_total = Column(Integer, nullable=True)
+    progress_message = Column(String, nullable=True)
+    result = Column(Text, nullable=True)  # JSON
+    error = Column(Text, nullable=True)
+    locked_by = Column(String, nullable=True)  # Worker en cours
+    heartbeat_at = Column(DateTime, nullable=True)  # Renouvelé par les rapports de progression
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("uq_idempotency_keys_user_key", "user_id", "key", unique=True),
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
+
+    # Réponse d'un POST rejouée pour une même clé Idempotency-Key (base principale)
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    key = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False)  # Méthode, chemin et corps de la requête
+    status = Column(String, nullable=False, default="in_progress")  # in_progress, completed
+    response_status = Column(Integer, nullable=True)
+    response_headers = Column(Text, nullable=True)  # JSON
+    response_body = Column(Text, nullable=True)
+    locked_at = Column(DateTime, nullable=True)  # Début du traitement en cours
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+    __table_args__ = (
+        Index("uq_rate_limit_buckets_user_bucket", "user_id", "bucket", unique=True),
+    )
+
+    # Seaux de jetons partagés entre workers (RATE_LIMIT_BACKEND=database, base principale)
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    bucket = Column(String, nullable=False)  # read, write, report
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)  # Horodatage epoch, pour le calcul SQL du rechargement
+
+class NumberSequence(Base):
+    __tablename__ = "number_sequences"
+    
+    # Compteurs globaux (base principale) quand les tenants sont répartis sur plusieurs shards
+    name = Column(String, primary_key=True)  # invoice, quote
+    value = Column(Integer, nullable=False, default=0)
+
+class ProductSalesMonthly(Base):
+    __tablename__ = "product_sales_monthly"
+    __table_args__ = (
+        Index("ix_product_sales_monthly_user_month", "user_id", "month"),
+    )
+    
+    # Agrégat mensuel des ventes par produit (mois clos), recalculé par le scheduler
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"))
+    month = Column(DateTime, nullable=False)  # Premier jour du mois
+    product_id = Column(String, nullable=True)  # Pas de clé étrangère : simple cache
+    quantity = Column(Float, default=0.0)
+    revenue = Column(Float, default=0.0)  # HT, remise de la facture appliquée
+
+class ProductSalesMonth(Base):
+    __tablename__ = "product_sales_months"
+    __table_args__ = (
+        Index("uq_product_sales_months_user_month", "user_id", "month", unique=True),
+    )
+    
+    # Mois agrégés (y compris sans vente) ; supprimé quand une facture du mois change
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"))
+    month = Column(DateTime, nullable=False)
+    refreshed_at = Column(DateTime, default=datetime.utcnow)
+
+class SuggestRevision(Base):
+    __tablename__ = "suggest_revisions"
+    __table_args__ = (
+        Index("uq_suggest_revisions_user_entity", "user_id", "entity", unique=True),
+    )
+    
+    # Compteur de modifications (clients, products), incrémenté dans la transaction
+    # de l'écriture : les index de suggestion en mémoire le comparent à chaque appel
+    id = Column(String, primary_key=True, default=generate_uuid)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    entity = Column(String, nullable=False)
+    revision = Column(Integer, nullable=False, default=0)
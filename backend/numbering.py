@@ -0,0 +1,41 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import select, update, insert, func
+from database import engine, shard_engines
+from models import Invoice, Quote, NumberSequence
+
+# Helper functions for numbering
+def format_invoice_number(sequence: int) -> str:
+    return f"INV{str(sequence).zfill(3)}"
+
+def format_quote_number(sequence: int) -> str:
+    return f"DEV{str(sequence).zfill(3)}"
+
+def reserve_sequence(db: Session, model, quantity: int = 1) -> int:
+    """First of `quantity` consecutive sequence values for model's numbers"""
+    if not shard_engines:
+        return db.query(model).count() + 1
+    # Shardé : un compteur sur la base principale garde les numéros uniques entre
+    # shards (un tenant déplacé n'entre pas en collision). Transaction propre :
+    # un numéro réservé n'est jamais réattribué.
+    table = NumberSequence.__table__
+    name = model.__tablename__
+    with engine.begin() as conn:
+        reserved = conn.execute(
+            update(table).where(table.c.name == name).values(value=table.c.value + quantity)
+        ).rowcount
+        if not reserved:
+            # Première allocation : reprend après les numéros déjà en base principale
+            start = conn.execute(select(func.count()).select_from(model.__table__)).scalar()
+            conn.execute(insert(table).values(name=name, value=start + quantity))
+        return conn.execute(select(table.c.value).where(table.c.name == name)).scalar() - quantity + 1
+
+def generate_invoice_number(db: Session) -> str:
+    return format_invoice_number(reserve_sequence(db, Invoice))
+
+def generate_quote_number(db: Session) -> str:
+    return format_quote_number(reserve_sequence(db, Quote))
+
+def allocate_invoice_numbers(db: Session, quantity: int) -> list:
+    # Réserve un bloc de numéros consécutifs pour une insertion en masse
+    start = reserve_sequence(db, Invoice, quantity)
+    return [format_invoice_number(start + i) for i in range(quantity)]
@@ -0,0 +1,152 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Engine
+from sqlalchemy import select, insert, update, case
+from models import Invoice, Payment, generate_uuid
+import webhooks
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Registre des règlements : chaque paiement ajuste amount_paid et balance_due
+# de sa facture par un UPDATE incrémental, dans la transaction qui l'insère.
+# Le contrôle du solde se fait dans le WHERE : deux règlements concurrents ne
+# peuvent pas dépasser le montant de la facture.
+
+BALANCE_EPSILON = 0.005  # Sous le demi-centime, la facture est soldée
+BACKFILL_BATCH_SIZE = 1000
+
+class PaymentError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def unpaid_status(now: datetime):
+    return case((Invoice.due_date < now, "En retard"), else_="Envoyé")
+
+def record_payment(db: Session, invoice: Invoice, amount: float, payment_date: datetime = None,
+                   method: str = None, reference: str = None, notes: str = None) -> Payment:
+    """Insert a payment and apply it to the invoice balance (caller commits)"""
+    if amount <= 0:
+        raise PaymentError(400, "Payment amount must be positive")
+    if invoice.status == "Annulé":
+        raise PaymentError(400, "Cannot record a payment on a cancelled invoice")
+    # SET évalue les anciennes valeurs : le CASE teste le solde avant paiement
+    paid = db.execute(update(Invoice).where(
+        Invoice.id == invoice.id,
+        Invoice.balance_due >= amount - BALANCE_EPSILON
+    ).values(
+        amount_paid=Invoice.amount_paid + amount,
+        balance_due=Invoice.balance_due - amount,
+        status=case((Invoice.balance_due - amount <= BALANCE_EPSILON, "Payé"), else_=Invoice.status),
+        version=Invoice.version + 1
+    ).returning(Invoice.status).execution_options(synchronize_session=False)).first()
+    if paid is None:
+        raise PaymentError(400, "Payment exceeds the balance due")
+
+    payment = Payment(
+        id=generate_uuid(),
+        invoice_id=invoice.id,
+        client_id=invoice.client_id,
+        user_id=invoice.user_id,
+        amount=amount,
+        payment_date=payment_date or datetime.utcnow(),
+        method=method,
+        reference=reference,
+        notes=notes
+    )
+    db.add(payment)
+    events = [webhooks.payment_event("payment.created", payment)]
+    if paid.status == "Payé" and invoice.status != "Payé":
+        events.append(webhooks.invoice_paid_event(invoice, payment.id))
+    webhooks.emit(db, events)
+    db.expire(invoice)
+    return payment
+
+def settle(db: Session, invoice: Invoice, payment_date: datetime = None, method: str = None):
+    """Record the remaining balance, for invoices marked paid without an amount"""
+    if invoice.balance_due is not None and invoice.balance_due > BALANCE_EPSILON:
+        return record_payment(db, invoice, invoice.balance_due, payment_date, method)
+    if invoice.status != "Payé":
+        webhooks.emit(db, [webhooks.invoice_paid_event(invoice)])
+    invoice.status = "Payé"
+    return None
+
+def check_status_change(current: str, amount_paid: float, status: str):
+    """Refuse to leave Payé while payments settle the invoice: delete them instead"""
+    if current == "Payé" and status != "Payé" and (amount_paid or 0) > BALANCE_EPSILON:
+        raise PaymentError(409, "Invoice is settled by payments: delete them to change its status")
+
+def settle_rows(invoice_rows: list, now: datetime) -> tuple:
+    """Payments and events for invoice rows inserted already paid; balances are set on the rows (caller inserts)"""
+    payment_rows, events = [], []
+    for row in invoice_rows:
+        if row["status"] != "Payé":
+            continue
+        payment_id = None
+        if row["amount"] > BALANCE_EPSILON:
+            payment_id = generate_uuid()
+            row["amount_paid"], row["balance_due"] = row["amount"], 0.0
+            payment_rows.append({
+                "id": payment_id,
+                "invoice_id": row["id"],
+                "client_id": row["client_id"],
+                "user_id": row["user_id"],
+                "amount": row["amount"],
+                "payment_date": row["date"],
+                "method": None,
+                "reference": None,
+                "created_at": now
+            })
+            events.append(webhooks.payment_event("payment.created", payment_rows[-1]))
+        events.append(webhooks.invoice_paid_event(row, payment_id))
+    return payment_rows, events
+
+def delete_payment(db: Session, payment: Payment, now: datetime = None):
+    """Remove a payment and give its amount back to the invoice balance (caller commits)"""
+    db.execute(update(Invoice).where(Invoice.id == payment.invoice_id).values(
+        amount_paid=Invoice.amount_paid - payment.amount,
+        balance_due=Invoice.balance_due + payment.amount,
+        status=case((Invoice.status == "Payé", unpaid_status(now or datetime.utcnow())), else_=Invoice.status),
+        version=Invoice.version + 1
+    ).execution_options(synchronize_session=False))
+    webhooks.emit(db, [webhooks.payment_event("payment.deleted", payment)])
+    db.delete(payment)
+
+def backfill_payments(bind: Engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Fill balance_due and create one payment per invoice paid before the ledger existed"""
+    invoices = Invoice.__table__
+    with bind.begin() as conn:
+        conn.execute(update(invoices).where(invoices.c.balance_due.is_(None)).values(
+            balance_due=invoices.c.amount - invoices.c.amount_paid
+        ))
+
+    # Par lots, chacun dans sa transaction : reprise possible après interruption.
+    # Faute de mieux, le règlement est daté de la facture.
+    pending = (invoices.c.status == "Payé", invoices.c.amount_paid == 0, invoices.c.amount > 0)
+    created = 0
+    while True:
+        with bind.begin() as conn:
+            rows = conn.execute(select(
+                invoices.c.id, invoices.c.client_id, invoices.c.user_id, invoices.c.amount, invoices.c.date
+            ).where(*pending).limit(batch_size)).all()
+            if not rows:
+                break
+            conn.execute(insert(Payment.__table__), [{
+                "id": generate_uuid(),
+                "invoice_id": row.id,
+                "client_id": row.client_id,
+                "user_id": row.user_id,
+                "amount": row.amount,
+                "payment_date": row.date,
+                "notes": "Reprise du statut Payé",
+                "created_at": datetime.utcnow()
+            } for row in rows])
+            conn.execute(update(invoices).where(invoices.c.id.in_([row.id for row in rows])).values(
+                amount_paid=invoices.c.amount, balance_due=0.0
+            ))
+            created += len(rows)
+    if created:
+        logger.info(f"Backfilled {created} payments from paid invoices")
+    return created
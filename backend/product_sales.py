@@ -0,0 +1,191 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, or_, and_
+from database import shard_session, shard_names
+from models import Invoice, InvoiceItem, Product, ProductSalesMonthly, ProductSalesMonth
+from statement import NOT_ISSUED_STATUSES
+import sharding
+from datetime import datetime, timedelta
+from collections import defaultdict
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ventes par produit : les mois clos déjà agrégés sont lus dans
+# product_sales_monthly, le reste de la période (mois en cours, bords
+# partiels, mois invalidés) est calculé à la volée sur invoice_items.
+
+def month_floor(date: datetime) -> datetime:
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(month: datetime) -> datetime:
+    return month_floor(month_floor(month) + timedelta(days=32))
+
+def month_key(db: Session):
+    if db.get_bind(Invoice.__mapper__).dialect.name == "postgresql":
+        return func.to_char(Invoice.date, "YYYY-MM")
+    return func.strftime("%Y-%m", Invoice.date)
+
+def _sales_query(db: Session, user_id: str, *columns):
+    # Chiffre d'affaires HT de la ligne, remise de la facture appliquée
+    revenue = InvoiceItem.total * (1 - func.coalesce(Invoice.discount, 0) / 100)
+    return db.query(
+        *columns,
+        InvoiceItem.product_id,
+        func.sum(InvoiceItem.quantity),
+        func.sum(revenue)
+    ).join(Invoice, Invoice.id == InvoiceItem.invoice_id).filter(
+        Invoice.user_id == user_id,
+        ~Invoice.status.in_(NOT_ISSUED_STATUSES)
+    )
+
+def invalidate(db: Session, user_id: str, date: datetime):
+    """Drop a month's aggregate after one of its invoices changed (caller commits)"""
+    if date is None:
+        return
+    month = month_floor(date)
+    db.query(ProductSalesMonthly).filter(
+        ProductSalesMonthly.user_id == user_id, ProductSalesMonthly.month == month
+    ).delete(synchronize_session=False)
+    db.query(ProductSalesMonth).filter(
+        ProductSalesMonth.user_id == user_id, ProductSalesMonth.month == month
+    ).delete(synchronize_session=False)
+
+def refresh_tenant(db: Session, user_id: str, now: datetime = None) -> int:
+    """Aggregate the tenant's closed months that are not aggregated yet"""
+    current_month = month_floor(now or datetime.utcnow())
+    first = db.query(func.min(Invoice.date)).filter(Invoice.user_id == user_id).scalar()
+    if first is None:
+        return 0
+    done = {month for (month,) in db.query(ProductSalesMonth.month).filter(ProductSalesMonth.user_id == user_id)}
+    missing = []
+    month = month_floor(first)
+    while month < current_month:
+        if month not in done:
+            missing.append(month)
+        month = next_month(month)
+    if not missing:
+        return 0
+
+    wanted = {month.strftime("%Y-%m"): month for month in missing}
+    rows = _sales_query(db, user_id, month_key(db)).filter(
+        Invoice.date >= missing[0],
+        Invoice.date < current_month
+    ).group_by(month_key(db), InvoiceItem.product_id).all()
+    aggregates = [
+        {"user_id": user_id, "month": wanted[key], "product_id": product_id, "quantity": quantity or 0, "revenue": revenue or 0}
+        for key, product_id, quantity, revenue in rows if key in wanted
+    ]
+    if aggregates:
+        db.execute(insert(ProductSalesMonthly), aggregates)
+    db.execute(insert(ProductSalesMonth), [{"user_id": user_id, "month": month} for month in missing])
+    db.commit()
+    return len(missing)
+
+def refresh_product_sales(db: Session, now: datetime = None) -> int:
+    months = 0
+    user_ids = {user_id for (user_id,) in db.query(Invoice.user_id).distinct()}
+    # Tenants en cours de déplacement : agrégés plus tard, sur leur nouveau shard
+    for user_id in sharding.writable_tenants(db.info.get("tenant", {}).get("shard"), user_ids):
+        months += refresh_tenant(db, user_id, now)
+    return months
+
+def run_product_sales_refresh(now: datetime = None) -> dict:
+    months = 0
+    for shard in shard_names():
+        db = shard_session(shard)
+        try:
+            months += refresh_product_sales(db, now)
+        finally:
+            db.close()
+    return {"months_aggregated": months}
+
+def sales_by_product(db: Session, user_id: str, date_from: datetime, date_to: datetime) -> dict:
+    """{product_id: [quantity, revenue]} over [date_from, date_to)"""
+    covered = [month for (month,) in db.query(ProductSalesMonth.month).filter(
+        ProductSalesMonth.user_id == user_id,
+        ProductSalesMonth.month >= date_from,
+        ProductSalesMonth.month < date_to
+    ).order_by(ProductSalesMonth.month)]
+    covered = [month for month in covered if next_month(month) <= date_to]
+
+    totals = defaultdict(lambda: [0.0, 0.0])
+    if covered:
+        for product_id, quantity, revenue in db.query(
+            ProductSalesMonthly.product_id,
+            func.sum(ProductSalesMonthly.quantity),
+            func.sum(ProductSalesMonthly.revenue)
+        ).filter(
+            ProductSalesMonthly.user_id == user_id,
+            ProductSalesMonthly.month.in_(covered)
+        ).group_by(ProductSalesMonthly.product_id):
+            totals[product_id][0] += quantity or 0
+            totals[product_id][1] += revenue or 0
+
+    # Intervalles non couverts par l'agrégat
+    ranges = []
+    start = date_from
+    for month in covered:
+        if month > start:
+            ranges.append((start, month))
+        start = next_month(month)
+    if start < date_to:
+        ranges.append((start, date_to))
+    if ranges:
+        for product_id, quantity, revenue in _sales_query(db, user_id).filter(
+            or_(*[and_(Invoice.date >= range_start, Invoice.date < range_end) for range_start, range_end in ranges])
+        ).group_by(InvoiceItem.product_id):
+            totals[product_id][0] += quantity or 0
+            totals[product_id][1] += revenue or 0
+    return totals
+
+def product_report(db: Session, user_id: str, date_from: datetime, date_to: datetime, limit: int = 50) -> dict:
+    totals = sales_by_product(db, user_id, date_from, date_to)
+    products = {
+        product.id: product for product in db.query(Product.id, Product.name, Product.category, Product.cost).filter(
+            Product.user_id == user_id,
+            Product.id.in_([product_id for product_id in totals if product_id is not None])
+        )
+    }
+
+    rows = []
+    for product_id, (quantity, revenue) in totals.items():
+        product = products.get(product_id)
+        cost = quantity * product.cost if product is not None and product.cost is not None else None
+        rows.append({
+            "product_id": product_id,
+            "name": product.name if product else "Unknown",
+            "category": product.category if product else None,
+            "quantity": quantity,
+            "revenue": round(revenue, 2),
+            "cost": round(cost, 2) if cost is not None else None,
+            "margin": round(revenue - cost, 2) if cost is not None else None,
+            "margin_rate": round((revenue - cost) / revenue * 100, 1) if cost is not None and revenue else None,
+        })
+    rows.sort(key=lambda row: row["revenue"], reverse=True)
+
+    categories = {}
+    for row in rows:
+        category = categories.setdefault(row["category"], {
+            "category": row["category"], "quantity": 0.0, "revenue": 0.0, "margin": 0.0, "products": 0
+        })
+        category["quantity"] += row["quantity"]
+        category["revenue"] = round(category["revenue"] + row["revenue"], 2)
+        # Marge connue uniquement pour les produits avec un coût
+        category["margin"] = round(category["margin"] + (row["margin"] or 0), 2)
+        category["products"] += 1
+
+    return {
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "totals": {
+            "quantity": sum(row["quantity"] for row in rows),
+            "revenue": round(sum(row["revenue"] for row in rows), 2),
+            "margin": round(sum(row["margin"] or 0 for row in rows), 2),
+        },
+        "products": rows[:max(1, min(limit, 1000))],
+        "categories": sorted(categories.values(), key=lambda category: category["revenue"], reverse=True),
+    }
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Product sales: {run_product_sales_refresh()}")
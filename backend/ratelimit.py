@@ -0,0 +1,252 @@
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select, insert, update, case
+from sqlalchemy.exc import IntegrityError
+from collections import OrderedDict, deque
+from database import engine
+from models import RateLimitBucket, generate_uuid
+from auth import verify_token
+import metrics
+import threading
+import asyncio
+import math
+import time
+import re
+import os
+
+# Limitation par utilisateur authentifié : un seau de jetons par classe de
+# coût (lectures, écritures, rapports), puis, pour les rapports, un nombre
+# borné de requêtes simultanées par worker, attribuées à tour de rôle entre
+# utilisateurs pour qu'un tenant ne monopolise pas les calculs lourds.
+
+# Configuration
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory (par worker) ou database (partagé)
+RATE_LIMIT_REPORT_CONCURRENCY = int(os.getenv("RATE_LIMIT_REPORT_CONCURRENCY", "8"))  # Par worker
+RATE_LIMIT_REPORT_CONCURRENCY_PER_USER = int(os.getenv("RATE_LIMIT_REPORT_CONCURRENCY_PER_USER", "2"))
+RATE_LIMIT_REPORT_QUEUE_SECONDS = float(os.getenv("RATE_LIMIT_REPORT_QUEUE_SECONDS", "5"))
+
+def _bucket_config(name: str, per_minute: int, burst: int) -> dict:
+    return {
+        "rate": float(os.getenv(f"RATE_LIMIT_{name}_PER_MINUTE", str(per_minute))) / 60,  # jetons par seconde
+        "burst": float(os.getenv(f"RATE_LIMIT_{name}_BURST", str(burst))),
+    }
+
+COST_CLASSES = {
+    "read": _bucket_config("READ", 600, 100),
+    "write": _bucket_config("WRITE", 120, 30),
+    "report": _bucket_config("REPORT", 30, 10),
+}
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+READ_METHODS = {"GET", "HEAD"}
+REPORT_PATHS = re.compile(r"^/api/(reports/|dashboard$|clients/[^/]+/statement$)")
+EXEMPT_PATHS = re.compile(r"^/api/(health|login$|register$)")
+
+rate_limited_requests_total = metrics.registry.register(metrics.Counter(
+    "rate_limited_requests_total", "Requests rejected with 429 by cost class and reason (rate, concurrency).",
+    ("cost_class", "reason")))
+report_requests_queued = metrics.registry.register(metrics.Gauge(
+    "report_requests_queued", "Report requests waiting for a concurrency slot."))
+
+def cost_class(method: str, path: str) -> str:
+    if not path.startswith("/api/") or EXEMPT_PATHS.match(path):
+        return None
+    if method in WRITE_METHODS:
+        return "write"
+    if method in READ_METHODS:
+        return "report" if REPORT_PATHS.match(path) else "read"
+    return None
+
+class MemoryBackend:
+    """Token buckets held by this worker (limits apply per process)"""
+
+    blocking = False
+    PRUNE_EVERY = 1000
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def acquire(self, user_id: str, bucket: str, now: float = None) -> float:
+        """Take one token; returns 0 when allowed, else seconds until the next token"""
+        config = COST_CLASSES[bucket]
+        now = now or time.time()
+        with self._lock:
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                self._prune(now)
+            tokens, updated_at = self._buckets.get((user_id, bucket), (config["burst"], now))
+            tokens = min(config["burst"], tokens + (now - updated_at) * config["rate"])
+            if tokens < 1:
+                self._buckets[(user_id, bucket)] = (tokens, now)
+                return (1 - tokens) / config["rate"]
+            self._buckets[(user_id, bucket)] = (tokens - 1, now)
+            return 0
+
+    def _prune(self, now: float):
+        # Un seau rechargé à plein équivaut à un seau absent
+        for key, (tokens, updated_at) in list(self._buckets.items()):
+            config = COST_CLASSES[key[1]]
+            if tokens + (now - updated_at) * config["rate"] >= config["burst"]:
+                del self._buckets[key]
+
+class DatabaseBackend:
+    """Token buckets in the primary database, shared by every worker"""
+
+    blocking = True
+
+    def acquire(self, user_id: str, bucket: str, now: float = None) -> float:
+        config = COST_CLASSES[bucket]
+        now = now or time.time()
+        buckets = RateLimitBucket.__table__
+        refilled = buckets.c.tokens + (now - buckets.c.updated_at) * config["rate"]
+        level = case((refilled > config["burst"], config["burst"]), else_=refilled)
+
+        for _ in range(2):
+            with engine.begin() as conn:
+                # Rechargement et retrait du jeton en une seule instruction
+                taken = conn.execute(update(buckets).where(
+                    buckets.c.user_id == user_id,
+                    buckets.c.bucket == bucket,
+                    level >= 1
+                ).values(tokens=level - 1, updated_at=now)).rowcount
+                if taken:
+                    return 0
+                row = conn.execute(select(buckets.c.tokens, buckets.c.updated_at).where(
+                    buckets.c.user_id == user_id, buckets.c.bucket == bucket
+                )).first()
+            if row is not None:
+                tokens = min(config["burst"], row.tokens + (now - row.updated_at) * config["rate"])
+                return max((1 - tokens) / config["rate"], 0.001)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(buckets).values(
+                        id=generate_uuid(), user_id=user_id, bucket=bucket,
+                        tokens=config["burst"] - 1, updated_at=now
+                    ))
+                return 0
+            except IntegrityError:
+                # Créé en parallèle par un autre worker : nouvel essai de retrait
+                continue
+        return 1 / config["rate"]
+
+class FairBulkhead:
+    """Caps concurrent requests per worker; waiting users are served round-robin"""
+
+    def __init__(self, limit: int, per_user: int, max_wait: float):
+        self.limit = limit
+        self.per_user = per_user
+        self.max_wait = max_wait
+        self.running = 0
+        self._users = {}  # En cours + en attente, par utilisateur
+        self._waiting = OrderedDict()  # user_id -> futures, dans l'ordre de service
+
+    async def acquire(self, user_id: str) -> bool:
+        if self._users.get(user_id, 0) >= self.per_user:
+            return False
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        if self.running < self.limit and not self._waiting:
+            self.running += 1
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(future)
+        report_requests_queued.inc()
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+            return True
+        except asyncio.TimeoutError:
+            self._leave(user_id)
+            return False
+        except BaseException:
+            # Client parti pendant l'attente
+            if future.done() and not future.cancelled():
+                self.release(user_id)
+            else:
+                self._leave(user_id)
+            raise
+        finally:
+            report_requests_queued.dec()
+
+    def release(self, user_id: str):
+        self.running -= 1
+        self._leave(user_id)
+        self._dispatch()
+
+    def _leave(self, user_id: str):
+        remaining = self._users.get(user_id, 0) - 1
+        if remaining > 0:
+            self._users[user_id] = remaining
+        else:
+            self._users.pop(user_id, None)
+
+    def _dispatch(self):
+        while self.running < self.limit and self._waiting:
+            user_id, queue = next(iter(self._waiting.items()))
+            future = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            if future.done():
+                continue  # Délai d'attente dépassé
+            self.running += 1
+            future.set_result(True)
+
+limiter = DatabaseBackend() if RATE_LIMIT_BACKEND == "database" else MemoryBackend()
+report_bulkhead = FairBulkhead(
+    RATE_LIMIT_REPORT_CONCURRENCY, RATE_LIMIT_REPORT_CONCURRENCY_PER_USER, RATE_LIMIT_REPORT_QUEUE_SECONDS
+)
+
+def too_many_requests(detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=429,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+async def _release_after(body_iterator, release):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        release()
+
+async def middleware(request: Request, call_next):
+    bucket = cost_class(request.method, request.url.path) if RATE_LIMIT_ENABLED else None
+    if bucket is None:
+        return await call_next(request)
+    authorization = request.headers.get("authorization", "")
+    user_id = verify_token(authorization[7:]) if authorization.lower().startswith("bearer ") else None
+    if user_id is None:
+        return await call_next(request)
+
+    if limiter.blocking:
+        retry_after = await run_in_threadpool(limiter.acquire, user_id, bucket)
+    else:
+        retry_after = limiter.acquire(user_id, bucket)
+    if retry_after:
+        rate_limited_requests_total.inc(bucket, "rate")
+        return too_many_requests("Rate limit exceeded", retry_after)
+    if bucket != "report":
+        return await call_next(request)
+
+    if not await report_bulkhead.acquire(user_id):
+        rate_limited_requests_total.inc(bucket, "concurrency")
+        return too_many_requests("Too many concurrent report requests", RATE_LIMIT_REPORT_QUEUE_SECONDS)
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            report_bulkhead.release(user_id)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        release()
+        raise
+    # Le créneau reste pris jusqu'à la fin du corps (relevés en streaming)
+    response.body_iterator = _release_after(response.body_iterator, release)
+    return response
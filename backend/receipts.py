@@ -0,0 +1,245 @@
+from fastapi import Request
+from fastapi.responses import Response, FileResponse, StreamingResponse
+from multipart.multipart import MultipartParser, parse_options_header
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import quote
+from dotenv import load_dotenv
+import multiprocessing
+import tempfile
+import hashlib
+import logging
+import re
+import os
+
+# Justificatifs de dépenses : le corps multipart est lu au fil de l'eau et
+# écrit par blocs dans un fichier temporaire tout en calculant son SHA-256,
+# puis renommé vers son adresse de contenu (un fichier identique n'est
+# stocké qu'une fois). Les miniatures sont générées hors requête.
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+RECEIPTS_DIR = Path(os.getenv("RECEIPTS_DIR", str(ROOT_DIR / "receipts")))
+RECEIPT_MAX_BYTES = int(os.getenv("RECEIPT_MAX_BYTES", str(10 * 1024 * 1024)))
+RECEIPT_CHUNK_SIZE = int(os.getenv("RECEIPT_CHUNK_SIZE", str(64 * 1024)))
+RECEIPT_THUMBNAIL_SIZE = int(os.getenv("RECEIPT_THUMBNAIL_SIZE", "320"))  # pixels, plus grand côté
+RECEIPT_THUMBNAIL_WORKERS = int(os.getenv("RECEIPT_THUMBNAIL_WORKERS", "2"))
+# Préfixe d'une location nginx "internal" pointant sur RECEIPTS_DIR : nginx
+# sert alors le fichier (sendfile, Range) via X-Accel-Redirect
+RECEIPTS_ACCEL_REDIRECT = os.getenv("RECEIPTS_ACCEL_REDIRECT", "")
+
+# Type réel détecté sur les premiers octets, pas celui annoncé par le client
+SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"%PDF-", "application/pdf"),
+]
+THUMBNAIL_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+class ReceiptError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def sniff_content_type(head: bytes):
+    for signature, content_type in SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def relative_path(sha256: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+def content_path(relative: str) -> Path:
+    return RECEIPTS_DIR / relative
+
+def thumbnail_path(relative: str) -> Path:
+    return RECEIPTS_DIR / f"{relative}.thumb.jpg"
+
+class _UploadWriter:
+    """Multipart callbacks: the first file part goes to a temp file, hashed on the fly"""
+
+    def __init__(self, directory: Path):
+        self.file = tempfile.NamedTemporaryFile(dir=directory, prefix=".upload-", delete=False)
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.head = b""
+        self.filename = None
+        self.done = False
+        self._in_file = False
+        self._header_field = b""
+        self._header_value = b""
+        self._headers = {}
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._append("_header_field", data[start:end]),
+            "on_header_value": lambda data, start, end: self._append("_header_value", data[start:end]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _append(self, name: str, data: bytes):
+        setattr(self, name, getattr(self, name) + data)
+
+    def _part_begin(self):
+        self._headers = {}
+
+    def _header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        self._in_file = not self.done and b"filename" in options
+        if self._in_file:
+            self.filename = os.path.basename(options[b"filename"].decode("utf-8", "replace")) or None
+
+    def _part_data(self, data: bytes, start: int, end: int):
+        if not self._in_file:
+            return
+        chunk = data[start:end]
+        self.size += len(chunk)
+        if self.size > RECEIPT_MAX_BYTES:
+            raise ReceiptError(413, f"Receipt larger than {RECEIPT_MAX_BYTES} bytes")
+        if len(self.head) < 16:
+            self.head += chunk[:16 - len(self.head)]
+        self.hasher.update(chunk)
+        self.file.write(chunk)
+
+    def _part_end(self):
+        if self._in_file:
+            self.done = True
+            self._in_file = False
+
+async def store_upload(request: Request) -> dict:
+    """Stream a multipart upload to content-addressed storage"""
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise ReceiptError(400, "Expected multipart/form-data")
+
+    staging = RECEIPTS_DIR / "tmp"
+    staging.mkdir(parents=True, exist_ok=True)
+    writer = _UploadWriter(staging)
+    try:
+        parser = MultipartParser(options[b"boundary"], writer.callbacks())
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+        writer.file.close()
+        if not writer.done:
+            raise ReceiptError(400, "No file part in upload")
+        detected = sniff_content_type(writer.head)
+        if detected is None:
+            raise ReceiptError(415, "Receipts must be JPEG, PNG, WebP or PDF")
+
+        sha256 = writer.hasher.hexdigest()
+        relative = relative_path(sha256)
+        target = content_path(relative)
+        if target.exists():
+            # Déjà stocké : dédupliqué
+            os.unlink(writer.file.name)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(writer.file.name, target)
+    except BaseException:
+        writer.file.close()
+        if os.path.exists(writer.file.name):
+            os.unlink(writer.file.name)
+        raise
+    return {"path": relative, "sha256": sha256, "size": writer.size, "content_type": detected, "filename": writer.filename}
+
+# ============ DOWNLOADS ============
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _read_range(path: Path, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(RECEIPT_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def receipt_response(request: Request, relative: str, content_type: str, filename: str = None) -> Response:
+    path = content_path(relative)
+    if not path.exists():
+        raise ReceiptError(404, "Receipt file missing")
+    etag = f'"{path.name}"'  # adresse de contenu : ETag fort
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Content-Disposition": f"inline; filename*=UTF-8''{quote(filename or path.name)}",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if RECEIPTS_ACCEL_REDIRECT:
+        headers["X-Accel-Redirect"] = RECEIPTS_ACCEL_REDIRECT.rstrip("/") + "/" + relative
+        return Response(media_type=content_type, headers=headers)
+
+    size = path.stat().st_size
+    match = RANGE_PATTERN.match(request.headers.get("range", ""))
+    if match and match.group(1) + match.group(2):
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start, end = max(0, size - int(match.group(2))), size - 1
+        if start > end or start >= size:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(_read_range(path, start, end - start + 1), status_code=206,
+                                 media_type=content_type, headers=headers)
+    # Fichier entier : le serveur l'envoie sans copie s'il gère http.response.pathsend
+    return FileResponse(path, media_type=content_type, headers=headers)
+
+# ============ THUMBNAILS ============
+_pool = None
+
+def _make_thumbnail(source: str, target: str, size: int) -> bool:
+    # Exécuté dans un processus du pool
+    try:
+        from PIL import Image
+    except ImportError:
+        return False
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        image.convert("RGB").save(target + ".tmp", "JPEG", quality=80)
+    os.replace(target + ".tmp", target)
+    return True
+
+def _thumbnail_done(future):
+    if future.exception() is not None:
+        logger.warning(f"Thumbnail generation failed: {future.exception()}")
+    elif future.result() is False:
+        logger.warning("Pillow is not installed, receipt thumbnails are disabled")
+
+def schedule_thumbnail(relative: str, content_type: str):
+    global _pool
+    if content_type not in THUMBNAIL_TYPES or thumbnail_path(relative).exists():
+        return
+    if _pool is None:
+        # spawn : pas de fork d'un worker qui a déjà des threads et des connexions
+        _pool = ProcessPoolExecutor(RECEIPT_THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    future = _pool.submit(_make_thumbnail, str(content_path(relative)), str(thumbnail_path(relative)), RECEIPT_THUMBNAIL_SIZE)
+    future.add_done_callback(_thumbnail_done)
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
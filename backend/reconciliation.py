@@ -0,0 +1,358 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from models import Invoice, BankTransaction, generate_uuid
+from payments import record_payment, PaymentError, BALANCE_EPSILON
+from datetime import datetime, timedelta
+from collections import defaultdict
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from dotenv import load_dotenv
+import product_sales
+import unicodedata
+import hashlib
+import csv
+import io
+import re
+import os
+
+# Rapprochement bancaire : import de relevés (CSV, OFX) puis propositions de
+# factures pour chaque crédit. Les factures ouvertes sont indexées une fois
+# (table de hachage par numéro, listes triées par date par montant) : chaque
+# ligne coûte des recherches en O(log M), pas un parcours des M factures.
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+BANK_IMPORT_MAX_BYTES = int(os.getenv("BANK_IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+RECONCILE_DATE_WINDOW_DAYS = int(os.getenv("RECONCILE_DATE_WINDOW_DAYS", "90"))  # Écart max avec l'échéance
+
+OPEN_STATUSES = ["Envoyé", "En retard"]
+UNMATCHED_STATUS = "À rapprocher"
+MATCHED_STATUS = "Rapproché"
+
+# Numéro de facture tel qu'il apparaît dans un libellé : "INV0042", "inv-42", "INV 42"
+INVOICE_REFERENCE = re.compile(r"INV[\s\-_/.]*(\d+)", re.IGNORECASE)
+
+# En-têtes CSV reconnus (minuscules, sans accents)
+CSV_COLUMNS = {
+    "date": ("date", "date operation", "date de l'operation", "date comptable", "booking date"),
+    "label": ("libelle", "label", "description", "intitule", "memo"),
+    "amount": ("montant", "amount", "montant (eur)", "montant eur"),
+    "credit": ("credit",),
+    "debit": ("debit",),
+    "reference": ("reference", "ref", "id", "fitid"),
+}
+CSV_DELIMITERS = [";", "\t", ","]
+DATE_FORMATS = ["%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y"]
+
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)(?=</STMTTRN>|<STMTTRN>|</BANKTRANLIST>)", re.IGNORECASE | re.DOTALL)
+OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+class ReconciliationError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+# ============ PARSING ============
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.strip().lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+def parse_amount(text: str) -> float:
+    text = text.strip().replace("\xa0", "").replace(" ", "").replace("€", "").replace("EUR", "")
+    if not text:
+        return 0.0
+    # Le dernier séparateur est le séparateur décimal : "1.234,56" comme "1,234.56"
+    if "," in text and text.rfind(",") > text.rfind("."):
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    return float(text)
+
+def parse_date(text: str) -> datetime:
+    text = text.strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date {text!r}")
+
+def _decode(content: bytes) -> str:
+    try:
+        return content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return content.decode("cp1252")  # Exports des banques françaises
+
+def _delimiter(text: str) -> str:
+    # csv.Sniffer échoue sur les préambules : le séparateur le plus fréquent
+    # des premières lignes l'emporte (";" des exports français malgré "12,50")
+    sample = [line for line in text.splitlines()[:20] if line.strip()]
+    return max(CSV_DELIMITERS, key=lambda delimiter: sum(line.count(delimiter) for line in sample))
+
+def parse_csv(text: str) -> list:
+    rows = csv.reader(io.StringIO(text), delimiter=_delimiter(text))
+
+    # Les exports commencent souvent par un préambule (compte, période) : on
+    # cherche la première ligne d'en-têtes reconnue
+    columns = None
+    for header in rows:
+        names = [_normalize(name) for name in header]
+        found = {key: names.index(alias) for key, aliases in CSV_COLUMNS.items() for alias in aliases if alias in names}
+        if "date" in found and ("amount" in found or "credit" in found):
+            columns = found
+            break
+    if columns is None:
+        raise ReconciliationError(400, "CSV header not recognized (date, libellé, montant or crédit/débit expected)")
+
+    def cell(row, key):
+        index = columns.get(key)
+        return row[index] if index is not None and index < len(row) else ""
+
+    lines = []
+    for row in rows:
+        if not any(value.strip() for value in row):
+            continue
+        try:
+            if "amount" in columns:
+                amount = parse_amount(cell(row, "amount"))
+            else:
+                amount = parse_amount(cell(row, "credit")) - abs(parse_amount(cell(row, "debit")))
+            lines.append({
+                "date": parse_date(cell(row, "date")),
+                "amount": amount,
+                "label": " ".join(cell(row, "label").split()),
+                "reference": cell(row, "reference").strip() or None,
+            })
+        except ValueError as e:
+            raise ReconciliationError(400, f"Line {rows.line_num}: {e}")
+    return lines
+
+def parse_ofx(text: str) -> list:
+    lines = []
+    for block in OFX_TRANSACTION.findall(text):
+        fields = {name.upper(): value.strip() for name, value in OFX_FIELD.findall(block)}
+        try:
+            lines.append({
+                "date": datetime.strptime(fields["DTPOSTED"][:8], "%Y%m%d"),
+                "amount": parse_amount(fields["TRNAMT"]),
+                "label": " ".join(value for value in (fields.get("NAME"), fields.get("MEMO")) if value),
+                "reference": fields.get("FITID") or None,
+            })
+        except (KeyError, ValueError) as e:
+            raise ReconciliationError(400, f"Invalid OFX transaction: {e}")
+    return lines
+
+def parse_statement(content: bytes) -> tuple:
+    text = _decode(content)
+    if "<OFX>" in text.upper() or text.lstrip().upper().startswith("OFXHEADER"):
+        return "ofx", parse_ofx(text)
+    return "csv", parse_csv(text)
+
+def fingerprint(line: dict, occurrence: int) -> str:
+    # FITID quand la banque en fournit un ; sinon le contenu de la ligne, avec
+    # son rang parmi les lignes identiques du fichier (deux virements égaux le
+    # même jour restent deux lignes, un relevé réimporté ne crée rien)
+    if line["reference"]:
+        key = f"ref|{line['reference']}"
+    else:
+        key = f"{line['date']:%Y-%m-%d}|{line['amount']:.2f}|{line['label']}|{occurrence}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def import_statement(db: Session, user_id: str, content: bytes) -> dict:
+    """Store a statement's lines, skipping those already imported (caller commits)"""
+    statement_format, lines = parse_statement(content)
+    occurrences = defaultdict(int)
+    for line in lines:
+        key = (line["date"], line["amount"], line["label"])
+        line["fingerprint"] = fingerprint(line, occurrences[key])
+        occurrences[key] += 1
+
+    fingerprints = [line["fingerprint"] for line in lines]
+    existing = set()
+    for start in range(0, len(fingerprints), 1000):
+        existing.update(value for (value,) in db.query(BankTransaction.fingerprint).filter(
+            BankTransaction.user_id == user_id,
+            BankTransaction.fingerprint.in_(fingerprints[start:start + 1000])
+        ))
+
+    import_id = generate_uuid()
+    now = datetime.utcnow()
+    rows = [{
+        "id": generate_uuid(),
+        "user_id": user_id,
+        "import_id": import_id,
+        "status": UNMATCHED_STATUS,
+        "created_at": now,
+        **line
+    } for line in lines if line["fingerprint"] not in existing]
+    if rows:
+        db.execute(insert(BankTransaction), rows)
+    return {
+        "import_id": import_id,
+        "format": statement_format,
+        "lines": len(lines),
+        "imported": len(rows),
+        "duplicates": len(lines) - len(rows),
+    }
+
+# ============ MATCHING ============
+def reference_keys(text: str) -> list:
+    return [f"INV{int(number)}" for number in INVOICE_REFERENCE.findall(text or "")]
+
+def cents(amount: float) -> int:
+    return int(round(amount * 100))
+
+class OpenInvoiceIndex:
+    """Open invoices by reference (hash) and by balance, sorted by expected payment date"""
+
+    def __init__(self, invoices: list):
+        self.by_reference = {}
+        buckets = defaultdict(list)
+        for invoice in invoices:
+            for key in reference_keys(invoice.invoice_number) or [invoice.invoice_number.upper()]:
+                self.by_reference[key] = invoice
+            buckets[cents(invoice.balance_due)].append((invoice.due_date or invoice.date, invoice.id, invoice))
+        self.by_amount = {}
+        for amount, entries in buckets.items():
+            entries.sort(key=lambda entry: (entry[0], entry[1]))
+            self.by_amount[amount] = ([entry[0] for entry in entries], [entry[2] for entry in entries])
+        self.claimed = set()
+
+    def claim(self, invoice):
+        self.claimed.add(invoice.id)
+
+    def find_reference(self, label: str):
+        for key in reference_keys(label):
+            invoice = self.by_reference.get(key)
+            if invoice is not None and invoice.id not in self.claimed:
+                return invoice
+        return None
+
+    def find_amount(self, amount: float, date: datetime, window: timedelta) -> tuple:
+        """Unclaimed invoice with this balance closest to date, and the candidates count"""
+        bucket = self.by_amount.get(cents(amount))
+        if bucket is None:
+            return None, 0
+        dates, invoices = bucket
+        low, high = bisect_left(dates, date - window), bisect_right(dates, date + window)
+        # Voisins de part et d'autre de la date, en sautant les factures déjà prises
+        left = bisect_left(dates, date, low, high) - 1
+        right = left + 1
+        while left >= low and invoices[left].id in self.claimed:
+            left -= 1
+        while right < high and invoices[right].id in self.claimed:
+            right += 1
+        candidates = [index for index in (left, right) if low <= index < high]
+        if not candidates:
+            return None, 0
+        best = min(candidates, key=lambda index: abs(dates[index] - date))
+        return invoices[best], high - low
+
+def _proposal(transaction, invoice, confidence: str, reason: str) -> dict:
+    return {
+        "transaction_id": transaction.id,
+        "date": transaction.date.isoformat(),
+        "amount": transaction.amount,
+        "label": transaction.label,
+        "invoice_id": invoice.id,
+        "invoice_number": invoice.invoice_number,
+        "client_id": invoice.client_id,
+        "balance_due": invoice.balance_due,
+        "match_amount": round(min(transaction.amount, invoice.balance_due), 2),
+        "confidence": confidence,
+        "reason": reason,
+    }
+
+def propose_matches(db: Session, user_id: str, limit: int = 1000,
+                    window_days: int = RECONCILE_DATE_WINDOW_DAYS) -> dict:
+    transactions = db.query(BankTransaction).filter(
+        BankTransaction.user_id == user_id,
+        BankTransaction.status == UNMATCHED_STATUS,
+        BankTransaction.amount > 0
+    ).order_by(BankTransaction.date).limit(limit).all()
+    if not transactions:
+        return {"matches": [], "unmatched": []}
+
+    index = OpenInvoiceIndex(db.query(
+        Invoice.id, Invoice.invoice_number, Invoice.client_id, Invoice.date, Invoice.due_date, Invoice.balance_due
+    ).filter(
+        Invoice.user_id == user_id,
+        Invoice.status.in_(OPEN_STATUSES),
+        Invoice.balance_due > BALANCE_EPSILON
+    ).all())
+
+    # Références d'abord (les plus sûres), puis montant et proximité de date
+    proposals = {}
+    for transaction in transactions:
+        invoice = index.find_reference(transaction.label)
+        if invoice is None:
+            continue
+        index.claim(invoice)
+        exact = cents(transaction.amount) == cents(invoice.balance_due)
+        proposals[transaction.id] = _proposal(
+            transaction, invoice, "high" if exact else "medium", "reference+amount" if exact else "reference"
+        )
+    window = timedelta(days=window_days)
+    for transaction in transactions:
+        if transaction.id in proposals:
+            continue
+        invoice, candidates = index.find_amount(transaction.amount, transaction.date, window)
+        if invoice is None:
+            continue
+        index.claim(invoice)
+        proposals[transaction.id] = _proposal(
+            transaction, invoice, "medium" if candidates == 1 else "low", "amount+date"
+        )
+
+    return {
+        "matches": [proposals[transaction.id] for transaction in transactions if transaction.id in proposals],
+        "unmatched": [transaction.id for transaction in transactions if transaction.id not in proposals],
+    }
+
+def confirm_matches(db: Session, user_id: str, matches: list, progress=None) -> list:
+    """Create every confirmed match's payment, all or nothing (caller commits)"""
+    transaction_ids = [match["transaction_id"] for match in matches]
+    if len(set(transaction_ids)) != len(transaction_ids):
+        raise ReconciliationError(400, "A bank transaction is matched more than once")
+    transactions = {transaction.id: transaction for transaction in db.query(BankTransaction).filter(
+        BankTransaction.user_id == user_id,
+        BankTransaction.id.in_(transaction_ids)
+    )}
+    invoices = {invoice.id: invoice for invoice in db.query(Invoice).filter(
+        Invoice.user_id == user_id,
+        Invoice.id.in_({match["invoice_id"] for match in matches})
+    )}
+
+    confirmed = []
+    months = set()
+    for done, match in enumerate(matches):
+        if progress is not None:
+            progress(done, len(matches))
+        transaction = transactions.get(match["transaction_id"])
+        invoice = invoices.get(match["invoice_id"])
+        if transaction is None or invoice is None:
+            raise ReconciliationError(404, f"Transaction {match['transaction_id']} or invoice {match['invoice_id']} not found")
+        if transaction.status != UNMATCHED_STATUS:
+            raise ReconciliationError(409, f"Transaction {transaction.id} is already reconciled")
+        amount = match.get("amount") or min(transaction.amount, invoice.balance_due)
+        if invoice.date is not None:
+            months.add(product_sales.month_floor(invoice.date))
+        try:
+            payment = record_payment(
+                db, invoice, round(amount, 2), transaction.date, "Virement",
+                transaction.reference or transaction.label[:200]
+            )
+        except PaymentError as e:
+            raise ReconciliationError(e.status_code, f"Transaction {transaction.id}: {e.detail}")
+        confirmed.append((transaction, payment))
+
+    db.flush()
+    for transaction, payment in confirmed:
+        transaction.status = MATCHED_STATUS
+        transaction.payment_id = payment.id
+    # Un brouillon réglé passe à Payé et entre dans les ventes de son mois
+    for month in months:
+        product_sales.invalidate(db, user_id, month)
+    return [payment for _, payment in confirmed]
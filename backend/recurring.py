@@ -0,0 +1,207 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, update
+from database import shard_session, shard_names
+from models import User, Client, Invoice, InvoiceItem, Payment, RecurringInvoice, RecurringInvoiceItem, Activity, generate_uuid
+from numbering import allocate_invoice_numbers
+import product_sales
+import sharding
+import payments
+import mailer
+import webhooks
+from datetime import datetime, timedelta
+from collections import defaultdict
+import calendar
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+RECURRING_BATCH_SIZE = int(os.getenv("RECURRING_BATCH_SIZE", "500"))
+
+CADENCE_MONTHS = {"monthly": 1, "quarterly": 3, "yearly": 12}
+
+def advance(date: datetime, cadence: str, anchor_day: int = None) -> datetime:
+    """Next run date; month-based cadences stick to the template's start day"""
+    if cadence == "weekly":
+        return date + timedelta(days=7)
+    months = date.month - 1 + CADENCE_MONTHS[cadence]
+    year = date.year + months // 12
+    month = months % 12 + 1
+    day = min(anchor_day or date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+def compute_totals(items, discount: float):
+    total_amount = 0
+    total_tax = 0
+    for item in items:
+        item_total = item.quantity * item.price
+        total_amount += item_total
+        total_tax += item_total * (item.tax_rate / 100)
+
+    # Apply discount
+    if discount > 0:
+        total_amount -= (total_amount * discount / 100)
+        total_tax -= (total_tax * discount / 100)
+    return total_amount, total_tax
+
+def _generate_batch(db: Session, templates: list, now: datetime) -> int:
+    template_ids = [t.id for t in templates]
+
+    # Un seul aller-retour pour les lignes de tous les modèles du lot
+    items_by_template = defaultdict(list)
+    for item in db.query(RecurringInvoiceItem).filter(RecurringInvoiceItem.recurring_id.in_(template_ids)):
+        items_by_template[item.recurring_id].append(item)
+
+    # Périodes déjà facturées (idempotence en cas de relance après échec)
+    already_billed = set(db.query(Invoice.recurring_id, Invoice.recurring_period).filter(
+        Invoice.recurring_id.in_(template_ids)
+    ).filter(Invoice.recurring_period.in_([t.next_run_date for t in templates])).all())
+
+    due = []
+    template_updates = []
+    for template in templates:
+        period = template.next_run_date
+        if template.end_date is None or period <= template.end_date:
+            if (template.id, period) not in already_billed:
+                due.append(template)
+        next_run = advance(period, template.cadence, template.start_date.day)
+        template_updates.append({
+            "id": template.id,
+            "next_run_date": next_run,
+            "last_run_date": now,
+            "is_active": template.end_date is None or next_run <= template.end_date
+        })
+
+    invoice_rows = []
+    item_rows = []
+    activity_rows = []
+    for template, number in zip(due, allocate_invoice_numbers(db, len(due))):
+        items = items_by_template[template.id]
+        amount, tax = compute_totals(items, template.discount or 0)
+        invoice_id = generate_uuid()
+        period = template.next_run_date
+        invoice_rows.append({
+            "id": invoice_id,
+            "invoice_number": number,
+            "client_id": template.client_id,
+            "user_id": template.user_id,
+            "date": period,
+            "due_date": period + timedelta(days=template.due_days or 0),
+            "amount": amount,
+            "tax_amount": tax,
+            "amount_paid": 0.0,
+            "balance_due": amount,
+            "discount": template.discount or 0,
+            "status": template.invoice_status or "Brouillon",
+            "description": template.description,
+            "notes": template.notes,
+            "payment_terms": template.payment_terms,
+            "recurring_id": template.id,
+            "recurring_period": period,
+            "created_at": now
+        })
+        for item in items:
+            item_rows.append({
+                "invoice_id": invoice_id,
+                "product_id": item.product_id,
+                "description": item.description,
+                "quantity": item.quantity,
+                "price": item.price,
+                "tax_rate": item.tax_rate,
+                "total": item.total
+            })
+        activity_rows.append({
+            "user_id": template.user_id,
+            "description": f"Facture {number} générée (abonnement)",
+            "activity_type": "invoice",
+            "related_id": invoice_id,
+            "created_at": now
+        })
+
+    # Modèles "Payé" : le règlement est inscrit au registre avec la facture
+    payment_rows, payment_events = payments.settle_rows(invoice_rows, now)
+    if invoice_rows:
+        db.execute(insert(Invoice), invoice_rows)
+    if item_rows:
+        db.execute(insert(InvoiceItem), item_rows)
+    if payment_rows:
+        db.execute(insert(Payment), payment_rows)
+    if activity_rows:
+        db.execute(insert(Activity), activity_rows)
+    webhooks.emit(db, [webhooks.invoice_event("invoice.created", row) for row in invoice_rows] + payment_events)
+    mailer.queue(db, _invoice_emails(db, invoice_rows, items_by_template))
+    # Périodes rattrapées : le mois agrégé de chaque facture générée est recalculé
+    for user_id, month in {(row["user_id"], product_sales.month_floor(row["date"])) for row in invoice_rows}:
+        product_sales.invalidate(db, user_id, month)
+    db.execute(update(RecurringInvoice), template_updates)
+    db.commit()
+    return len(invoice_rows)
+
+def _invoice_emails(db: Session, invoice_rows: list, items_by_template: dict) -> list:
+    # Factures générées directement "Envoyé" : email rendu dans le même lot
+    sent = [row for row in invoice_rows if row["status"] == "Envoyé"]
+    if not sent or not mailer.EMAIL_ENABLED:
+        return []
+    clients = {client.id: client for client in db.query(Client.id, Client.name, Client.email).filter(
+        Client.id.in_({row["client_id"] for row in sent})
+    )}
+    senders = {user.id: user for user in db.query(User.id, User.name, User.company_name, User.email).filter(
+        User.id.in_({row["user_id"] for row in sent})
+    )}
+    return [mailer.prepare("invoice", {
+        "id": row["id"],
+        "user_id": row["user_id"],
+        "number": row["invoice_number"],
+        "date": row["date"],
+        "due_date": row["due_date"],
+        "amount": row["amount"],
+        "tax_amount": row["tax_amount"],
+        "notes": row["notes"],
+        "payment_terms": row["payment_terms"],
+    }, items_by_template[row["recurring_id"]], clients.get(row["client_id"]), senders[row["user_id"]]) for row in sent]
+
+def generate_due_invoices(db: Session, now: datetime = None, batch_size: int = RECURRING_BATCH_SIZE) -> int:
+    """Materialize every due period of every active template, one transaction per batch"""
+    now = now or datetime.utcnow()
+    total = 0
+    shard = db.info.get("tenant", {}).get("shard")
+    frozen = set()
+    while True:
+        query = db.query(RecurringInvoice).filter(
+            RecurringInvoice.is_active.is_(True),
+            RecurringInvoice.next_run_date <= now
+        )
+        if frozen:
+            query = query.filter(~RecurringInvoice.user_id.in_(frozen))
+        templates = query.order_by(RecurringInvoice.next_run_date).limit(batch_size).all()
+        if not templates:
+            break
+        # Tenants en cours de déplacement : leurs périodes seront générées sur le nouveau shard
+        writable = sharding.writable_tenants(shard, {template.user_id for template in templates})
+        frozen.update(template.user_id for template in templates if template.user_id not in writable)
+        templates = [template for template in templates if template.user_id in writable]
+        if not templates:
+            continue
+        try:
+            total += _generate_batch(db, templates, now)
+        except Exception:
+            db.rollback()
+            raise
+        # Les objets chargés ne sont plus utiles une fois le lot validé
+        db.expunge_all()
+    return total
+
+def run_recurring_invoices(now: datetime = None) -> dict:
+    generated = 0
+    for shard in shard_names():
+        db = shard_session(shard)
+        try:
+            generated += generate_due_invoices(db, now)
+        finally:
+            db.close()
+    return {"invoices_generated": generated}
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Recurring invoices: {run_recurring_invoices()}")
@@ -0,0 +1,226 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text, insert, update
+from database import shard_session, shard_names, engine
+from models import Invoice, Quote, Activity
+from recurring import run_recurring_invoices
+from product_sales import run_product_sales_refresh
+from idempotency import run_idempotency_prune
+import webhooks
+import sharding
+from datetime import datetime
+import tempfile
+import threading
+import logging
+import fcntl
+import os
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULER_INTERVAL = int(os.getenv("SCHEDULER_INTERVAL", "300"))  # secondes
+SCHEDULER_CHUNK_SIZE = int(os.getenv("SCHEDULER_CHUNK_SIZE", "1000"))
+SCHEDULER_LOCK_KEY = int(os.getenv("SCHEDULER_LOCK_KEY", "724001"))
+SCHEDULER_LOCK_FILE = os.getenv(
+    "SCHEDULER_LOCK_FILE",
+    os.path.join(tempfile.gettempdir(), "invoiceflow-scheduler.lock")
+)
+
+class LeaderLock:
+    """Non-blocking cross-worker lock: pg advisory lock, or a file lock elsewhere"""
+
+    def __init__(self, key: int = SCHEDULER_LOCK_KEY, lock_file: str = SCHEDULER_LOCK_FILE):
+        self.key = key
+        self.lock_file = lock_file
+        self._conn = None
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        # Vérifié à chaque tour : le verrou advisory disparaît avec sa connexion
+        if self._conn is not None and not self._still_held():
+            self._drop_connection()
+        return self._conn is not None or self._fd is not None
+
+    def _still_held(self) -> bool:
+        try:
+            held = self._conn.execute(text(
+                "SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted AND pid = pg_backend_pid()"
+                " AND objsubid = 1 AND ((classid::bigint << 32) | objid::bigint) = :key"
+            ), {"key": self.key}).scalar()
+            self._conn.commit()
+        except Exception as e:
+            logger.warning(f"Scheduler leader connection lost: {e}")
+            return False
+        if not held:
+            logger.warning("Scheduler leader lock no longer held")
+        return bool(held)
+
+    def _drop_connection(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+
+    def try_acquire(self) -> bool:
+        if self.held:
+            return True
+        if engine.dialect.name == "postgresql":
+            conn = engine.connect()
+            acquired = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+            conn.commit()
+            if acquired:
+                # La connexion reste ouverte tant que ce worker est leader
+                self._conn = conn
+            else:
+                conn.close()
+            return bool(acquired)
+
+        fd = os.open(self.lock_file, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._conn is not None:
+            try:
+                self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+                self._conn.commit()
+            finally:
+                self._conn.close()
+                self._conn = None
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+def _transition_in_chunks(db: Session, model, number_column, date_column, from_statuses, to_status,
+                          activity_type, describe, event, now: datetime, chunk_size: int) -> int:
+    total = 0
+    shard = db.info.get("tenant", {}).get("shard")
+    frozen = set()
+    while True:
+        # Sélection d'un lot d'IDs puis UPDATE ensembliste gardé par le statut,
+        # pour ne jamais écraser un changement concurrent
+        query = db.query(model.id, model.user_id, model.status).filter(
+            model.status.in_(from_statuses),
+            date_column.isnot(None),
+            date_column < now
+        )
+        if frozen:
+            query = query.filter(~model.user_id.in_(frozen))
+        rows = query.limit(chunk_size).all()
+        if not rows:
+            break
+
+        # Tenants en cours de déplacement : repris au prochain passage, sur leur shard
+        writable = sharding.writable_tenants(shard, {row.user_id for row in rows})
+        frozen.update(row.user_id for row in rows if row.user_id not in writable)
+        ids_by_status = {}
+        for row in rows:
+            if row.user_id in writable:
+                ids_by_status.setdefault(row.status, []).append(row.id)
+        activities, events = [], []
+        for old_status, ids in ids_by_status.items():
+            # Un UPDATE par ancien statut : seules les lignes réellement passées
+            # à to_status reçoivent leur activité et leur événement
+            changed = db.execute(
+                update(model)
+                .where(model.id.in_(ids), model.status == old_status)
+                .values(status=to_status, version=model.version + 1)
+                .returning(*model.__table__.columns)
+                .execution_options(synchronize_session=False)
+            ).mappings().all()
+            for row in changed:
+                activities.append({
+                    "user_id": row["user_id"],
+                    "description": describe(row[number_column.key]),
+                    "activity_type": activity_type,
+                    "related_id": row["id"],
+                    "created_at": now
+                })
+                events.append(event(dict(row), old_status))
+        if activities:
+            db.execute(insert(Activity), activities)
+        # Dans la transaction du lot : l'événement part si et seulement si le statut a changé
+        webhooks.emit(db, events)
+        db.commit()
+        total += len(activities)
+        if len(rows) < chunk_size:
+            break
+    return total
+
+def mark_overdue_invoices(db: Session, now: datetime = None, chunk_size: int = SCHEDULER_CHUNK_SIZE) -> int:
+    return _transition_in_chunks(
+        db, Invoice, Invoice.invoice_number, Invoice.due_date,
+        ["Envoyé"], "En retard", "invoice",
+        lambda number: f"Facture {number} en retard",
+        lambda row, old_status: webhooks.invoice_event("invoice.status_changed", row, old_status=old_status),
+        now or datetime.utcnow(), chunk_size
+    )
+
+def mark_expired_quotes(db: Session, now: datetime = None, chunk_size: int = SCHEDULER_CHUNK_SIZE) -> int:
+    return _transition_in_chunks(
+        db, Quote, Quote.quote_number, Quote.expiry_date,
+        ["Brouillon", "Envoyé"], "Expiré", "quote",
+        lambda number: f"Devis {number} expiré",
+        lambda row, old_status: webhooks.quote_event("quote.status_changed", row, old_status=old_status),
+        now or datetime.utcnow(), chunk_size
+    )
+
+def run_status_transitions(now: datetime = None) -> dict:
+    result = {"invoices_overdue": 0, "quotes_expired": 0}
+    for shard in shard_names():
+        db = shard_session(shard)
+        try:
+            result["invoices_overdue"] += mark_overdue_invoices(db, now)
+            result["quotes_expired"] += mark_expired_quotes(db, now)
+        finally:
+            db.close()
+    return result
+
+class Scheduler:
+    """Background thread running periodic jobs on the elected leader only"""
+
+    def __init__(self, interval: int = SCHEDULER_INTERVAL):
+        self.interval = interval
+        self.lock = LeaderLock()
+        self.jobs = [run_status_transitions, run_recurring_invoices, run_product_sales_refresh, run_idempotency_prune]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="invoiceflow-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+        self.lock.release()
+
+    def tick(self):
+        if not self.lock.try_acquire():
+            return
+        for job in self.jobs:
+            try:
+                result = job()
+                logger.info(f"Scheduler job {job.__name__}: {result}")
+            except Exception as e:
+                logger.error(f"Scheduler job {job.__name__} failed: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.tick()
+            self._stop.wait(self.interval)
+
+scheduler = Scheduler()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import Any, List, Literal, Optional
 from datetime import datetime
 
 # User Schemas
@@ -43,9 +43,20 @@ class ClientBase(BaseModel):
 class ClientCreate(ClientBase):
     pass
 
+class ClientUpdate(BaseModel):
+    name: Optional[str] = None
+    email: Optional[EmailStr] = None
+    phone: Optional[str] = None
+    address: Optional[str] = None
+    status: Optional[str] = None
+    siret: Optional[str] = None
+    contact_person: Optional[str] = None
+    notes: Optional[str] = None
+
 class Client(ClientBase):
     id: str
     user_id: str
+    version: int = 1
     created_at: datetime
     
     class Config:
@@ -59,13 +70,24 @@ class ProductBase(BaseModel):
     unit: str = "pièce"
     category: Optional[str] = None
     is_service: bool = False
+    cost: Optional[float] = None
 
 class ProductCreate(ProductBase):
     pass
 
+class ProductUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    unit: Optional[str] = None
+    category: Optional[str] = None
+    is_service: Optional[bool] = None
+    cost: Optional[float] = None
+
 class Product(ProductBase):
     id: str
     user_id: str
+    version: int = 1
     created_at: datetime
     
     class Config:
@@ -85,10 +107,23 @@ class ExpenseBase(BaseModel):
 class ExpenseCreate(ExpenseBase):
     pass
 
+class ExpenseUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    amount: Optional[float] = None
+    category: Optional[str] = None
+    expense_date: Optional[datetime] = None
+    is_billable: Optional[bool] = None
+    client_id: Optional[str] = None
+    status: Optional[str] = None
+
 class Expense(ExpenseBase):
     id: str
     user_id: str
+    version: int = 1
     receipt_path: Optional[str] = None
+    receipt_content_type: Optional[str] = None
+    receipt_filename: Optional[str] = None
     created_at: datetime
     
     class Config:
@@ -127,19 +162,155 @@ class InvoiceCreate(InvoiceBase):
     client_id: str  # Obligatoire à la création
     items: List[InvoiceItemCreate] = []
 
+class InvoiceUpdate(BaseModel):
+    # Champs descriptifs : montants via les lignes et paiements, statut via /status
+    due_date: Optional[datetime] = None
+    description: Optional[str] = None
+    notes: Optional[str] = None
+    payment_terms: Optional[str] = None
+
 class Invoice(InvoiceBase):
     id: str
     invoice_number: str
     user_id: str
+    recurring_id: Optional[str] = None  # Posé par la génération des abonnements
     date: datetime
     amount: float
     tax_amount: float
+    amount_paid: float = 0.0
+    balance_due: Optional[float] = None
+    version: int = 1
     created_at: datetime
     items: List[InvoiceItem] = []
     
     class Config:
         from_attributes = True
 
+# Bulk Schemas
+class InvoiceFilter(BaseModel):
+    status: Optional[str] = None
+    client_id: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    due_before: Optional[datetime] = None
+
+class InvoiceBulkStatus(BaseModel):
+    status: str
+    ids: Optional[List[str]] = None  # Ou filter, pas les deux
+    filter: Optional[InvoiceFilter] = None
+    send_email: bool = True
+
+class BulkDelete(BaseModel):
+    ids: List[str]
+
+# Payment Schemas
+class PaymentBase(BaseModel):
+    amount: float
+    payment_date: Optional[datetime] = None
+    method: Optional[str] = None  # Virement, Chèque, Carte, Espèces, Prélèvement
+    reference: Optional[str] = None
+    notes: Optional[str] = None
+
+class PaymentCreate(PaymentBase):
+    pass
+
+class Payment(PaymentBase):
+    id: str
+    invoice_id: str
+    client_id: Optional[str] = None
+    user_id: str
+    payment_date: datetime
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+# Bank Reconciliation Schemas
+class BankTransaction(BaseModel):
+    id: str
+    import_id: str
+    date: datetime
+    amount: float
+    label: str
+    reference: Optional[str] = None
+    status: str
+    payment_id: Optional[str] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class BankMatchConfirm(BaseModel):
+    transaction_id: str
+    invoice_id: str
+    amount: Optional[float] = None  # Par défaut : le crédit, dans la limite du solde dû
+
+class BankMatchConfirmRequest(BaseModel):
+    matches: List[BankMatchConfirm]
+
+# Job Schemas
+class Job(BaseModel):
+    id: str
+    kind: str
+    status: str  # queued, running, succeeded, failed
+    attempts: int
+    max_attempts: int
+    progress_done: int = 0
+    progress_total: Optional[int] = None
+    progress_message: Optional[str] = None
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    run_after: datetime
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+# Outbound Email Schemas
+class OutboundEmail(BaseModel):
+    id: str
+    document_type: str
+    document_id: str
+    document_number: Optional[str] = None
+    recipient: str
+    subject: str
+    status: str  # queued, sent, failed, bounced
+    attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    sent_at: Optional[datetime] = None
+    bounced_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+# Webhook Schemas
+class WebhookCreate(BaseModel):
+    url: str
+    events: List[str] = ["*"]  # invoice.created, invoice.paid, quote.converted... ou * pour tous
+
+class Webhook(BaseModel):
+    id: str
+    url: str
+    events: List[str]
+    is_active: bool
+    failure_count: int
+    next_attempt_at: Optional[datetime] = None
+    created_at: datetime
+    secret: Optional[str] = None  # Uniquement à la création
+
+class WebhookDelivery(BaseModel):
+    id: str
+    event_id: str
+    event_type: str
+    resource_type: str
+    resource_id: str
+    status: str  # pending, delivered, dead
+    attempts: int
+    last_status_code: Optional[int] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    delivered_at: Optional[datetime] = None
+
 # Quote Item Schemas
 class QuoteItemBase(BaseModel):
     description: str
@@ -171,6 +342,11 @@ class QuoteCreate(QuoteBase):
     client_id: str  # Obligatoire à la création
     items: List[QuoteItemCreate] = []
 
+class QuoteUpdate(BaseModel):
+    expiry_date: Optional[datetime] = None
+    description: Optional[str] = None
+    notes: Optional[str] = None
+
 class Quote(QuoteBase):
     id: str
     quote_number: str
@@ -178,12 +354,58 @@ class Quote(QuoteBase):
     date: datetime
     amount: float
     tax_amount: float
+    version: int = 1
     created_at: datetime
     items: List[QuoteItem] = []
     
     class Config:
         from_attributes = True
 
+# Recurring Invoice Schemas
+class RecurringInvoiceItemBase(BaseModel):
+    description: str
+    quantity: float = 1
+    price: float
+    tax_rate: float = 20.0
+    product_id: Optional[str] = None
+
+class RecurringInvoiceItemCreate(RecurringInvoiceItemBase):
+    pass
+
+class RecurringInvoiceItem(RecurringInvoiceItemBase):
+    id: str
+    total: float
+    
+    class Config:
+        from_attributes = True
+
+class RecurringInvoiceBase(BaseModel):
+    client_id: str
+    cadence: Literal["weekly", "monthly", "quarterly", "yearly"] = "monthly"
+    start_date: datetime
+    end_date: Optional[datetime] = None
+    due_days: int = 30
+    invoice_status: str = "Brouillon"
+    discount: float = 0.0
+    description: Optional[str] = None
+    notes: Optional[str] = None
+    payment_terms: Optional[str] = None
+    is_active: bool = True
+
+class RecurringInvoiceCreate(RecurringInvoiceBase):
+    items: List[RecurringInvoiceItemCreate] = []
+
+class RecurringInvoice(RecurringInvoiceBase):
+    id: str
+    user_id: str
+    next_run_date: datetime
+    last_run_date: Optional[datetime] = None
+    created_at: datetime
+    items: List[RecurringInvoiceItem] = []
+    
+    class Config:
+        from_attributes = True
+
 # Activity Schemas
 class ActivityBase(BaseModel):
     description: str
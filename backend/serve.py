@@ -0,0 +1,123 @@
+from pathlib import Path
+from dotenv import load_dotenv
+import logging
+import math
+import os
+
+# Lanceur de production : gunicorn (gestion des processus, redémarrage
+# gracieux sur SIGHUP, recyclage max_requests) avec des workers uvicorn.
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8001"))
+WORKER_MEMORY_MB = int(os.getenv("WORKER_MEMORY_MB", "200"))  # Empreinte estimée d'un worker
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "5000"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "60"))
+KEEPALIVE = int(os.getenv("KEEPALIVE", "5"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))  # max_connections PostgreSQL
+DB_RESERVED_CONNECTIONS = int(os.getenv("DB_RESERVED_CONNECTIONS", "10"))  # superuser, migrations, psql
+APP_INSTANCES = int(os.getenv("APP_INSTANCES", "1"))  # Conteneurs partageant la même base
+
+def _read(path: str):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def available_cpus() -> int:
+    # Quota cgroup v2 (conteneurs), sinon affinité du processus
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, period = cpu_max.split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def available_memory_mb():
+    memory_max = _read("/sys/fs/cgroup/memory.max")
+    if memory_max and memory_max != "max":
+        return int(memory_max) // (1024 * 1024)
+    meminfo = _read("/proc/meminfo")
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) // 1024
+    return None
+
+def worker_count(cpus: int = None, memory_mb: int = None) -> int:
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(1, int(os.getenv("WEB_CONCURRENCY")))
+    cpus = cpus or available_cpus()
+    # Les handlers font des appels SQL bloquants : un worker de plus par cœur
+    # recouvre les attentes réseau de la base
+    workers = cpus * 2 + 1
+    memory_mb = memory_mb if memory_mb is not None else available_memory_mb()
+    if memory_mb:
+        workers = min(workers, max(1, memory_mb // WORKER_MEMORY_MB))
+    return max(1, workers)
+
+def pool_settings(workers: int, max_connections: int = DB_MAX_CONNECTIONS,
+                  reserved: int = DB_RESERVED_CONNECTIONS, instances: int = APP_INSTANCES) -> dict:
+    # Chaque worker garde une connexion pour le verrou du scheduler
+    per_worker = max(2, (max_connections - reserved) // (workers * instances) - 1)
+    overflow = per_worker // 3
+    return {"DB_POOL_SIZE": per_worker - overflow, "DB_MAX_OVERFLOW": overflow}
+
+def gunicorn_options(workers: int) -> dict:
+    return {
+        "bind": f"{HOST}:{PORT}",
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS_JITTER,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": WORKER_TIMEOUT,
+        "keepalive": KEEPALIVE,
+        "post_fork": post_fork,
+        "accesslog": os.getenv("ACCESS_LOG"),
+    }
+
+def post_fork(server, worker):
+    # Le préchargement a lieu avant le fork : aucune connexion ne doit être
+    # partagée entre le maître et les workers
+    from database import engine, replica_router, shard_engines
+    engine.dispose(close=False)
+    for other in [replica.engine for replica in replica_router.replicas] + list(shard_engines.values()):
+        other.dispose(close=False)
+
+def main():
+    from gunicorn.app.base import BaseApplication
+
+    workers = worker_count()
+    pool = pool_settings(workers)
+    # Lus par database.py, importé après (préchargement)
+    for key, value in pool.items():
+        os.environ.setdefault(key, str(value))
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options(workers).items():
+                if value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            from server import app
+            return app
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger.info(f"Starting {workers} workers on {HOST}:{PORT}, DB pool {pool}")
+    Application().run()
+
+if __name__ == "__main__":
+    main()
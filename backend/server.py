@@ -1,12 +1,32 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Header, Request, Response, UploadFile, File, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse, FileResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, extract
-from database import get_db, engine, Base
-from models import User, Client, Invoice, InvoiceItem, Quote, QuoteItem, Activity, Expense, Product
+from sqlalchemy import func, desc, extract, text, case, or_, and_
+from database import get_db, get_read_db, engine, replica_router, shard_engines
+from models import User, Client, Invoice, InvoiceItem, Payment, BankTransaction, Job, OutboundEmail, Webhook, WebhookDelivery, OutboxEvent, Quote, QuoteItem, Activity, Expense, Product, RecurringInvoice, RecurringInvoiceItem
 import schemas
-from auth import get_password_hash, verify_password, create_access_token, get_current_user
+from auth import get_password_hash, verify_password, create_access_token, verify_token, get_current_user, get_admin_user
+from numbering import generate_invoice_number, generate_quote_number
+import suggest
+import statement
+import product_sales
+import payments
+import reconciliation
+import receipts
+import sharding
+import jobs
+import mailer
+import webhooks
+import idempotency
+import ratelimit
+import versioning
+import bulk
+from scheduler import scheduler, SCHEDULER_ENABLED
+import metrics
+import slowlog
 from datetime import datetime, timedelta
+from typing import Optional
 import logging
 from pathlib import Path
 from dotenv import load_dotenv
@@ -23,13 +43,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Create database tables
-try:
-    Base.metadata.create_all(bind=engine)
-    logger.info("Database tables created successfully")
-except Exception as e:
-    logger.error(f"Error creating database tables: {e}")
-    raise
+# Database tables are created by the explicit init step (python init_db.py),
+# not at import time, so workers boot without introspecting the database
 
 # Create the main app
 app = FastAPI(title="InvoiceFlow API", version="2.0.0")
@@ -37,15 +52,74 @@ app = FastAPI(title="InvoiceFlow API", version="2.0.0")
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# CORS middleware
+# Idempotency-Key on POST: duplicates replay the stored 2xx response instead of creating twice
+app.middleware("http")(idempotency.middleware)
+
+# Per-user token buckets (read, write, report cost classes) and a fair bulkhead on report routes: 429 + Retry-After
+app.middleware("http")(ratelimit.middleware)
+
+# Prometheus metrics (per-route latency, SQL statements and time per request)
+metrics.instrument_engine(engine, "primary")
+app.middleware("http")(metrics.metrics_middleware)
+
+# Slow-query log (threshold, EXPLAIN capture and buffer size from env)
+slowlog.instrument_engine(engine)
+
+# One pool gauge series per engine, labelled replica-N / shard-NAME
+extra_engines = [(f"replica-{index}", replica.engine) for index, replica in enumerate(replica_router.replicas, 1)]
+extra_engines += [(f"shard-{name}", shard_engine) for name, shard_engine in shard_engines.items()]
+for name, extra_engine in extra_engines:
+    if extra_engine is not engine:
+        metrics.instrument_engine(extra_engine, name)
+        slowlog.instrument_engine(extra_engine)
+
+# Read-your-writes: after a successful write, the user's replica-routed reads
+# go to the primary for REPLICA_STICKY_SECONDS (or on "X-Read-Consistency: primary")
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    if not replica_router.replicas:
+        return await call_next(request)
+    authorization = request.headers.get("authorization", "")
+    user_id = verify_token(authorization[7:]) if authorization.lower().startswith("bearer ") else None
+    request.state.read_primary = (
+        request.headers.get("x-read-consistency", "").lower() == "primary"
+        or (user_id is not None and replica_router.recently_wrote(user_id))
+    )
+    response = await call_next(request)
+    if user_id is not None and request.method in WRITE_METHODS and response.status_code < 400:
+        replica_router.record_write(user_id)
+    return response
+
+# CORS middleware, registered last so it is outermost: the 429, 409 and 422
+# answered by the rate-limit and idempotency middlewares carry CORS headers too
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After", "Location", "Idempotent-Replayed"],
 )
 
+# Background scheduler (overdue invoices, expired quotes)
+@app.on_event("startup")
+async def start_scheduler():
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    scheduler.stop()
+    receipts.shutdown_pool()
+
+# Helper function for 202 Accepted responses of queued jobs
+def accepted(response: Response, job: Job) -> dict:
+    # 202: the job runs on a worker (python jobs.py work); poll the Location
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return jobs.describe(job)
+
 # Helper function to log activities
 def log_activity(db: Session, user_id: str, description: str, activity_type: str = "general", related_id: str = None):
     activity = Activity(
@@ -57,14 +131,32 @@ def log_activity(db: Session, user_id: str, description: str, activity_type: str
     db.add(activity)
     db.commit()
 
-# Helper functions for numbering
-def generate_invoice_number(db: Session) -> str:
-    count = db.query(Invoice).count()
-    return f"INV{str(count + 1).zfill(3)}"
+def queue_document_email(db: Session, user: User, document_type: str, document) -> int:
+    # Rendu maintenant, remis par les workers (caller commits)
+    return mailer.queue(db, [mailer.prepare(
+        document_type, mailer.document_fields(document_type, document), document.items, document.client, user
+    )])
+
+def save_changes(db: Session, model, schema, resource_id: str, user_id: str, values: dict,
+                 if_match: Optional[str], response: Response, event=None):
+    # Un seul UPDATE ... RETURNING gardé par If-Match ; sérialisé avant le commit, sans refresh
+    try:
+        row = versioning.patch(db, model, resource_id, user_id, values, versioning.parse_if_match(if_match))
+    except versioning.VersionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if event is not None and values:
+        webhooks.emit(db, [event(row)])
+    result = schema.model_validate(row)
+    db.commit()
+    response.headers["ETag"] = versioning.etag(result.version)
+    return result
 
-def generate_quote_number(db: Session) -> str:
-    count = db.query(Quote).count()
-    return f"DEV{str(count + 1).zfill(3)}"
+def claim_version(db: Session, instance, if_match: Optional[str] = None):
+    # Avant de modifier une ligne chargée : version + 1, 412 si If-Match ne correspond plus
+    try:
+        versioning.claim(db, instance, versioning.parse_if_match(if_match))
+    except versioning.VersionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
 # ============ AUTH ROUTES ============
 @api_router.post("/register", response_model=schemas.User)
@@ -85,9 +177,11 @@ async def register(user_data: schemas.UserCreate, db: Session = Depends(get_db))
         phone=user_data.phone,
         hashed_password=hashed_password
     )
+    sharding.assign_shard(db_user)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    sharding.provision_tenant(db_user)
     
     return db_user
 
@@ -129,6 +223,7 @@ async def create_client(
 ):
     db_client = Client(**client_data.dict(), user_id=current_user.id)
     db.add(db_client)
+    suggest.touch(db, current_user.id, "clients")
     db.commit()
     db.refresh(db_client)
     
@@ -143,9 +238,19 @@ async def get_clients(
     clients = db.query(Client).filter(Client.user_id == current_user.id).all()
     return clients
 
+@api_router.get("/clients/suggest", response_model=list[schemas.Client])
+async def suggest_clients(
+    q: str,
+    limit: int = suggest.SUGGEST_DEFAULT_LIMIT,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return suggest.suggest(db, current_user.id, "clients", q, limit)
+
 @api_router.get("/clients/{client_id}", response_model=schemas.Client)
 async def get_client(
     client_id: str,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -155,29 +260,70 @@ async def get_client(
     ).first()
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
+    response.headers["ETag"] = versioning.etag(client.version)
     return client
 
-@api_router.put("/clients/{client_id}", response_model=schemas.Client)
-async def update_client(
+@api_router.get("/clients/{client_id}/statement")
+async def get_client_statement(
     client_id: str,
-    client_data: schemas.ClientCreate,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    format: str = "json",  # json, csv
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    db_client = db.query(Client).filter(
+    client = db.query(Client.id, Client.name, Client.email, Client.siret).filter(
         Client.id == client_id,
         Client.user_id == current_user.id
     ).first()
-    if not db_client:
+    if not client:
         raise HTTPException(status_code=404, detail="Client not found")
-    
-    for key, value in client_data.dict().items():
-        setattr(db_client, key, value)
-    
-    db.commit()
-    db.refresh(db_client)
-    
-    log_activity(db, current_user.id, f"Client modifié: {client_data.name}", "client", client_id)
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    
+    # The session closes before the body is sent: the stream uses its own
+    # connection on the same database (replica or tenant shard)
+    bind = db.get_bind(Invoice.__mapper__)
+    if format == "csv":
+        return StreamingResponse(
+            statement.stream_csv(bind, dict(client._mapping), current_user.id, date_from, date_to),
+            media_type="text/csv",
+            headers={"Content-Disposition": f'attachment; filename="statement-{client_id}.csv"'}
+        )
+    return StreamingResponse(
+        statement.stream_json(bind, dict(client._mapping), current_user.id, date_from, date_to),
+        media_type="application/json"
+    )
+
+@api_router.put("/clients/{client_id}", response_model=schemas.Client)
+async def update_client(
+    client_id: str,
+    client_data: schemas.ClientCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    suggest.touch(db, current_user.id, "clients")
+    db_client = save_changes(db, Client, schemas.Client, client_id, current_user.id,
+                             client_data.dict(), if_match, response)
+    log_activity(db, current_user.id, f"Client modifié: {db_client.name}", "client", client_id)
+    return db_client
+
+@api_router.patch("/clients/{client_id}", response_model=schemas.Client)
+async def patch_client(
+    client_id: str,
+    client_data: schemas.ClientUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    suggest.touch(db, current_user.id, "clients")
+    # Seuls les champs envoyés sont écrits
+    db_client = save_changes(db, Client, schemas.Client, client_id, current_user.id,
+                             client_data.dict(exclude_unset=True), if_match, response)
+    log_activity(db, current_user.id, f"Client modifié: {db_client.name}", "client", client_id)
     return db_client
 
 @api_router.delete("/clients/{client_id}")
@@ -186,20 +332,30 @@ async def delete_client(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    db_client = db.query(Client).filter(
-        Client.id == client_id,
-        Client.user_id == current_user.id
-    ).first()
-    if not db_client:
+    # Même garde que la suppression groupée : 409 tant qu'un document y fait référence
+    result, = bulk.delete_resources(db, current_user.id, "client", [client_id])
+    if result["outcome"] == "not_found":
         raise HTTPException(status_code=404, detail="Client not found")
-    
-    client_name = db_client.name
-    db.delete(db_client)
+    if result["outcome"] == "in_use":
+        raise HTTPException(status_code=409, detail=result["detail"])
+    suggest.touch(db, current_user.id, "clients")
     db.commit()
-    
-    log_activity(db, current_user.id, f"Client supprimé: {client_name}", "client", client_id)
     return {"message": "Client deleted"}
 
+@api_router.post("/clients/bulk-delete")
+async def bulk_delete_clients(
+    request_data: schemas.BulkDelete,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        results = bulk.delete_resources(db, current_user.id, "client", request_data.ids)
+    except bulk.BulkError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    suggest.touch(db, current_user.id, "clients")
+    db.commit()
+    return {"deleted": sum(result["outcome"] == "deleted" for result in results), "results": results}
+
 # ============ PRODUCT ROUTES ============
 @api_router.post("/products", response_model=schemas.Product)
 async def create_product(
@@ -209,6 +365,7 @@ async def create_product(
 ):
     db_product = Product(**product_data.dict(), user_id=current_user.id)
     db.add(db_product)
+    suggest.touch(db, current_user.id, "products")
     db.commit()
     db.refresh(db_product)
     
@@ -223,27 +380,43 @@ async def get_products(
     products = db.query(Product).filter(Product.user_id == current_user.id).all()
     return products
 
+@api_router.get("/products/suggest", response_model=list[schemas.Product])
+async def suggest_products(
+    q: str,
+    limit: int = suggest.SUGGEST_DEFAULT_LIMIT,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return suggest.suggest(db, current_user.id, "products", q, limit)
+
 @api_router.put("/products/{product_id}", response_model=schemas.Product)
 async def update_product(
     product_id: str,
     product_data: schemas.ProductCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    db_product = db.query(Product).filter(
-        Product.id == product_id,
-        Product.user_id == current_user.id
-    ).first()
-    if not db_product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
-    for key, value in product_data.dict().items():
-        setattr(db_product, key, value)
-    
-    db.commit()
-    db.refresh(db_product)
-    
-    log_activity(db, current_user.id, f"Produit/Service modifié: {product_data.name}", "product", product_id)
+    suggest.touch(db, current_user.id, "products")
+    db_product = save_changes(db, Product, schemas.Product, product_id, current_user.id,
+                              product_data.dict(), if_match, response)
+    log_activity(db, current_user.id, f"Produit/Service modifié: {db_product.name}", "product", product_id)
+    return db_product
+
+@api_router.patch("/products/{product_id}", response_model=schemas.Product)
+async def patch_product(
+    product_id: str,
+    product_data: schemas.ProductUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    suggest.touch(db, current_user.id, "products")
+    db_product = save_changes(db, Product, schemas.Product, product_id, current_user.id,
+                              product_data.dict(exclude_unset=True), if_match, response)
+    log_activity(db, current_user.id, f"Produit/Service modifié: {db_product.name}", "product", product_id)
     return db_product
 
 @api_router.delete("/products/{product_id}")
@@ -252,20 +425,30 @@ async def delete_product(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    db_product = db.query(Product).filter(
-        Product.id == product_id,
-        Product.user_id == current_user.id
-    ).first()
-    if not db_product:
+    # Même garde que la suppression groupée : 409 tant qu'un document y fait référence
+    result, = bulk.delete_resources(db, current_user.id, "product", [product_id])
+    if result["outcome"] == "not_found":
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    product_name = db_product.name
-    db.delete(db_product)
+    if result["outcome"] == "in_use":
+        raise HTTPException(status_code=409, detail=result["detail"])
+    suggest.touch(db, current_user.id, "products")
     db.commit()
-    
-    log_activity(db, current_user.id, f"Produit/Service supprimé: {product_name}", "product", product_id)
     return {"message": "Product deleted"}
 
+@api_router.post("/products/bulk-delete")
+async def bulk_delete_products(
+    request_data: schemas.BulkDelete,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        results = bulk.delete_resources(db, current_user.id, "product", request_data.ids)
+    except bulk.BulkError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    suggest.touch(db, current_user.id, "products")
+    db.commit()
+    return {"deleted": sum(result["outcome"] == "deleted" for result in results), "results": results}
+
 # ============ EXPENSE ROUTES ============
 @api_router.post("/expenses", response_model=schemas.Expense)
 async def create_expense(
@@ -293,6 +476,34 @@ async def get_expenses(
 async def update_expense(
     expense_id: str,
     expense_data: schemas.ExpenseCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_expense = save_changes(db, Expense, schemas.Expense, expense_id, current_user.id,
+                              expense_data.dict(), if_match, response)
+    log_activity(db, current_user.id, f"Dépense modifiée: {db_expense.title}", "expense", expense_id)
+    return db_expense
+
+@api_router.patch("/expenses/{expense_id}", response_model=schemas.Expense)
+async def patch_expense(
+    expense_id: str,
+    expense_data: schemas.ExpenseUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_expense = save_changes(db, Expense, schemas.Expense, expense_id, current_user.id,
+                              expense_data.dict(exclude_unset=True), if_match, response)
+    log_activity(db, current_user.id, f"Dépense modifiée: {db_expense.title}", "expense", expense_id)
+    return db_expense
+
+@api_router.post("/expenses/{expense_id}/receipt", response_model=schemas.Expense)
+async def upload_expense_receipt(
+    expense_id: str,
+    request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -303,15 +514,49 @@ async def update_expense(
     if not db_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     
-    for key, value in expense_data.dict().items():
-        setattr(db_expense, key, value)
+    # Body read here, not as an UploadFile: streamed to disk, never buffered
+    try:
+        stored = await receipts.store_upload(request)
+    except receipts.ReceiptError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     
+    claim_version(db, db_expense)
+    db_expense.receipt_path = stored["path"]
+    db_expense.receipt_content_type = stored["content_type"]
+    db_expense.receipt_filename = stored["filename"]
     db.commit()
     db.refresh(db_expense)
+    receipts.schedule_thumbnail(stored["path"], stored["content_type"])
     
-    log_activity(db, current_user.id, f"Dépense modifiée: {expense_data.title}", "expense", expense_id)
+    log_activity(db, current_user.id, f"Justificatif ajouté: {db_expense.title}", "expense", expense_id)
     return db_expense
 
+@api_router.get("/expenses/{expense_id}/receipt")
+async def download_expense_receipt(
+    expense_id: str,
+    request: Request,
+    thumbnail: bool = False,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_expense = db.query(Expense).filter(
+        Expense.id == expense_id,
+        Expense.user_id == current_user.id
+    ).first()
+    if not db_expense or not db_expense.receipt_path:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    
+    if thumbnail:
+        path = receipts.thumbnail_path(db_expense.receipt_path)
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="Thumbnail not available")
+        return FileResponse(path, media_type="image/jpeg")
+    try:
+        return receipts.receipt_response(request, db_expense.receipt_path,
+                                         db_expense.receipt_content_type, db_expense.receipt_filename)
+    except receipts.ReceiptError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
 @api_router.delete("/expenses/{expense_id}")
 async def delete_expense(
     expense_id: str,
@@ -332,6 +577,19 @@ async def delete_expense(
     log_activity(db, current_user.id, f"Dépense supprimée: {expense_title}", "expense", expense_id)
     return {"message": "Expense deleted"}
 
+@api_router.post("/expenses/bulk-delete")
+async def bulk_delete_expenses(
+    request_data: schemas.BulkDelete,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        results = bulk.delete_resources(db, current_user.id, "expense", request_data.ids)
+    except bulk.BulkError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    db.commit()
+    return {"deleted": sum(result["outcome"] == "deleted" for result in results), "results": results}
+
 # ============ QUOTE ROUTES ============
 @api_router.post("/quotes", response_model=schemas.Quote)
 async def create_quote(
@@ -387,6 +645,7 @@ async def create_quote(
     # Update quote totals
     db_quote.amount = total_amount
     db_quote.tax_amount = total_tax
+    webhooks.emit(db, [webhooks.quote_event("quote.created", db_quote)])
     db.commit()
     
     # Get client name for activity log
@@ -407,6 +666,9 @@ async def get_quotes(
 async def update_quote_status(
     quote_id: str,
     status: str,
+    response: Response,
+    send_email: bool = True,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -417,8 +679,14 @@ async def update_quote_status(
     if not db_quote:
         raise HTTPException(status_code=404, detail="Quote not found")
     
+    claim_version(db, db_quote, if_match)
+    version = db_quote.version
     old_status = db_quote.status
     db_quote.status = status
+    emails = 0
+    if status == "Envoyé" and old_status != status and send_email:
+        emails = queue_document_email(db, current_user, "quote", db_quote)
+    webhooks.emit(db, [webhooks.quote_event("quote.status_changed", db_quote, old_status=old_status)])
     db.commit()
     
     # Log activity based on status change
@@ -427,7 +695,23 @@ async def update_quote_status(
     elif status == "Envoyé":
         log_activity(db, current_user.id, f"Devis {db_quote.quote_number} envoyé", "quote", quote_id)
     
-    return {"message": f"Quote status updated from {old_status} to {status}"}
+    response.headers["ETag"] = versioning.etag(version)
+    return {"message": f"Quote status updated from {old_status} to {status}", "email_queued": emails > 0, "version": version}
+
+@api_router.patch("/quotes/{quote_id}", response_model=schemas.Quote)
+async def patch_quote(
+    quote_id: str,
+    quote_data: schemas.QuoteUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    values = quote_data.dict(exclude_unset=True)
+    db_quote = save_changes(db, Quote, schemas.Quote, quote_id, current_user.id, values, if_match, response,
+                            lambda row: webhooks.quote_event("quote.updated", row, changed=sorted(values)))
+    log_activity(db, current_user.id, f"Devis {db_quote.quote_number} modifié", "quote", quote_id)
+    return db_quote
 
 @api_router.post("/quotes/{quote_id}/convert", response_model=schemas.Invoice)
 async def convert_quote_to_invoice(
@@ -450,6 +734,7 @@ async def convert_quote_to_invoice(
         amount=db_quote.amount,
         tax_amount=db_quote.tax_amount,
         discount=db_quote.discount,
+        balance_due=db_quote.amount,
         status="Brouillon",
         description=db_quote.description,
         notes=db_quote.notes,
@@ -474,7 +759,12 @@ async def convert_quote_to_invoice(
         db.add(db_item)
     
     # Update quote status
+    claim_version(db, db_quote)
     db_quote.status = "Accepté"
+    webhooks.emit(db, [
+        webhooks.invoice_event("invoice.created", db_invoice),
+        webhooks.quote_event("quote.converted", db_quote, invoice_id=db_invoice.id, invoice_number=db_invoice.invoice_number)
+    ])
     db.commit()
     
     log_activity(db, current_user.id, f"Devis {db_quote.quote_number} converti en facture {db_invoice.invoice_number}", "invoice", db_invoice.id)
@@ -498,14 +788,16 @@ async def create_invoice(
         client_id=invoice_data.client_id,
         user_id=current_user.id,
         due_date=invoice_data.due_date,
-        status=invoice_data.status,
+        # Créée payée : passe par le registre des règlements une fois les totaux connus
+        status="Envoyé" if invoice_data.status == "Payé" else invoice_data.status,
         description=invoice_data.description,
         notes=invoice_data.notes,
         payment_terms=invoice_data.payment_terms,
         discount=invoice_data.discount,
         quote_id=invoice_data.quote_id,
         amount=0,  # Will be updated after items
-        tax_amount=0
+        tax_amount=0,
+        balance_due=0
     )
     db.add(db_invoice)
     db.commit()
@@ -538,6 +830,11 @@ async def create_invoice(
     # Update invoice totals
     db_invoice.amount = total_amount
     db_invoice.tax_amount = total_tax
+    db_invoice.balance_due = total_amount
+    webhooks.emit(db, [webhooks.invoice_event("invoice.created", db_invoice)])
+    if invoice_data.status == "Payé":
+        db.flush()
+        payments.settle(db, db_invoice)
     db.commit()
     
     # Get client name for activity log
@@ -557,6 +854,7 @@ async def get_invoices(
 @api_router.get("/invoices/{invoice_id}", response_model=schemas.Invoice)
 async def get_invoice(
     invoice_id: str,
+    response: Response,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -566,12 +864,16 @@ async def get_invoice(
     ).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
+    response.headers["ETag"] = versioning.etag(invoice.version)
     return invoice
 
 @api_router.put("/invoices/{invoice_id}/status")
 async def update_invoice_status(
     invoice_id: str,
     status: str,
+    response: Response,
+    send_email: bool = True,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -582,8 +884,27 @@ async def update_invoice_status(
     if not db_invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
+    try:
+        payments.check_status_change(db_invoice.status, db_invoice.amount_paid, status)
+    except payments.PaymentError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    claim_version(db, db_invoice, if_match)
     old_status = db_invoice.status
-    db_invoice.status = status
+    if status == "Payé":
+        # Marquée payée sans montant : le solde restant est réglé ce jour
+        try:
+            payments.settle(db, db_invoice)
+        except payments.PaymentError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+    else:
+        db_invoice.status = status
+    emails = 0
+    if status == "Envoyé" and old_status != status and send_email:
+        emails = queue_document_email(db, current_user, "invoice", db_invoice)
+    webhooks.emit(db, [webhooks.invoice_event("invoice.status_changed", db_invoice, old_status=old_status)])
+    product_sales.invalidate(db, current_user.id, db_invoice.date)
+    version = db_invoice.version
     db.commit()
     
     # Log activity based on status change
@@ -592,32 +913,396 @@ async def update_invoice_status(
     elif status == "Envoyé":
         log_activity(db, current_user.id, f"Facture {db_invoice.invoice_number} envoyée", "invoice", invoice_id)
     
-    return {"message": f"Invoice status updated from {old_status} to {status}"}
+    response.headers["ETag"] = versioning.etag(version)
+    return {"message": f"Invoice status updated from {old_status} to {status}", "email_queued": emails > 0, "version": version}
 
-# ============ DASHBOARD ROUTES ============
-@api_router.get("/dashboard", response_model=schemas.DashboardData)
-async def get_dashboard(
+@api_router.patch("/invoices/{invoice_id}", response_model=schemas.Invoice)
+async def patch_invoice(
+    invoice_id: str,
+    invoice_data: schemas.InvoiceUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Calculate metrics
-    total_revenue = db.query(func.sum(Invoice.amount)).filter(
-        Invoice.user_id == current_user.id,
-        Invoice.status == "Payé"
-    ).scalar() or 0
+    # Échéance et textes seulement : montants et solde restent tenus par les lignes et paiements
+    values = invoice_data.dict(exclude_unset=True)
+    db_invoice = save_changes(db, Invoice, schemas.Invoice, invoice_id, current_user.id, values, if_match, response,
+                              lambda row: webhooks.invoice_event("invoice.updated", row, changed=sorted(values)))
+    log_activity(db, current_user.id, f"Facture {db_invoice.invoice_number} modifiée", "invoice", invoice_id)
+    return db_invoice
+
+@api_router.post("/invoices/bulk-status")
+async def bulk_update_invoice_status(
+    request_data: schemas.InvoiceBulkStatus,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Un UPDATE pour toute la sélection (ids ou filter, BULK_MAX_IDS au plus), résultat par facture
+    filters = request_data.filter.model_dump() if request_data.filter is not None else None
+    try:
+        results = bulk.set_invoice_status(
+            db, current_user, request_data.status, request_data.ids, filters, request_data.send_email
+        )
+    except bulk.BulkError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    db.commit()
+    return {"updated": sum(result["outcome"] == "updated" for result in results), "results": results}
+
+@api_router.post("/invoices/bulk-status/jobs", status_code=202, response_model=schemas.Job)
+async def bulk_update_invoice_status_job(
+    request_data: schemas.InvoiceBulkStatus,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Large selections: same change by chunks of BULK_CHUNK_SIZE, run by a worker
+    if (request_data.ids is None) == (request_data.filter is None):
+        raise HTTPException(status_code=400, detail="Give either ids or filter")
+    job = jobs.enqueue(db, "bulk_invoice_status", {
+        "status": request_data.status,
+        "ids": request_data.ids,
+        "filters": request_data.filter.model_dump(mode="json") if request_data.filter is not None else None,
+        "send_email": request_data.send_email,
+    }, current_user.id)
+    db.commit()
+    return accepted(response, job)
+
+# ============ PAYMENT ROUTES ============
+@api_router.post("/invoices/{invoice_id}/payments", response_model=schemas.Payment)
+async def create_payment(
+    invoice_id: str,
+    payment_data: schemas.PaymentCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_invoice = db.query(Invoice).filter(
+        Invoice.id == invoice_id,
+        Invoice.user_id == current_user.id
+    ).first()
+    if not db_invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
     
-    total_invoices = db.query(Invoice).filter(Invoice.user_id == current_user.id).count()
-    total_clients = db.query(Client).filter(Client.user_id == current_user.id).count()
-    total_quotes = db.query(Quote).filter(Quote.user_id == current_user.id).count()
-    quotes_pending = db.query(Quote).filter(
-        Quote.user_id == current_user.id,
-        Quote.status.in_(["Brouillon", "Envoyé"])
-    ).count()
+    invoice_number, invoice_date = db_invoice.invoice_number, db_invoice.date
+    try:
+        db_payment = payments.record_payment(db, db_invoice, **payment_data.model_dump())
+    except payments.PaymentError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    # Un brouillon soldé devient Payé, donc compté dans les ventes
+    product_sales.invalidate(db, current_user.id, invoice_date)
+    db.commit()
+    db.refresh(db_payment)
     
-    pending_amount = db.query(func.sum(Invoice.amount)).filter(
+    log_activity(db, current_user.id, f"Règlement de {db_payment.amount:,.2f} € reçu pour la facture {invoice_number}", "invoice", invoice_id)
+    return db_payment
+
+@api_router.get("/invoices/{invoice_id}/payments", response_model=list[schemas.Payment])
+async def get_invoice_payments(
+    invoice_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return db.query(Payment).filter(
+        Payment.invoice_id == invoice_id,
+        Payment.user_id == current_user.id
+    ).order_by(Payment.payment_date).all()
+
+@api_router.get("/payments", response_model=list[schemas.Payment])
+async def get_payments(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,  # exclusive
+    limit: int = 100,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    query = db.query(Payment).filter(Payment.user_id == current_user.id)
+    if date_from:
+        query = query.filter(Payment.payment_date >= date_from)
+    if date_to:
+        query = query.filter(Payment.payment_date < date_to)
+    return query.order_by(desc(Payment.payment_date)).limit(max(1, min(limit, 1000))).all()
+
+@api_router.delete("/payments/{payment_id}")
+async def delete_payment(
+    payment_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_payment = db.query(Payment).filter(
+        Payment.id == payment_id,
+        Payment.user_id == current_user.id
+    ).first()
+    if not db_payment:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    
+    invoice_id = db_payment.invoice_id
+    payments.delete_payment(db, db_payment)
+    db.commit()
+    
+    log_activity(db, current_user.id, "Règlement supprimé", "invoice", invoice_id)
+    return {"message": "Payment deleted"}
+
+# ============ BANK RECONCILIATION ROUTES ============
+@api_router.post("/bank/imports")
+async def import_bank_statement(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    content = await file.read(reconciliation.BANK_IMPORT_MAX_BYTES + 1)
+    if len(content) > reconciliation.BANK_IMPORT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Statement larger than {reconciliation.BANK_IMPORT_MAX_BYTES} bytes")
+    try:
+        result = reconciliation.import_statement(db, current_user.id, content)
+    except reconciliation.ReconciliationError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    db.commit()
+    
+    log_activity(db, current_user.id, f"Relevé bancaire importé: {result['imported']} opérations", "bank", result["import_id"])
+    return result
+
+@api_router.get("/bank/transactions", response_model=list[schemas.BankTransaction])
+async def get_bank_transactions(
+    status: Optional[str] = None,
+    import_id: Optional[str] = None,
+    limit: int = 500,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    query = db.query(BankTransaction).filter(BankTransaction.user_id == current_user.id)
+    if status:
+        query = query.filter(BankTransaction.status == status)
+    if import_id:
+        query = query.filter(BankTransaction.import_id == import_id)
+    return query.order_by(desc(BankTransaction.date)).limit(max(1, min(limit, 5000))).all()
+
+@api_router.get("/bank/matches")
+async def get_bank_matches(
+    limit: int = 1000,
+    window_days: int = reconciliation.RECONCILE_DATE_WINDOW_DAYS,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Proposals for unreconciled credits; nothing is written until confirmed
+    return reconciliation.propose_matches(db, current_user.id, max(1, min(limit, 5000)), window_days)
+
+@api_router.post("/bank/matches/confirm", response_model=list[schemas.Payment])
+async def confirm_bank_matches(
+    request_data: schemas.BankMatchConfirmRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # One transaction: every payment is created, or none
+    try:
+        created = reconciliation.confirm_matches(db, current_user.id, [match.model_dump() for match in request_data.matches])
+    except reconciliation.ReconciliationError as e:
+        db.rollback()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    payment_ids = [payment.id for payment in created]
+    db.commit()
+    
+    log_activity(db, current_user.id, f"Rapprochement bancaire: {len(created)} règlements enregistrés", "bank")
+    return db.query(Payment).filter(Payment.id.in_(payment_ids)).order_by(Payment.payment_date).all()
+
+@api_router.post("/bank/matches/confirm/jobs", status_code=202, response_model=schemas.Job)
+async def confirm_bank_matches_job(
+    request_data: schemas.BankMatchConfirmRequest,
+    response: Response,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Large batches: same all-or-nothing confirmation, run by a worker
+    job = jobs.enqueue(db, "bank_confirm", {
+        "matches": [match.model_dump() for match in request_data.matches]
+    }, current_user.id)
+    db.commit()
+    return accepted(response, job)
+
+# ============ RECURRING INVOICE ROUTES ============
+def replace_recurring_items(db: Session, db_recurring: RecurringInvoice, items: list):
+    db.query(RecurringInvoiceItem).filter(RecurringInvoiceItem.recurring_id == db_recurring.id).delete()
+    for item_data in items:
+        db.add(RecurringInvoiceItem(
+            recurring_id=db_recurring.id,
+            product_id=item_data.product_id,
+            description=item_data.description,
+            quantity=item_data.quantity,
+            price=item_data.price,
+            tax_rate=item_data.tax_rate,
+            total=item_data.quantity * item_data.price
+        ))
+
+@api_router.post("/recurring-invoices", response_model=schemas.RecurringInvoice)
+async def create_recurring_invoice(
+    recurring_data: schemas.RecurringInvoiceCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    client = db.query(Client).filter(
+        Client.id == recurring_data.client_id,
+        Client.user_id == current_user.id
+    ).first()
+    if not client:
+        raise HTTPException(status_code=404, detail="Client not found")
+    
+    db_recurring = RecurringInvoice(
+        **recurring_data.dict(exclude={"items"}),
+        user_id=current_user.id,
+        next_run_date=recurring_data.start_date
+    )
+    db.add(db_recurring)
+    db.flush()
+    replace_recurring_items(db, db_recurring, recurring_data.items)
+    db.commit()
+    db.refresh(db_recurring)
+    
+    log_activity(db, current_user.id, f"Abonnement créé pour {client.name}", "recurring", db_recurring.id)
+    return db_recurring
+
+@api_router.get("/recurring-invoices", response_model=list[schemas.RecurringInvoice])
+async def get_recurring_invoices(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return db.query(RecurringInvoice).filter(
+        RecurringInvoice.user_id == current_user.id
+    ).order_by(desc(RecurringInvoice.created_at)).all()
+
+@api_router.get("/recurring-invoices/{recurring_id}", response_model=schemas.RecurringInvoice)
+async def get_recurring_invoice(
+    recurring_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_recurring = db.query(RecurringInvoice).filter(
+        RecurringInvoice.id == recurring_id,
+        RecurringInvoice.user_id == current_user.id
+    ).first()
+    if not db_recurring:
+        raise HTTPException(status_code=404, detail="Recurring invoice not found")
+    return db_recurring
+
+@api_router.put("/recurring-invoices/{recurring_id}", response_model=schemas.RecurringInvoice)
+async def update_recurring_invoice(
+    recurring_id: str,
+    recurring_data: schemas.RecurringInvoiceCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_recurring = db.query(RecurringInvoice).filter(
+        RecurringInvoice.id == recurring_id,
+        RecurringInvoice.user_id == current_user.id
+    ).first()
+    if not db_recurring:
+        raise HTTPException(status_code=404, detail="Recurring invoice not found")
+    
+    # A new start date restarts the schedule; periods already billed stay skipped
+    if recurring_data.start_date != db_recurring.start_date:
+        db_recurring.next_run_date = recurring_data.start_date
+    for key, value in recurring_data.dict(exclude={"items"}).items():
+        setattr(db_recurring, key, value)
+    replace_recurring_items(db, db_recurring, recurring_data.items)
+    
+    db.commit()
+    db.refresh(db_recurring)
+    
+    log_activity(db, current_user.id, "Abonnement modifié", "recurring", recurring_id)
+    return db_recurring
+
+@api_router.delete("/recurring-invoices/{recurring_id}")
+async def delete_recurring_invoice(
+    recurring_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_recurring = db.query(RecurringInvoice).filter(
+        RecurringInvoice.id == recurring_id,
+        RecurringInvoice.user_id == current_user.id
+    ).first()
+    if not db_recurring:
+        raise HTTPException(status_code=404, detail="Recurring invoice not found")
+    
+    # Generated invoices are kept, only detached from the template
+    db.query(Invoice).filter(Invoice.recurring_id == recurring_id).update(
+        {Invoice.recurring_id: None}, synchronize_session=False
+    )
+    db.query(RecurringInvoiceItem).filter(RecurringInvoiceItem.recurring_id == recurring_id).delete()
+    db.delete(db_recurring)
+    db.commit()
+    
+    log_activity(db, current_user.id, "Abonnement supprimé", "recurring", recurring_id)
+    return {"message": "Recurring invoice deleted"}
+
+# ============ DASHBOARD ROUTES ============
+# Deltas compare the last DASHBOARD_PERIOD_DAYS with the same span before it
+DASHBOARD_PERIOD_DAYS = int(os.getenv("DASHBOARD_PERIOD_DAYS", "30"))
+
+def percent_change(current: float, previous: float) -> float:
+    if not previous:
+        return 100.0 if current else 0.0
+    return round((current - previous) / previous * 100, 1)
+
+@api_router.get("/dashboard", response_model=schemas.DashboardData)
+async def get_dashboard(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    # Current values and period-over-period deltas share their passes: one
+    # grouped by status for the totals, one over the last two periods only.
+    # Every delta compares this period with the previous one: cash received,
+    # new invoices, new clients and what is still due on the invoices of each.
+    now = datetime.utcnow()
+    period_start = now - timedelta(days=DASHBOARD_PERIOD_DAYS)
+    previous_start = period_start - timedelta(days=DASHBOARD_PERIOD_DAYS)
+    current_period = Invoice.date >= period_start
+    
+    def amount_if(condition, amount=Invoice.amount):
+        return func.coalesce(func.sum(case((condition, amount), else_=0)), 0)
+    
+    def count_if(condition):
+        return amount_if(condition, 1)
+    
+    # Pending amounts are what is left to pay, not the invoiced total
+    invoice_totals = db.query(
+        Invoice.status, func.count(), func.coalesce(func.sum(Invoice.balance_due), 0)
+    ).filter(Invoice.user_id == current_user.id).group_by(Invoice.status).all()
+    
+    # status IN (statuses present) keeps the window a range scan per status
+    invoice_periods = db.query(
+        Invoice.status,
+        count_if(current_period), count_if(~current_period),
+        amount_if(current_period, Invoice.balance_due), amount_if(~current_period, Invoice.balance_due)
+    ).filter(
         Invoice.user_id == current_user.id,
-        Invoice.status.in_(["Envoyé", "En retard"])
-    ).scalar() or 0
+        Invoice.status.in_([row[0] for row in invoice_totals]),
+        Invoice.date >= previous_start
+    ).group_by(Invoice.status).all()
+    
+    # Revenue is cash received: payments by payment date, partial ones included
+    current_payment = Payment.payment_date >= period_start
+    total_revenue, revenue_current, revenue_previous = db.query(
+        func.coalesce(func.sum(Payment.amount), 0),
+        amount_if(current_payment, Payment.amount),
+        amount_if(and_(Payment.payment_date >= previous_start, ~current_payment), Payment.amount)
+    ).filter(Payment.user_id == current_user.id).one()
+    
+    total_invoices = sum(count for _, count, _ in invoice_totals)
+    pending_amount = sum(amount for status, _, amount in invoice_totals if status in ("Envoyé", "En retard"))
+    invoices_current = sum(row[1] for row in invoice_periods)
+    invoices_previous = sum(row[2] for row in invoice_periods)
+    pending_current = sum(row[3] for row in invoice_periods if row[0] in ("Envoyé", "En retard"))
+    pending_previous = sum(row[4] for row in invoice_periods if row[0] in ("Envoyé", "En retard"))
+    
+    total_clients, clients_current, clients_previous = db.query(
+        func.count(),
+        count_if(Client.created_at >= period_start),
+        count_if(and_(Client.created_at >= previous_start, Client.created_at < period_start))
+    ).filter(Client.user_id == current_user.id).one()
+    
+    total_quotes, quotes_pending = db.query(
+        func.count(),
+        count_if(Quote.status.in_(["Brouillon", "Envoyé"]))
+    ).filter(Quote.user_id == current_user.id).one()
     
     total_expenses = db.query(func.sum(Expense.amount)).filter(
         Expense.user_id == current_user.id
@@ -660,27 +1345,31 @@ async def get_dashboard(
         Activity.user_id == current_user.id
     ).order_by(desc(Activity.created_at)).limit(8).all()
     
-    # Top clients
+    # Top clients: payments grouped on the covering index, then the five names
     top_clients = db.query(
-        Client.id,
-        Client.name,
-        Client.email,
-        Client.status,
-        func.sum(Invoice.amount).label('revenue')
-    ).join(Invoice).filter(
-        Client.user_id == current_user.id,
-        Invoice.status == "Payé"
-    ).group_by(Client.id, Client.name, Client.email, Client.status).order_by(
+        Payment.client_id,
+        func.sum(Payment.amount).label('revenue')
+    ).filter(
+        Payment.user_id == current_user.id
+    ).group_by(Payment.client_id).order_by(
         desc('revenue')
     ).limit(5).all()
+    top_client_rows = {
+        client.id: client for client in db.query(Client.id, Client.name, Client.email, Client.status).filter(
+            Client.id.in_([row.client_id for row in top_clients])
+        )
+    }
     
     top_clients_data = []
-    for client in top_clients:
+    for row in top_clients:
+        client = top_client_rows.get(row.client_id)
+        if client is None:
+            continue
         top_clients_data.append({
             "client_id": client.id[:2].upper(),
             "name": client.name,
             "email": client.email,
-            "revenue": f"{client.revenue:,.2f} €",
+            "revenue": f"{row.revenue:,.2f} €",
             "status": client.status
         })
     
@@ -702,13 +1391,13 @@ async def get_dashboard(
     return {
         "metrics": {
             "revenue": total_revenue,
-            "revenue_change": 12.5,  # Mock data - implement proper calculation
+            "revenue_change": percent_change(revenue_current, revenue_previous),
             "invoices_count": total_invoices,
-            "invoices_change": 8.2,  # Mock data
+            "invoices_change": percent_change(invoices_current, invoices_previous),
             "clients_count": total_clients,
-            "clients_change": 15.1,  # Mock data
+            "clients_change": percent_change(clients_current, clients_previous),
             "pending_amount": pending_amount,
-            "pending_change": 3.2,  # Mock data
+            "pending_change": percent_change(pending_current, pending_previous),
             "expenses_total": total_expenses,
             "quotes_count": total_quotes,
             "quotes_pending": quotes_pending
@@ -725,7 +1414,7 @@ async def get_dashboard(
 async def get_financial_report(
     period: str = "month",  # month, quarter, year
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     # Calculate period dates
     now = datetime.now()
@@ -737,11 +1426,10 @@ async def get_financial_report(
     else:  # year
         start_date = now.replace(month=1, day=1)
     
-    # Get financial data for period
-    revenue = db.query(func.sum(Invoice.amount)).filter(
-        Invoice.user_id == current_user.id,
-        Invoice.status == "Payé",
-        Invoice.date >= start_date
+    # Get financial data for period (revenue = payments received in the period)
+    revenue = db.query(func.sum(Payment.amount)).filter(
+        Payment.user_id == current_user.id,
+        Payment.payment_date >= start_date
     ).scalar() or 0
     
     expenses = db.query(func.sum(Expense.amount)).filter(
@@ -787,7 +1475,7 @@ async def get_financial_report(
 @api_router.get("/reports/cashflow")
 async def get_cashflow_report(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     # Get last 12 months data
     cashflow_data = []
@@ -798,12 +1486,11 @@ async def get_cashflow_report(
         month_start = target_month.replace(day=1)
         next_month = month_start.replace(month=month_start.month % 12 + 1) if month_start.month < 12 else month_start.replace(year=month_start.year + 1, month=1)
         
-        # Income (paid invoices)
-        income = db.query(func.sum(Invoice.amount)).filter(
-            Invoice.user_id == current_user.id,
-            Invoice.status == "Payé",
-            Invoice.date >= month_start,
-            Invoice.date < next_month
+        # Income (payments received)
+        income = db.query(func.sum(Payment.amount)).filter(
+            Payment.user_id == current_user.id,
+            Payment.payment_date >= month_start,
+            Payment.payment_date < next_month
         ).scalar() or 0
         
         # Expenses
@@ -822,18 +1509,315 @@ async def get_cashflow_report(
     
     return {"cashflow": list(reversed(cashflow_data))}
 
+@api_router.get("/reports/products")
+async def get_products_report(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,  # exclusive
+    limit: int = 50,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    # Defaults to the current year to date
+    date_to = date_to or datetime.utcnow()
+    date_from = date_from or date_to.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if date_from >= date_to:
+        raise HTTPException(status_code=400, detail="date_from must be before date_to")
+    return product_sales.product_report(db, current_user.id, date_from, date_to, limit)
+
+@api_router.post("/reports/products/jobs", status_code=202, response_model=schemas.Job)
+async def create_products_report_job(
+    response: Response,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,  # exclusive
+    limit: int = 50,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Same report computed by a worker, for ranges too long to wait for
+    date_to = date_to or datetime.utcnow()
+    date_from = date_from or date_to.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if date_from >= date_to:
+        raise HTTPException(status_code=400, detail="date_from must be before date_to")
+    job = jobs.enqueue(db, "product_report", {
+        "date_from": date_from.isoformat(), "date_to": date_to.isoformat(), "limit": limit
+    }, current_user.id)
+    db.commit()
+    return accepted(response, job)
+
+# Aging buckets: (label, days past due_date from, to); unpaid = sent or overdue
+AGING_BUCKETS = [("current", None, 0), ("1-30", 0, 30), ("31-60", 30, 60), ("61-90", 60, 90), ("90+", 90, None)]
+UNPAID_STATUSES = ["Envoyé", "En retard"]
+
+def aging_conditions(as_of: datetime) -> dict:
+    conditions = {}
+    for label, days_from, days_to in AGING_BUCKETS:
+        if days_from is None:
+            conditions[label] = or_(Invoice.due_date.is_(None), Invoice.due_date >= as_of)
+        elif days_to is None:
+            conditions[label] = Invoice.due_date < as_of - timedelta(days=days_from)
+        else:
+            conditions[label] = and_(
+                Invoice.due_date < as_of - timedelta(days=days_from),
+                Invoice.due_date >= as_of - timedelta(days=days_to)
+            )
+    return conditions
+
+def aging_bucket(due_date: datetime, as_of: datetime) -> str:
+    if due_date is None or due_date >= as_of:
+        return "current"
+    days = (as_of - due_date).days
+    for label, days_from, days_to in AGING_BUCKETS[1:]:
+        if days_to is None or days < days_to:
+            return label
+
+@api_router.get("/reports/aging")
+async def get_aging_report(
+    client_id: str = None,
+    limit: int = 100,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    as_of = datetime.utcnow()
+    conditions = aging_conditions(as_of)
+    
+    # One grouped pass over the tenant's unpaid invoices, one SUM(CASE) per bucket
+    # of what is left to pay (partial payments deducted)
+    query = db.query(
+        Invoice.client_id,
+        func.count(),
+        *[func.coalesce(func.sum(case((condition, Invoice.balance_due), else_=0)), 0) for condition in conditions.values()]
+    ).filter(
+        Invoice.user_id == current_user.id,
+        Invoice.status.in_(UNPAID_STATUSES)
+    )
+    if client_id:
+        query = query.filter(Invoice.client_id == client_id)
+    rows = query.group_by(Invoice.client_id).all()
+    
+    totals = {label: 0.0 for label in conditions}
+    clients = []
+    for row_client_id, invoice_count, *amounts in rows:
+        buckets = dict(zip(conditions, amounts))
+        for label, amount in buckets.items():
+            totals[label] += amount
+        clients.append({
+            "client_id": row_client_id,
+            "invoice_count": invoice_count,
+            **buckets,
+            "total": sum(amounts)
+        })
+    totals["total"] = sum(totals.values())
+    
+    # Totals cover every client; only the largest balances are listed
+    clients.sort(key=lambda entry: entry["total"], reverse=True)
+    clients_count = len(clients)
+    clients = clients[:max(1, min(limit, 1000))]
+    names = dict(db.query(Client.id, Client.name).filter(
+        Client.id.in_([entry["client_id"] for entry in clients])
+    ).all())
+    for entry in clients:
+        entry["client_name"] = names.get(entry["client_id"], "Unknown")
+    
+    report = {
+        "as_of": as_of.isoformat(),
+        "buckets": list(conditions),
+        "totals": totals,
+        "clients_count": clients_count,
+        "clients": clients
+    }
+    
+    # Drill-down: the client's unpaid invoices, oldest due date first
+    if client_id:
+        invoices = db.query(
+            Invoice.id, Invoice.invoice_number, Invoice.date, Invoice.due_date, Invoice.amount,
+            Invoice.amount_paid, Invoice.balance_due, Invoice.status
+        ).filter(
+            Invoice.user_id == current_user.id,
+            Invoice.status.in_(UNPAID_STATUSES),
+            Invoice.client_id == client_id
+        ).order_by(Invoice.due_date).all()
+        report["invoices"] = [{
+            "id": inv.id,
+            "invoice_number": inv.invoice_number,
+            "date": inv.date.isoformat() if inv.date else None,
+            "due_date": inv.due_date.isoformat() if inv.due_date else None,
+            "amount": inv.amount,
+            "amount_paid": inv.amount_paid,
+            "balance_due": inv.balance_due,
+            "status": inv.status,
+            "days_overdue": max(0, (as_of - inv.due_date).days) if inv.due_date else 0,
+            "bucket": aging_bucket(inv.due_date, as_of)
+        } for inv in invoices]
+    
+    return report
+
+# ============ EMAIL ROUTES ============
+@api_router.get("/emails", response_model=list[schemas.OutboundEmail])
+async def get_emails(
+    document_id: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 50,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    query = db.query(OutboundEmail).filter(OutboundEmail.user_id == current_user.id)
+    if document_id:
+        query = query.filter(OutboundEmail.document_id == document_id)
+    if status:
+        query = query.filter(OutboundEmail.status == status)
+    return query.order_by(desc(OutboundEmail.created_at)).limit(max(1, min(limit, 500))).all()
+
+# ============ WEBHOOK ROUTES ============
+def get_user_webhook(db: Session, user: User, webhook_id: str) -> Webhook:
+    webhook = db.query(Webhook).filter(Webhook.id == webhook_id, Webhook.user_id == user.id).first()
+    if not webhook:
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    return webhook
+
+@api_router.post("/webhooks", response_model=schemas.Webhook)
+async def create_webhook(
+    webhook_data: schemas.WebhookCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    try:
+        webhook = webhooks.create_webhook(db, current_user.id, webhook_data.url, webhook_data.events)
+    except webhooks.WebhookError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    db.commit()
+    db.refresh(webhook)
+    
+    log_activity(db, current_user.id, f"Webhook ajouté: {webhook.url}", "webhook", webhook.id)
+    return webhooks.describe(webhook, with_secret=True)
+
+@api_router.get("/webhooks", response_model=list[schemas.Webhook])
+async def get_webhooks(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return [webhooks.describe(webhook) for webhook in db.query(Webhook).filter(
+        Webhook.user_id == current_user.id
+    ).order_by(Webhook.created_at).all()]
+
+@api_router.delete("/webhooks/{webhook_id}")
+async def delete_webhook(
+    webhook_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    webhook = get_user_webhook(db, current_user, webhook_id)
+    db.query(WebhookDelivery).filter(WebhookDelivery.webhook_id == webhook.id).delete(synchronize_session=False)
+    db.delete(webhook)
+    db.commit()
+    return {"message": "Webhook deleted"}
+
+@api_router.get("/webhooks/{webhook_id}/deliveries", response_model=list[schemas.WebhookDelivery])
+async def get_webhook_deliveries(
+    webhook_id: str,
+    status: Optional[str] = None,
+    limit: int = 100,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    webhook = get_user_webhook(db, current_user, webhook_id)
+    query = db.query(WebhookDelivery, OutboxEvent).join(OutboxEvent, OutboxEvent.id == WebhookDelivery.event_id).filter(
+        WebhookDelivery.webhook_id == webhook.id
+    )
+    if status:
+        query = query.filter(WebhookDelivery.status == status)
+    return [{
+        "id": delivery.id,
+        "event_id": event.id,
+        "event_type": event.event_type,
+        "resource_type": event.resource_type,
+        "resource_id": event.resource_id,
+        "status": delivery.status,
+        "attempts": delivery.attempts,
+        "last_status_code": delivery.last_status_code,
+        "last_error": delivery.last_error,
+        "created_at": delivery.created_at,
+        "delivered_at": delivery.delivered_at,
+    } for delivery, event in query.order_by(desc(WebhookDelivery.sequence)).limit(max(1, min(limit, 1000)))]
+
+@api_router.post("/webhooks/{webhook_id}/deliveries/replay")
+async def replay_webhook_deliveries(
+    webhook_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Dead-lettered events are queued again and the endpoint re-enabled
+    webhook = get_user_webhook(db, current_user, webhook_id)
+    replayed = webhooks.replay_dead(db, webhook)
+    db.commit()
+    return {"replayed": replayed}
+
+# ============ JOB ROUTES ============
+@api_router.get("/jobs", response_model=list[schemas.Job])
+async def get_jobs(
+    limit: int = 50,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    return [jobs.describe(job) for job in db.query(Job).filter(
+        Job.user_id == current_user.id
+    ).order_by(desc(Job.created_at)).limit(max(1, min(limit, 500))).all()]
+
+@api_router.get("/jobs/{job_id}", response_model=schemas.Job)
+async def get_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    job = db.query(Job).filter(Job.id == job_id, Job.user_id == current_user.id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.describe(job)
+
+# ============ ADMIN ROUTES ============
+@api_router.get("/admin/slow-queries")
+async def get_slow_queries(
+    limit: int = 50,
+    min_duration_ms: float = 0,
+    route: str = None,
+    admin_user: User = Depends(get_admin_user)
+):
+    return {
+        "threshold_ms": slowlog.slow_query_log.threshold_ms,
+        "explain": slowlog.slow_query_log.explain,
+        "queries": slowlog.slow_query_log.entries(limit, min_duration_ms, route)
+    }
+
+@api_router.delete("/admin/slow-queries")
+async def clear_slow_queries(admin_user: User = Depends(get_admin_user)):
+    slowlog.slow_query_log.clear()
+    return {"message": "Slow query log cleared"}
+
 # ============ BASIC ROUTES ============
 @api_router.get("/")
 async def root():
     return {"message": "InvoiceFlow API v2.0 is running!", "features": ["invoices", "quotes", "expenses", "products", "reports"]}
 
 @api_router.get("/health")
+@api_router.get("/health/live")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow(), "version": "2.0.0"}
 
+@api_router.get("/health/ready")
+async def readiness_check(db: Session = Depends(get_db)):
+    try:
+        db.execute(text("SELECT 1"))
+    except Exception as e:
+        logger.error(f"Readiness check failed: {e}")
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    return {"status": "ready", "timestamp": datetime.utcnow(), "version": "2.0.0"}
+
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.registry.expose(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,258 @@
+from sqlalchemy import select, delete, update, insert, event, func, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from bisect import bisect
+from pathlib import Path
+from dotenv import load_dotenv
+import hashlib
+import logging
+import time
+import os
+import typer
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from database import engine, shard_engines, Base, GLOBAL_TABLES
+from models import User, generate_uuid
+
+# Placement des tenants : un anneau de hachage cohérent choisit le shard d'un
+# nouveau tenant, puis users.shard (l'annuaire, sur la base principale) fait
+# foi. Ajouter un shard ne déplace donc personne ; `move` rééquilibre.
+# Pendant le gel d'un déplacement, les requêtes sont refusées (auth.py) et
+# les écritures de fond (jobs, planificateur, abonnements) sautent le tenant :
+# elles vérifient l'annuaire avant d'écrire, dans la fenêtre de drainage.
+
+logger = logging.getLogger(__name__)
+
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))  # Points par shard sur l'anneau
+SHARD_MOVE_BATCH_SIZE = int(os.getenv("SHARD_MOVE_BATCH_SIZE", "1000"))
+SHARD_MOVE_DRAIN_SECONDS = float(os.getenv("SHARD_MOVE_DRAIN_SECONDS", "5"))  # Requêtes en cours avant le gel
+
+# Tables sans user_id : rattachées au tenant par leur parent
+TENANT_CHILDREN = {
+    "invoice_items": ("invoice_id", "invoices"),
+    "quote_items": ("quote_id", "quotes"),
+    "recurring_invoice_items": ("recurring_id", "recurring_invoices"),
+}
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    def __init__(self, names: list, vnodes: int = SHARD_VNODES):
+        points = sorted((_hash(f"{name}#{i}"), name) for name in names for i in range(vnodes))
+        self.keys = [key for key, _ in points]
+        self.names = [name for _, name in points]
+
+    def place(self, key: str):
+        if not self.keys:
+            return None
+        return self.names[bisect(self.keys, _hash(key)) % len(self.keys)]
+
+ring = HashRing(sorted(shard_engines))
+
+def shard_engine(shard: str) -> Engine:
+    return engine if shard is None else shard_engines[shard]
+
+def assign_shard(user: User):
+    # Appelé à l'inscription, avant le commit de l'annuaire
+    if user.id is None:
+        user.id = generate_uuid()
+    user.shard = ring.place(user.id)
+    return user.shard
+
+class TenantMoving(Exception):
+    """The tenant is frozen for a move, or now lives on another shard"""
+
+def writable_tenants(shard: str, user_ids) -> set:
+    """Tenants among user_ids that the directory places on this shard, outside a move"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return set()
+    bind = shard_engine(shard)
+    users = User.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(select(users.c.id, users.c.shard).where(
+            users.c.id.in_(user_ids), users.c.shard_state.is_(None)
+        )).all()
+    # Un shard déclaré sur l'URL de la base principale est la base principale
+    return {row.id for row in rows if (engine if row.shard is None else shard_engines.get(row.shard)) is bind}
+
+def fence_session(db: Session, user_id: str):
+    """Refuse the session's commits once the tenant is frozen for a move (background writers)"""
+    shard = db.info.get("tenant", {}).get("shard")
+
+    def check_directory(session):
+        if user_id not in writable_tenants(shard, [user_id]):
+            raise TenantMoving(user_id)
+
+    event.listen(db, "before_commit", check_directory)
+
+def provision_tenant(user: User, bind: Engine = None):
+    # Copie de la ligne users sur le shard : les clés étrangères user_id y pointent
+    bind = bind if bind is not None else shard_engine(user.shard)
+    if bind is engine:
+        return
+    table = User.__table__
+    row = {column.name: getattr(user, column.key) for column in User.__mapper__.columns}
+    with bind.begin() as conn:
+        if conn.execute(select(table.c.id).where(table.c.id == user.id)).first() is None:
+            conn.execute(insert(table), [row])
+
+def tenant_tables() -> list:
+    """(table, filter) for every tenant table, parents first"""
+    tables = []
+    for table in Base.metadata.sorted_tables:
+        if table.name in GLOBAL_TABLES:
+            continue
+        if "user_id" in table.c:
+            tables.append((table, lambda user_id, table=table: table.c.user_id == user_id))
+        elif table.name in TENANT_CHILDREN:
+            column, parent_name = TENANT_CHILDREN[table.name]
+            parent = Base.metadata.tables[parent_name]
+            tables.append((table, lambda user_id, table=table, column=column, parent=parent: table.c[column].in_(
+                select(parent.c.id).where(parent.c.user_id == user_id)
+            )))
+        else:
+            raise RuntimeError(f"Table {table.name} is not attached to a tenant (see TENANT_CHILDREN)")
+    return tables
+
+def _rows(conn, table, condition, batch_size: int):
+    result = conn.execution_options(stream_results=True).execute(select(table).where(condition))
+    for rows in result.mappings().partitions(batch_size):
+        yield [dict(row) for row in rows]
+
+def copy_tenant(source: Engine, target: Engine, user_id: str, batch_size: int = SHARD_MOVE_BATCH_SIZE) -> dict:
+    counts = {}
+    with source.connect() as src, target.begin() as dst:
+        for table, condition in tenant_tables():
+            counts[table.name] = 0
+            for rows in _rows(src, table, condition(user_id), batch_size):
+                dst.execute(insert(table), rows)
+                counts[table.name] += len(rows)
+    return counts
+
+def purge_tenant(bind: Engine, user_id: str) -> dict:
+    counts = {}
+    with bind.begin() as conn:
+        # Enfants d'abord (clés étrangères)
+        for table, condition in reversed(tenant_tables()):
+            counts[table.name] = conn.execute(delete(table).where(condition(user_id))).rowcount
+    return counts
+
+def reconcile_tenant(source: Engine, target: Engine, user_id: str, batch_size: int = SHARD_MOVE_BATCH_SIZE) -> dict:
+    """Apply to the target only what changed on the source since copy_tenant"""
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+    stale = []
+    with source.connect() as src, target.begin() as dst:
+        for table, condition in tenant_tables():
+            existing = {row["id"]: dict(row) for row in dst.execute(select(table).where(condition(user_id))).mappings()}
+            for rows in _rows(src, table, condition(user_id), batch_size):
+                new_rows = []
+                for row in rows:
+                    current = existing.pop(row["id"], None)
+                    if current is None:
+                        new_rows.append(row)
+                    elif current != row:
+                        dst.execute(update(table).where(table.c.id == row["id"]).values(row))
+                        counts["updated"] += 1
+                if new_rows:
+                    dst.execute(insert(table), new_rows)
+                    counts["inserted"] += len(new_rows)
+            stale.append((table, list(existing)))
+        for table, ids in reversed(stale):
+            for start in range(0, len(ids), batch_size):
+                counts["deleted"] += dst.execute(delete(table).where(table.c.id.in_(ids[start:start + batch_size]))).rowcount
+    return counts
+
+def advance_identities(bind: Engine):
+    """Move IDENTITY sequences past the copied rows, so new rows sort after them"""
+    if bind.dialect.name != "postgresql":
+        return  # SQLite : numérotées par MAX + 1 à l'insertion
+    with bind.begin() as conn:
+        for table, _ in tenant_tables():
+            for column in table.c:
+                if column.identity is None:
+                    continue
+                top = conn.execute(select(func.coalesce(func.max(column), 0))).scalar()
+                conn.execute(text(
+                    "SELECT setval(pg_get_serial_sequence(:table, :column), "
+                    "GREATEST(nextval(pg_get_serial_sequence(:table, :column)), :top + 1), false)"
+                ), {"table": table.name, "column": column.name, "top": top})
+
+def _set_directory(user_id: str, **values):
+    with engine.begin() as conn:
+        conn.execute(update(User.__table__).where(User.__table__.c.id == user_id).values(**values))
+
+def move_tenant(user_id: str, target_shard: str, drain_seconds: float = SHARD_MOVE_DRAIN_SECONDS,
+                batch_size: int = SHARD_MOVE_BATCH_SIZE) -> dict:
+    """Move a tenant between shards; writes are only refused during the final reconcile"""
+    with engine.connect() as conn:
+        user = conn.execute(select(User.__table__).where(User.__table__.c.id == user_id)).mappings().first()
+    if user is None:
+        raise ValueError(f"Unknown tenant {user_id}")
+    if target_shard is not None and target_shard not in shard_engines:
+        raise ValueError(f"Unknown shard {target_shard}")
+    source, target = shard_engine(user["shard"]), shard_engine(target_shard)
+    if source is target:
+        return {"moved": False}
+
+    Base.metadata.create_all(bind=target)
+    if target is not engine:
+        with target.begin() as conn:
+            table = User.__table__
+            if conn.execute(select(table.c.id).where(table.c.id == user_id)).first() is None:
+                conn.execute(insert(table), [dict(user)])
+
+    # 1. Copie en ligne : le tenant continue de lire et d'écrire sur la source
+    purge_tenant(target, user_id)  # reste d'un déplacement interrompu
+    copied = copy_tenant(source, target, user_id, batch_size)
+
+    # 2. Gel des écritures, le temps que les requêtes en cours se terminent,
+    # puis rattrapage des seules lignes modifiées depuis la copie
+    _set_directory(user_id, shard_state="moving")
+    try:
+        time.sleep(drain_seconds)
+        reconciled = reconcile_tenant(source, target, user_id, batch_size)
+        advance_identities(target)
+        _set_directory(user_id, shard=target_shard, shard_state=None)
+    except Exception:
+        _set_directory(user_id, shard_state=None)
+        raise
+
+    # 3. Nettoyage de la source (la ligne users reste sur la base principale)
+    purged = purge_tenant(source, user_id)
+    if source is not engine:
+        with source.begin() as conn:
+            conn.execute(delete(User.__table__).where(User.__table__.c.id == user_id))
+    return {"moved": True, "copied": copied, "reconciled": reconciled, "purged": sum(purged.values())}
+
+app = typer.Typer(help="Tenant shard placement and online rebalancing")
+
+@app.command()
+def placement():
+    """Tenants per shard, according to the directory"""
+    with engine.connect() as conn:
+        rows = conn.execute(select(User.__table__.c.shard, User.__table__.c.id)).all()
+    counts = {}
+    for shard, _ in rows:
+        counts[shard or "(primary)"] = counts.get(shard or "(primary)", 0) + 1
+    for shard in ["(primary)"] + sorted(shard_engines):
+        typer.echo(f"{shard:20} {counts.get(shard, 0):>8,}")
+
+@app.command()
+def move(
+    user_id: str = typer.Argument(..., help="Tenant (user) id"),
+    target: str = typer.Argument(..., help="Target shard name, or 'primary'"),
+    drain_seconds: float = typer.Option(SHARD_MOVE_DRAIN_SECONDS, help="Wait for in-flight writes after the freeze"),
+    batch_size: int = typer.Option(SHARD_MOVE_BATCH_SIZE, help="Rows per copy batch"),
+):
+    """Move one tenant to another shard while it stays online"""
+    started = time.perf_counter()
+    result = move_tenant(user_id, None if target == "primary" else target, drain_seconds, batch_size)
+    typer.echo(f"{result} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    app()
@@ -0,0 +1,147 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from collections import deque, OrderedDict
+from datetime import datetime
+from metrics import current_request
+import threading
+import logging
+import re
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() == "true"
+# EXPLAIN ANALYZE réexécute la requête : désactivé par défaut, et réservé aux SELECT simples
+SLOW_QUERY_EXPLAIN_ANALYZE = os.getenv("SLOW_QUERY_EXPLAIN_ANALYZE", "false").lower() == "true"
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))  # secondes par requête
+SLOW_QUERY_EXPLAIN_PER_MINUTE = int(os.getenv("SLOW_QUERY_EXPLAIN_PER_MINUTE", "10"))  # par worker
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("SLOW_QUERY_BUFFER_SIZE", "200"))
+SLOW_QUERY_MAX_STATEMENT_LENGTH = 4000
+EXPLAIN_SAMPLES_TRACKED = 1000
+
+# Verrous de ligne ou séquences : la réexécution aurait des effets
+NOT_BARE_SELECT = re.compile(r"\bfor\s+(update|share|no\s+key\s+update|key\s+share)\b|\b(nextval|setval|pg_advisory\w*)\s*\(")
+
+def redact(value):
+    # Seuls la forme et le type des paramètres sont conservés
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return f"<{type(value).__name__}>"
+
+class SlowQueryLog:
+    """Bounded ring buffer of statements slower than the threshold"""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_THRESHOLD_MS, explain: bool = SLOW_QUERY_EXPLAIN,
+                 size: int = SLOW_QUERY_BUFFER_SIZE):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._explained = OrderedDict()  # requête -> dernier EXPLAIN
+        self._explain_times = deque()
+
+    def should_explain(self, statement: str, now: float = None) -> bool:
+        """Sample EXPLAIN: once per statement per interval, and a few per minute overall"""
+        now = now or time.monotonic()
+        with self._lock:
+            last = self._explained.get(statement)
+            if last is not None and now - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+                return False
+            while self._explain_times and now - self._explain_times[0] >= 60:
+                self._explain_times.popleft()
+            if len(self._explain_times) >= SLOW_QUERY_EXPLAIN_PER_MINUTE:
+                return False
+            self._explain_times.append(now)
+            self._explained[statement] = now
+            self._explained.move_to_end(statement)
+            if len(self._explained) > EXPLAIN_SAMPLES_TRACKED:
+                self._explained.popitem(last=False)
+            return True
+
+    def record(self, entry: dict):
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self, limit: int = 50, min_duration_ms: float = 0, route: str = None) -> list:
+        with self._lock:
+            entries = list(self._entries)
+        entries = [
+            entry for entry in reversed(entries)
+            if entry["duration_ms"] >= min_duration_ms and (route is None or entry["route"] == route)
+        ]
+        return entries[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._explained.clear()
+            self._explain_times.clear()
+
+slow_query_log = SlowQueryLog()
+
+def is_bare_select(statement: str) -> bool:
+    text = statement.lstrip().lower()
+    return text.startswith("select") and not NOT_BARE_SELECT.search(text)
+
+def explain_statement(dialect_name: str, cursor, statement: str, parameters, analyze: bool = False) -> list:
+    # Curseur DBAPI séparé : ne déclenche pas les événements SQLAlchemy.
+    # EXPLAIN seul n'exécute rien ; ANALYZE seulement pour un SELECT simple
+    if not statement.lstrip().lower().startswith(("select", "with")):
+        return None
+    if dialect_name == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if analyze and is_bare_select(statement) else "EXPLAIN "
+    elif dialect_name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        return None
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters)
+        return [" ".join(str(col) for col in row) for row in explain_cursor.fetchall()]
+    finally:
+        explain_cursor.close()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("slowlog_start_time", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - conn.info["slowlog_start_time"].pop()) * 1000
+    if duration_ms < slow_query_log.threshold_ms:
+        return
+
+    stats = current_request.get()
+    entry = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "duration_ms": round(duration_ms, 3),
+        "route": stats.route if stats is not None else None,
+        "statement": statement[:SLOW_QUERY_MAX_STATEMENT_LENGTH],
+        "parameters": redact(parameters),
+        "executemany": executemany,
+        "plan": None
+    }
+    if slow_query_log.explain and not executemany and slow_query_log.should_explain(statement):
+        try:
+            entry["plan"] = explain_statement(conn.dialect.name, cursor, statement, parameters,
+                                              SLOW_QUERY_EXPLAIN_ANALYZE)
+        except Exception as e:
+            entry["plan"] = [f"EXPLAIN failed: {e}"]
+
+    slow_query_log.record(entry)
+    logger.warning(
+        f"Slow query ({entry['duration_ms']} ms) on {entry['route']}: "
+        f"{' '.join(statement.split())[:500]} params={entry['parameters']}"
+    )
+
+def instrument_engine(engine: Engine):
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,121 @@
+from sqlalchemy import select, union_all, literal, case, func
+from sqlalchemy.engine import Engine
+from datetime import datetime
+from models import Invoice, Payment, Quote, Expense
+import json
+import csv
+import io
+
+# Relevé client : factures (débit), règlements (crédit), devis et dépenses
+# refacturables (pour information). Solde progressif calculé en SQL par une
+# fonction de fenêtre, lignes lues et envoyées au fil de l'eau.
+
+STATEMENT_BATCH_SIZE = 1000
+STATEMENT_COLUMNS = ["entry_date", "entry_type", "reference", "description", "status", "amount", "debit", "credit", "balance"]
+
+# Ni brouillons ni factures annulées dans le solde
+NOT_ISSUED_STATUSES = ["Brouillon", "Annulé"]
+
+def _in_range(column, date_from: datetime, date_to: datetime):
+    conditions = []
+    if date_from is not None:
+        conditions.append(column >= date_from)
+    if date_to is not None:
+        conditions.append(column <= date_to)
+    return conditions
+
+def entries_query(user_id: str, client_id: str, date_from: datetime = None, date_to: datetime = None):
+    issued = ~Invoice.status.in_(NOT_ISSUED_STATUSES)
+    invoice_scope = [Invoice.user_id == user_id, Invoice.client_id == client_id, *_in_range(Invoice.date, date_from, date_to)]
+    invoices = select(
+        Invoice.date.label("entry_date"), literal("invoice").label("entry_type"),
+        Invoice.invoice_number.label("reference"), Invoice.description.label("description"),
+        Invoice.status.label("status"), Invoice.amount.label("amount"),
+        case((issued, Invoice.amount), else_=0.0).label("debit"), literal(0.0).label("credit"),
+        literal(0).label("sort_order")
+    ).where(*invoice_scope)
+    # Règlements datés de leur encaissement, référencés par leur facture
+    payments = select(
+        Payment.payment_date, literal("payment"), Invoice.invoice_number,
+        func.coalesce(Payment.reference, Payment.method), Invoice.status,
+        Payment.amount, literal(0.0), Payment.amount, literal(1)
+    ).join(Invoice, Invoice.id == Payment.invoice_id).where(
+        Payment.user_id == user_id, Payment.client_id == client_id,
+        *_in_range(Payment.payment_date, date_from, date_to)
+    )
+    quotes = select(
+        Quote.date, literal("quote"), Quote.quote_number, Quote.description,
+        Quote.status, Quote.amount, literal(0.0), literal(0.0), literal(2)
+    ).where(Quote.user_id == user_id, Quote.client_id == client_id, *_in_range(Quote.date, date_from, date_to))
+    expenses = select(
+        Expense.expense_date, literal("expense"), Expense.title, Expense.description,
+        Expense.status, Expense.amount, literal(0.0), literal(0.0), literal(3)
+    ).where(
+        Expense.user_id == user_id, Expense.client_id == client_id, Expense.is_billable.is_(True),
+        *_in_range(Expense.expense_date, date_from, date_to)
+    )
+    entries = union_all(invoices, payments, quotes, expenses).subquery("entries")
+    order = (entries.c.entry_date, entries.c.sort_order, entries.c.reference)
+    return select(
+        *[entries.c[name] for name in STATEMENT_COLUMNS[:-1]],
+        func.sum(entries.c.debit - entries.c.credit).over(order_by=order, rows=(None, 0)).label("balance")
+    ).order_by(*order)
+
+def opening_balance(conn, user_id: str, client_id: str, date_from: datetime) -> float:
+    if date_from is None:
+        return 0.0
+    debit = conn.execute(select(func.sum(Invoice.amount)).where(
+        Invoice.user_id == user_id, Invoice.client_id == client_id, Invoice.date < date_from,
+        ~Invoice.status.in_(NOT_ISSUED_STATUSES)
+    )).scalar() or 0.0
+    credit = conn.execute(select(func.sum(Payment.amount)).where(
+        Payment.user_id == user_id, Payment.client_id == client_id, Payment.payment_date < date_from
+    )).scalar() or 0.0
+    return debit - credit
+
+def _entries(conn, user_id, client_id, date_from, date_to, opening):
+    result = conn.execution_options(stream_results=True, yield_per=STATEMENT_BATCH_SIZE).execute(
+        entries_query(user_id, client_id, date_from, date_to)
+    )
+    for row in result:
+        entry = dict(row._mapping)
+        entry["entry_date"] = entry["entry_date"].isoformat() if entry["entry_date"] else None
+        entry["balance"] = round(opening + entry["balance"], 2)
+        yield entry
+
+def stream_json(bind: Engine, client: dict, user_id: str, date_from: datetime = None, date_to: datetime = None):
+    with bind.connect() as conn:
+        opening = opening_balance(conn, user_id, client["id"], date_from)
+        header = {
+            "client": client,
+            "date_from": date_from.isoformat() if date_from else None,
+            "date_to": date_to.isoformat() if date_to else None,
+            "opening_balance": round(opening, 2),
+        }
+        yield json.dumps(header)[:-1] + ', "entries": ['
+        closing = opening
+        chunk = []
+        for index, entry in enumerate(_entries(conn, user_id, client["id"], date_from, date_to, opening)):
+            closing = entry["balance"]
+            chunk.append(("," if index else "") + json.dumps(entry))
+            if len(chunk) == STATEMENT_BATCH_SIZE:
+                yield "".join(chunk)
+                chunk = []
+        yield "".join(chunk)
+        yield f'], "closing_balance": {json.dumps(round(closing, 2))}}}'
+
+def stream_csv(bind: Engine, client: dict, user_id: str, date_from: datetime = None, date_to: datetime = None):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=STATEMENT_COLUMNS)
+    writer.writeheader()
+    with bind.connect() as conn:
+        opening = opening_balance(conn, user_id, client["id"], date_from)
+        writer.writerow({"entry_date": date_from.isoformat() if date_from else None,
+                         "entry_type": "opening_balance", "balance": round(opening, 2)})
+        for index, entry in enumerate(_entries(conn, user_id, client["id"], date_from, date_to, opening), 1):
+            writer.writerow(entry)
+            if index % STATEMENT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,169 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from sqlalchemy import or_, func, desc, insert, update
+from sqlalchemy.exc import IntegrityError
+from models import Client, Product, SuggestRevision, generate_uuid
+import threading
+import unicodedata
+import os
+
+# Configuration
+SUGGEST_DEFAULT_LIMIT = int(os.getenv("SUGGEST_DEFAULT_LIMIT", "10"))
+SUGGEST_MAX_LIMIT = int(os.getenv("SUGGEST_MAX_LIMIT", "25"))
+SUGGEST_MAX_TENANTS = int(os.getenv("SUGGEST_MAX_TENANTS", "256"))
+
+# Champs recherchés par entité
+SUGGEST_FIELDS = {
+    "clients": (Client, ("name", "email", "siret")),
+    "products": (Product, ("name", "category")),
+}
+
+def normalize(value: str) -> str:
+    """Lowercase and strip accents so 'Société' matches 'societe'"""
+    value = unicodedata.normalize("NFKD", value or "")
+    return "".join(c for c in value if not unicodedata.combining(c)).lower().strip()
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(limit or SUGGEST_DEFAULT_LIMIT, SUGGEST_MAX_LIMIT))
+
+class PrefixIndex:
+    """Sorted (key, id) arrays searched with bisect for prefix matches"""
+
+    def __init__(self, entries, stamp: int = None):
+        entries = sorted(set(entries))
+        self.keys = [key for key, _ in entries]
+        self.ids = [row_id for _, row_id in entries]
+        self.stamp = stamp
+
+    def search(self, prefix: str, limit: int) -> list:
+        results = []
+        seen = set()
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix):
+            row_id = self.ids[i]
+            if row_id not in seen:
+                seen.add(row_id)
+                results.append(row_id)
+                if len(results) >= limit:
+                    break
+            i += 1
+        return results
+
+def index_keys(values) -> set:
+    keys = set()
+    for value in values:
+        value = normalize(value)
+        if not value:
+            continue
+        keys.add(value)
+        keys.update(word for word in value.replace("@", " ").replace(".", " ").split() if word)
+    return keys
+
+class SuggestIndexCache:
+    """Per-process, per-tenant prefix indexes used when pg_trgm is unavailable.
+
+    Each worker keeps its own copy, so an index is only reused while the
+    tenant's revision (see touch) is unchanged: one primary-key lookup per
+    call, and a write made through any worker bumps it.
+    """
+
+    def __init__(self, max_tenants: int = SUGGEST_MAX_TENANTS):
+        self.max_tenants = max_tenants
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, user_id: str, entity: str) -> PrefixIndex:
+        cache_key = (user_id, entity)
+        stamp = self._stamp(db, user_id, entity)
+        with self._lock:
+            index = self._indexes.get(cache_key)
+            if index is not None and index.stamp == stamp:
+                self._indexes.move_to_end(cache_key)
+                return index
+
+        index = self._build(db, user_id, entity, stamp)
+        with self._lock:
+            self._indexes[cache_key] = index
+            self._indexes.move_to_end(cache_key)
+            while len(self._indexes) > self.max_tenants:
+                self._indexes.popitem(last=False)
+        return index
+
+    def _stamp(self, db: Session, user_id: str, entity: str) -> int:
+        return db.query(SuggestRevision.revision).filter(
+            SuggestRevision.user_id == user_id,
+            SuggestRevision.entity == entity
+        ).scalar() or 0
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def _build(self, db: Session, user_id: str, entity: str, stamp: int = None) -> PrefixIndex:
+        model, fields = SUGGEST_FIELDS[entity]
+        columns = [getattr(model, field) for field in fields]
+        rows = db.query(model.id, *columns).filter(model.user_id == user_id).all()
+        entries = []
+        for row in rows:
+            for key in index_keys(row[1:]):
+                entries.append((key, row[0]))
+        return PrefixIndex(entries, stamp)
+
+suggest_cache = SuggestIndexCache()
+
+def touch(db: Session, user_id: str, entity: str):
+    """Bump the tenant's revision for entity (caller commits, with the write)"""
+    table = SuggestRevision.__table__
+    bump = update(table).where(table.c.user_id == user_id, table.c.entity == entity).values(
+        revision=table.c.revision + 1
+    )
+    if db.execute(bump).rowcount:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(insert(table).values(id=generate_uuid(), user_id=user_id, entity=entity, revision=1))
+    except IntegrityError:
+        # Créée en parallèle par une autre transaction
+        db.execute(bump)
+
+def escape_like(value: str) -> str:
+    return value.replace("/", "//").replace("%", "/%").replace("_", "/_")
+
+def _suggest_trigram(db: Session, user_id: str, entity: str, q: str, limit: int) -> list:
+    model, fields = SUGGEST_FIELDS[entity]
+    columns = [getattr(model, field) for field in fields]
+    pattern = f"{escape_like(q)}%"
+
+    # ILIKE 'q%' and the % operator (pg_trgm.similarity_threshold) are both
+    # served by the gin_trgm_ops indexes declared in models.py
+    matches = []
+    for column in columns:
+        matches.append(column.ilike(pattern, escape="/"))
+        matches.append(column.op("%")(q))
+    score = func.greatest(*[func.coalesce(func.similarity(column, q), 0) for column in columns])
+
+    return db.query(model).filter(
+        model.user_id == user_id,
+        or_(*matches)
+    ).order_by(desc(score), columns[0]).limit(limit).all()
+
+def _suggest_prefix(db: Session, user_id: str, entity: str, q: str, limit: int) -> list:
+    model, _ = SUGGEST_FIELDS[entity]
+    prefix = normalize(q)
+    if not prefix:
+        return []
+    ids = suggest_cache.get(db, user_id, entity).search(prefix, limit)
+    if not ids:
+        return []
+    rows = {row.id: row for row in db.query(model).filter(model.id.in_(ids)).all()}
+    return [rows[row_id] for row_id in ids if row_id in rows]
+
+def suggest(db: Session, user_id: str, entity: str, q: str, limit: int = SUGGEST_DEFAULT_LIMIT) -> list:
+    q = (q or "").strip()
+    if not q:
+        return []
+    limit = clamp_limit(limit)
+    if db.get_bind().dialect.name == "postgresql":
+        return _suggest_trigram(db, user_id, entity, q, limit)
+    return _suggest_prefix(db, user_id, entity, q, limit)
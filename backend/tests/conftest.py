@@ -0,0 +1,61 @@
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+# Base SQLite jetable : à définir avant tout import du backend,
+# database.py lit DATABASE_URL à l'import
+TEST_DB_DIR = tempfile.mkdtemp(prefix="invoiceflow-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DB_DIR, 'invoiceflow-test.db')}"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ["SHARD_URLS"] = ""
+os.environ["SCHEDULER_ENABLED"] = "false"
+os.environ["RATE_LIMIT_ENABLED"] = "false"
+os.environ["EMAIL_ENABLED"] = "false"
+os.environ["RECEIPTS_DIR"] = os.path.join(TEST_DB_DIR, "receipts")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient  # noqa: E402
+import init_db  # noqa: E402
+
+init_db.init_db()
+
+import server  # noqa: E402
+from auth import verify_token  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def user(client):
+    """A fresh tenant: id, email and Authorization headers"""
+    email = f"{uuid.uuid4().hex[:12]}@example.fr"
+    client.post("/api/register", json={"email": email, "password": "secret123", "name": "Test"})
+    token = client.post("/api/login", json={"email": email, "password": "secret123"}).json()["access_token"]
+    return {"id": verify_token(token), "email": email, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+@pytest.fixture
+def customer(client, user):
+    """A client of the tenant, to invoice"""
+    response = client.post("/api/clients", json={"name": "Société Test", "email": "compta@test.fr"},
+                           headers=user["headers"])
+    assert response.status_code == 200
+    return response.json()
+
+
+def create_invoice(client, user, customer, price: float = 100.0, **fields) -> dict:
+    response = client.post("/api/invoices", json={
+        "client_id": customer["id"],
+        "items": [{"description": "Prestation", "quantity": 1, "price": price, "tax_rate": 0}],
+        **fields,
+    }, headers=user["headers"])
+    assert response.status_code == 200, response.text
+    return response.json()
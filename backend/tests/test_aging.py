@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from conftest import create_invoice
+
+
+def due_in(days: int) -> str:
+    return (datetime.utcnow() + timedelta(days=days)).replace(microsecond=0).isoformat()
+
+
+def test_buckets_hold_what_is_left_to_pay(client, user, customer):
+    other = client.post("/api/clients", json={"name": "Client Lent", "email": "lent@test.fr"},
+                        headers=user["headers"]).json()
+    create_invoice(client, user, customer, 100, status="Envoyé", due_date=due_in(10))
+    partly_paid = create_invoice(client, user, customer, 200, status="Envoyé", due_date=due_in(-10))
+    create_invoice(client, user, customer, 300, status="En retard", due_date=due_in(-45))
+    older = create_invoice(client, user, customer, 400, status="Envoyé", due_date=due_in(-75))
+    create_invoice(client, user, other, 500, status="Envoyé", due_date=due_in(-120))
+    # Hors balance âgée : payée, brouillon
+    create_invoice(client, user, other, 700, status="Payé", due_date=due_in(-120))
+    create_invoice(client, user, other, 900, due_date=due_in(-120))
+    for invoice, amount in ((partly_paid, 50), (older, 100)):
+        client.post(f"/api/invoices/{invoice['id']}/payments", json={"amount": amount}, headers=user["headers"])
+
+    report = client.get("/api/reports/aging", headers=user["headers"]).json()
+    assert report["totals"] == {"current": 100, "1-30": 150, "31-60": 300, "61-90": 300, "90+": 500, "total": 1350}
+    assert report["clients_count"] == 2
+    by_client = {entry["client_id"]: entry for entry in report["clients"]}
+    assert by_client[customer["id"]] == {
+        "client_id": customer["id"], "client_name": customer["name"], "invoice_count": 4,
+        "current": 100, "1-30": 150, "31-60": 300, "61-90": 300, "90+": 0, "total": 850,
+    }
+    assert (by_client[other["id"]]["90+"], by_client[other["id"]]["total"]) == (500, 500)
+    # Plus gros encours en premier
+    assert [entry["client_id"] for entry in report["clients"]] == [customer["id"], other["id"]]
+
+    drill_down = client.get(f"/api/reports/aging?client_id={customer['id']}", headers=user["headers"]).json()
+    assert drill_down["totals"]["total"] == 850
+    assert [(invoice["bucket"], invoice["balance_due"]) for invoice in drill_down["invoices"]] == [
+        ("61-90", 300), ("31-60", 300), ("1-30", 150), ("current", 100),
+    ]
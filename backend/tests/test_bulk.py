@@ -0,0 +1,38 @@
+from conftest import create_invoice
+
+
+def test_bulk_status_reports_each_invoice(client, user, customer):
+    invoices = [create_invoice(client, user, customer, 10 * (index + 1)) for index in range(3)]
+    ids = [invoice["id"] for invoice in invoices]
+    response = client.post("/api/invoices/bulk-status", json={"status": "Payé", "ids": ids + ["unknown"]},
+                           headers=user["headers"])
+    assert response.status_code == 200
+    assert response.json()["updated"] == 3
+    assert {result["id"]: result["outcome"] for result in response.json()["results"]}["unknown"] == "not_found"
+    for invoice in invoices:
+        ledger = client.get(f"/api/invoices/{invoice['id']}/payments", headers=user["headers"]).json()
+        assert [payment["amount"] for payment in ledger] == [invoice["amount"]]
+
+
+def test_bulk_delete_skips_referenced_clients(client, user, customer):
+    create_invoice(client, user, customer)
+    unused = client.post("/api/clients", json={"name": "Sans facture", "email": "libre@test.fr"},
+                         headers=user["headers"]).json()
+    response = client.post("/api/clients/bulk-delete", json={"ids": [customer["id"], unused["id"]]},
+                           headers=user["headers"])
+    outcomes = {result["id"]: result["outcome"] for result in response.json()["results"]}
+    assert outcomes == {customer["id"]: "in_use", unused["id"]: "deleted"}
+
+
+def test_single_delete_refuses_referenced_client_and_product(client, user, customer):
+    product = client.post("/api/products", json={"name": "Audit", "price": 500}, headers=user["headers"]).json()
+    create_invoice(client, user, customer, items=[
+        {"description": "Audit", "quantity": 1, "price": 500, "tax_rate": 0, "product_id": product["id"]}
+    ])
+    assert client.delete(f"/api/clients/{customer['id']}", headers=user["headers"]).status_code == 409
+    assert client.delete(f"/api/products/{product['id']}", headers=user["headers"]).status_code == 409
+    assert client.get(f"/api/clients/{customer['id']}", headers=user["headers"]).status_code == 200
+
+    unused = client.post("/api/products", json={"name": "Formation", "price": 90}, headers=user["headers"]).json()
+    assert client.delete(f"/api/products/{unused['id']}", headers=user["headers"]).status_code == 200
+    assert client.delete(f"/api/products/{unused['id']}", headers=user["headers"]).status_code == 404
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from conftest import create_invoice
+from database import engine
+from models import Client, Invoice
+
+
+def backdate(table, row_id: str, column: str, when: datetime):
+    with engine.begin() as conn:
+        conn.execute(update(table.__table__).where(table.__table__.c.id == row_id).values({column: when}))
+
+
+def pay(client, user, invoice, amount, when: datetime):
+    response = client.post(f"/api/invoices/{invoice['id']}/payments",
+                           json={"amount": amount, "payment_date": when.isoformat()}, headers=user["headers"])
+    assert response.status_code == 200, response.text
+
+
+def test_changes_compare_this_period_with_the_previous_one(client, user, customer):
+    now = datetime.utcnow()
+    previous = now - timedelta(days=45)  # Période précédente (DASHBOARD_PERIOD_DAYS = 30)
+
+    # Période précédente : 2 factures, 1 client, 80 encaissés, 200 restant dû
+    older_client = client.post("/api/clients", json={"name": "Ancien", "email": "ancien@test.fr"},
+                               headers=user["headers"]).json()
+    backdate(Client, older_client["id"], "created_at", previous)
+    unpaid = create_invoice(client, user, customer, 200, status="Envoyé")
+    settled = create_invoice(client, user, customer, 80, status="Envoyé")
+    for invoice in (unpaid, settled):
+        backdate(Invoice, invoice["id"], "date", previous)
+    pay(client, user, settled, 80, previous + timedelta(days=2))
+
+    # Période en cours : 3 factures, 1 client, 150 encaissés, 300 restant dû
+    partly_paid = create_invoice(client, user, customer, 300, status="Envoyé")
+    create_invoice(client, user, customer, 150, status="Envoyé")
+    create_invoice(client, user, customer, 100)
+    pay(client, user, partly_paid, 150, now - timedelta(days=1))
+
+    metrics = client.get("/api/dashboard", headers=user["headers"]).json()["metrics"]
+    assert (metrics["revenue"], metrics["revenue_change"]) == (230, 87.5)
+    assert (metrics["invoices_count"], metrics["invoices_change"]) == (5, 50.0)
+    assert (metrics["clients_count"], metrics["clients_change"]) == (2, 0.0)
+    assert (metrics["pending_amount"], metrics["pending_change"]) == (500, 50.0)
+
+
+def test_changes_can_be_negative(client, user, customer):
+    previous = datetime.utcnow() - timedelta(days=45)
+    for amount in (100, 100):
+        invoice = create_invoice(client, user, customer, amount, status="Envoyé")
+        backdate(Invoice, invoice["id"], "date", previous)
+        pay(client, user, invoice, amount, previous)
+    create_invoice(client, user, customer, 50, status="Envoyé")
+
+    metrics = client.get("/api/dashboard", headers=user["headers"]).json()["metrics"]
+    assert metrics["revenue_change"] == -100.0
+    assert metrics["invoices_change"] == -50.0
+    assert metrics["pending_change"] == 100.0
@@ -0,0 +1,77 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import idempotency
+from database import SessionLocal
+from models import Client, IdempotencyKey
+
+
+def test_retry_replays_the_stored_response(client, user):
+    headers = {**user["headers"], "Idempotency-Key": str(uuid.uuid4())}
+    body = {"name": "Client unique", "email": "unique@test.fr"}
+    first = client.post("/api/clients", json=body, headers=headers)
+    retry = client.post("/api/clients", json=body, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["id"] == first.json()["id"]
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+    db = SessionLocal()
+    try:
+        assert db.query(Client).filter(Client.user_id == user["id"], Client.name == "Client unique").count() == 1
+    finally:
+        db.close()
+
+
+def test_key_reused_for_another_body_is_rejected(client, user):
+    headers = {**user["headers"], "Idempotency-Key": str(uuid.uuid4())}
+    client.post("/api/clients", json={"name": "A", "email": "a@test.fr"}, headers=headers)
+    response = client.post("/api/clients", json={"name": "B", "email": "b@test.fr"}, headers=headers)
+    assert response.status_code == 422
+
+
+def test_errors_are_not_stored(client, user):
+    headers = {**user["headers"], "Idempotency-Key": str(uuid.uuid4())}
+    invalid = client.post("/api/clients", json={"email": "sans-nom@test.fr"}, headers=headers)
+    assert invalid.status_code == 422
+    # La clé est libérée : la requête corrigée est traitée normalement
+    fixed = client.post("/api/clients", json={"name": "Corrigé", "email": "sans-nom@test.fr"}, headers=headers)
+    assert fixed.status_code == 200
+    assert "Idempotent-Replayed" not in fixed.headers
+
+
+def test_in_progress_and_stale_keys(user):
+    key = str(uuid.uuid4())
+    now = datetime.utcnow()
+    request_fingerprint = idempotency.fingerprint("POST", "/api/clients", "", b"{}")
+    assert idempotency.begin(user["id"], key, request_fingerprint, now) is None
+    with pytest.raises(idempotency.IdempotencyError) as error:
+        idempotency.begin(user["id"], key, request_fingerprint, now)
+    assert error.value.status_code == 409
+    # Worker arrêté pendant le traitement : la clé est reprise après le délai de verrou
+    later = now + timedelta(seconds=idempotency.IDEMPOTENCY_LOCK_SECONDS + 1)
+    assert idempotency.begin(user["id"], key, request_fingerprint, later) is None
+
+
+def test_only_create_routes_are_covered(client, user):
+    assert idempotency.is_idempotent_route("/api/invoices")
+    assert idempotency.is_idempotent_route("/api/quotes/abc/convert")
+    assert not idempotency.is_idempotent_route("/api/expenses/abc/receipt")
+    assert not idempotency.is_idempotent_route("/api/invoices/bulk-status")
+
+    # Justificatif lu en flux : aucune clé réservée, pas de rejeu
+    expense = client.post("/api/expenses", json={"title": "Train", "amount": 42, "category": "Transport"},
+                          headers=user["headers"]).json()
+    key = str(uuid.uuid4())
+    headers = {**user["headers"], "Idempotency-Key": key}
+    files = {"file": ("ticket.pdf", b"%PDF-1.4 ticket", "application/pdf")}
+    response = client.post(f"/api/expenses/{expense['id']}/receipt", files=files, headers=headers)
+    assert response.status_code == 200
+    assert "Idempotent-Replayed" not in response.headers
+    db = SessionLocal()
+    try:
+        assert db.query(IdempotencyKey).filter(IdempotencyKey.key == key).count() == 0
+    finally:
+        db.close()
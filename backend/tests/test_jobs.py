@@ -0,0 +1,94 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+import jobs
+from database import SessionLocal
+from models import Job
+
+calls = []
+
+
+@jobs.handler("test_echo")
+def echo(context, value=None, fail=False):
+    calls.append(value)
+    if fail:
+        raise RuntimeError("boom")
+    context.progress(1, 1)
+    return {"value": value}
+
+
+@jobs.handler("test_permanent")
+def permanent(context):
+    raise jobs.JobError("bad params")
+
+
+@pytest.fixture
+def queue():
+    # File vide pour les types de test, quelle que soit l'issue du test précédent
+    db = SessionLocal()
+    db.query(Job).filter(Job.kind.like("test_%")).delete(synchronize_session=False)
+    db.commit()
+    calls.clear()
+    yield db
+    db.close()
+
+
+def enqueue(db, kind, user_id=None, **params):
+    job = jobs.enqueue(db, kind, params, user_id=user_id, max_attempts=2)
+    db.commit()
+    return job.id
+
+
+def test_concurrent_claims_take_distinct_jobs(queue):
+    ids = {enqueue(queue, "test_echo", value=index) for index in range(8)}
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(index):
+        while True:
+            job = jobs.claim(f"worker-{index}", ["test_echo"])
+            if job is None:
+                return
+            with lock:
+                claimed.append(job["id"])
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(ids)
+
+
+def test_success_failure_and_retry(queue, user):
+    done = enqueue(queue, "test_echo", user["id"], value="ok")
+    flaky = enqueue(queue, "test_echo", user["id"], value="ko", fail=True)
+    broken = enqueue(queue, "test_permanent", user["id"])
+    for _ in range(3):
+        job = jobs.claim("worker", ["test_echo", "test_permanent"])
+        jobs.execute(job, "worker")
+
+    queue.expire_all()
+    assert sorted(calls) == ["ko", "ok"]
+    assert queue.get(Job, done).status == "succeeded"
+    assert queue.get(Job, broken).status == "failed"
+    retried = queue.get(Job, flaky)
+    assert (retried.status, retried.attempts) == ("queued", 1)
+    assert retried.run_after > datetime.utcnow()
+
+    # Dernière tentative : échec définitif
+    job = jobs.claim("worker", ["test_echo"], now=retried.run_after + timedelta(seconds=1))
+    jobs.execute(job, "worker")
+    queue.expire_all()
+    assert (queue.get(Job, flaky).status, queue.get(Job, flaky).attempts) == ("failed", 2)
+
+
+def test_stale_running_job_is_requeued(queue):
+    job_id = enqueue(queue, "test_echo", value="stale")
+    assert jobs.claim("gone-worker", ["test_echo"])["id"] == job_id
+    later = datetime.utcnow() + timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1)
+    assert jobs.requeue_stale(later) == 1
+    queue.expire_all()
+    assert (queue.get(Job, job_id).status, queue.get(Job, job_id).locked_by) == ("queued", None)
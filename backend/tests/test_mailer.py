@@ -0,0 +1,139 @@
+import socket
+from datetime import timedelta
+from email import message_from_bytes, policy
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import jobs
+import mailer
+from conftest import create_invoice
+from database import SessionLocal
+from models import Activity, Job, OutboundEmail
+
+
+class Recorder:
+    """Local SMTP stand-in: keeps the messages, or refuses recipients with `reply`"""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = 0
+        self.reply = None
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if self.reply:
+            return self.reply
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(message_from_bytes(envelope.content, policy=policy.default))
+        return "250 Message accepted"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    recorder = Recorder()
+    controller = Controller(recorder, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    monkeypatch.setattr(mailer, "EMAIL_ENABLED", True)
+    monkeypatch.setattr(mailer, "EMAIL_SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(mailer, "EMAIL_SMTP_PORT", controller.port)
+    monkeypatch.setattr(mailer, "EMAIL_SMTP_SECURITY", "none")
+    monkeypatch.setattr(mailer, "EMAIL_SMTP_USERNAME", "")
+    monkeypatch.setattr(mailer, "pool", mailer.SMTPPool())
+
+    db = SessionLocal()
+    db.query(Job).filter(Job.kind == "send_email").delete(synchronize_session=False)
+    db.commit()
+    yield recorder, db
+    db.close()
+    mailer.pool.close()
+    controller.stop()
+
+
+def send_invoice(client, user, customer) -> dict:
+    invoice = create_invoice(client, user, customer, 120)
+    response = client.put(f"/api/invoices/{invoice['id']}/status?status=Envoyé", headers=user["headers"])
+    assert response.status_code == 200
+    return invoice
+
+
+def run_send_job(now=None):
+    job = jobs.claim("mail-worker", ["send_email"], now=now)
+    assert job is not None
+    jobs.execute(job, "mail-worker")
+    return job["id"]
+
+
+def email_for(db, invoice) -> OutboundEmail:
+    db.expire_all()
+    return db.query(OutboundEmail).filter(OutboundEmail.document_id == invoice["id"]).one()
+
+
+def test_sent_invoice_is_delivered(client, user, customer, smtp):
+    recorder, db = smtp
+    invoice = send_invoice(client, user, customer)
+    run_send_job()
+
+    email = email_for(db, invoice)
+    assert (email.status, email.attempts) == ("sent", 1)
+    [message] = recorder.messages
+    assert message["To"] == customer["email"]
+    assert message["Message-ID"] == email.message_id
+    assert invoice["invoice_number"] in message["Subject"]
+
+
+def test_connection_is_reused_across_messages(client, user, customer, smtp):
+    recorder, db = smtp
+    invoices = [send_invoice(client, user, customer) for _ in range(3)]
+    for _ in invoices:
+        run_send_job()
+    assert len(recorder.messages) == 3
+    assert recorder.sessions == 1
+    assert {email_for(db, invoice).status for invoice in invoices} == {"sent"}
+
+
+def test_temporary_refusal_is_retried_with_backoff(client, user, customer, smtp):
+    recorder, db = smtp
+    recorder.reply = "450 4.2.0 Mailbox busy"
+    invoice = send_invoice(client, user, customer)
+    job_id = run_send_job()
+
+    email = email_for(db, invoice)
+    assert (email.status, email.attempts) == ("queued", 1)
+    assert email.error.startswith("450")
+    job = db.get(Job, job_id)
+    assert (job.status, job.attempts) == ("queued", 1)
+
+    # Nouvelle tentative après le délai : le serveur accepte
+    recorder.reply = None
+    run_send_job(now=job.run_after + timedelta(seconds=1))
+    email = email_for(db, invoice)
+    assert (email.status, email.attempts, email.error) == ("sent", 2, None)
+
+
+def test_permanent_refusal_marks_bounced(client, user, customer, smtp):
+    recorder, db = smtp
+    recorder.reply = "550 5.1.1 No such user"
+    invoice = send_invoice(client, user, customer)
+    job_id = run_send_job()
+
+    email = email_for(db, invoice)
+    assert email.status == "bounced" and email.bounced_at is not None
+    assert db.get(Job, job_id).status == "failed"
+    activities = db.query(Activity).filter(Activity.related_id == invoice["id"],
+                                           Activity.description.like("%non distribué%")).all()
+    assert len(activities) == 1
+    assert recorder.messages == []
@@ -0,0 +1,40 @@
+from conftest import create_invoice
+
+
+def samples(text: str) -> dict:
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line and not line.startswith("#")}
+
+
+def test_request_is_measured_under_its_route_template(client, user, customer):
+    invoice = create_invoice(client, user, customer)
+    labels = '{method="GET",route="/api/invoices/{invoice_id}"}'
+    before = samples(client.get("/metrics").text)
+
+    assert client.get(f"/api/invoices/{invoice['id']}", headers=user["headers"]).status_code == 200
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    after = samples(response.text)
+
+    # Gabarit, pas l'identifiant : cardinalité bornée
+    assert invoice["id"] not in response.text
+    assert after[f"http_request_duration_seconds_count{labels}"] == \
+        before.get(f"http_request_duration_seconds_count{labels}", 0) + 1
+    assert after[f'http_requests_total{{method="GET",route="/api/invoices/{{invoice_id}}",status="200"}}'] >= 1
+    assert f'http_request_duration_seconds_bucket{{method="GET",route="/api/invoices/{{invoice_id}}",le="+Inf"}}' in after
+
+    # Compteurs SQL de la requête
+    assert after[f"db_statements_per_request_count{labels}"] == \
+        before.get(f"db_statements_per_request_count{labels}", 0) + 1
+    assert after[f"db_statements_per_request_sum{labels}"] > before.get(f"db_statements_per_request_sum{labels}", 0)
+    assert after[f"db_time_per_request_seconds_sum{labels}"] > before.get(f"db_time_per_request_seconds_sum{labels}", 0)
+    assert after["db_statement_duration_seconds_count"] > before["db_statement_duration_seconds_count"]
+    assert after['db_pool_connections{engine="primary",state="checked_out"}'] >= 0
+
+
+def test_unknown_paths_share_one_series(client):
+    client.get("/api/does-not-exist/123")
+    client.get("/api/does-not-exist/456")
+    text = client.get("/metrics").text
+    assert "/api/does-not-exist" not in text
+    assert 'route="unmatched"' in text
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from conftest import create_invoice
+from database import SessionLocal
+from models import Payment, RecurringInvoice, RecurringInvoiceItem, Invoice
+import recurring
+
+
+def get_invoice(client, user, invoice_id):
+    return client.get(f"/api/invoices/{invoice_id}", headers=user["headers"]).json()
+
+
+def test_partial_payments_update_the_balance(client, user, customer):
+    invoice = create_invoice(client, user, customer, 100, status="Envoyé")
+    url = f"/api/invoices/{invoice['id']}/payments"
+    assert client.post(url, json={"amount": 30}, headers=user["headers"]).status_code == 200
+    current = get_invoice(client, user, invoice["id"])
+    assert (current["amount_paid"], current["balance_due"], current["status"]) == (30, 70, "Envoyé")
+
+    assert client.post(url, json={"amount": 80}, headers=user["headers"]).status_code == 400
+    last = client.post(url, json={"amount": 70}, headers=user["headers"])
+    assert last.status_code == 200
+    current = get_invoice(client, user, invoice["id"])
+    assert (current["amount_paid"], current["balance_due"], current["status"]) == (100, 0, "Payé")
+
+    # Suppression : le solde revient et la facture n'est plus payée
+    assert client.delete(f"/api/payments/{last.json()['id']}", headers=user["headers"]).status_code == 200
+    current = get_invoice(client, user, invoice["id"])
+    assert (current["amount_paid"], current["balance_due"]) == (30, 70)
+    assert current["status"] != "Payé"
+
+
+def test_marking_paid_settles_the_balance(client, user, customer):
+    invoice = create_invoice(client, user, customer, 120, status="Envoyé")
+    client.post(f"/api/invoices/{invoice['id']}/payments", json={"amount": 20}, headers=user["headers"])
+    response = client.put(f"/api/invoices/{invoice['id']}/status?status=Payé", headers=user["headers"])
+    assert response.status_code == 200
+    ledger = client.get(f"/api/invoices/{invoice['id']}/payments", headers=user["headers"]).json()
+    assert sorted(payment["amount"] for payment in ledger) == [20, 100]
+    assert get_invoice(client, user, invoice["id"])["balance_due"] == 0
+
+
+def test_invoice_created_paid_gets_a_payment(client, user, customer):
+    invoice = create_invoice(client, user, customer, 250, status="Payé")
+    assert (invoice["status"], invoice["amount_paid"], invoice["balance_due"]) == ("Payé", 250, 0)
+    ledger = client.get(f"/api/invoices/{invoice['id']}/payments", headers=user["headers"]).json()
+    assert [payment["amount"] for payment in ledger] == [250]
+
+
+def test_recurring_paid_template_records_payments(user, customer):
+    db = SessionLocal()
+    try:
+        template = RecurringInvoice(
+            user_id=user["id"], client_id=customer["id"], cadence="monthly", start_date=datetime(2026, 1, 1),
+            next_run_date=datetime(2026, 1, 1), invoice_status="Payé", due_days=30, discount=0
+        )
+        db.add(template)
+        db.flush()
+        template_id = template.id
+        db.add(RecurringInvoiceItem(recurring_id=template_id, description="Abonnement", quantity=1, price=40,
+                                    tax_rate=0, total=40))
+        db.commit()
+
+        assert recurring.generate_due_invoices(db, datetime(2026, 2, 15)) == 2
+        invoices = db.query(Invoice).filter(Invoice.recurring_id == template_id).all()
+        assert {(invoice.status, invoice.amount_paid, invoice.balance_due) for invoice in invoices} == {("Payé", 40, 0)}
+        payments = db.query(Payment).filter(Payment.invoice_id.in_([invoice.id for invoice in invoices])).all()
+        assert sorted(payment.payment_date for payment in payments) == [datetime(2026, 1, 1), datetime(2026, 2, 1)]
+    finally:
+        db.close()
+
+
+def test_paid_invoice_keeps_its_status_while_payments_exist(client, user, customer):
+    invoice = create_invoice(client, user, customer, 90, status="Envoyé")
+    payment = client.post(f"/api/invoices/{invoice['id']}/payments", json={"amount": 90}, headers=user["headers"]).json()
+    reopen = client.put(f"/api/invoices/{invoice['id']}/status?status=Envoyé", headers=user["headers"])
+    assert reopen.status_code == 409
+    bulk = client.post("/api/invoices/bulk-status", json={"status": "En retard", "ids": [invoice["id"]]},
+                       headers=user["headers"]).json()
+    assert [result["outcome"] for result in bulk["results"]] == ["invalid"]
+    current = get_invoice(client, user, invoice["id"])
+    assert (current["status"], current["balance_due"]) == ("Payé", 0)
+
+    # Règlement supprimé : la facture redevient due
+    client.delete(f"/api/payments/{payment['id']}", headers=user["headers"])
+    current = get_invoice(client, user, invoice["id"])
+    assert (current["status"], current["amount_paid"], current["balance_due"]) == ("Envoyé", 0, 90)
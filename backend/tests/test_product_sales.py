@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+import product_sales
+from conftest import create_invoice
+from database import SessionLocal, engine
+from models import Invoice, InvoiceItem, ProductSalesMonth
+
+
+def direct_sales(db, user_id, date_from, date_to) -> dict:
+    rows = product_sales._sales_query(db, user_id).filter(
+        Invoice.date >= date_from, Invoice.date < date_to
+    ).group_by(InvoiceItem.product_id)
+    return {product_id: [quantity, round(revenue, 2)] for product_id, quantity, revenue in rows}
+
+
+def rounded(totals: dict) -> dict:
+    return {product_id: [quantity, round(revenue, 2)] for product_id, (quantity, revenue) in totals.items()}
+
+
+@pytest.fixture
+def sales(client, user, customer):
+    """Invoices on the 5th and 20th of the last three closed months, for two products"""
+    products = [client.post("/api/products", json={"name": name, "price": price}, headers=user["headers"]).json()
+                for name, price in (("Licence", 100), ("Support", 40))]
+    months = [product_sales.month_floor(datetime.utcnow())]
+    for _ in range(3):
+        months.insert(0, product_sales.month_floor(months[0] - timedelta(days=1)))
+    months.pop()
+    invoices = []
+    for index, month in enumerate(months):
+        for day in (5, 20):
+            invoice = create_invoice(client, user, customer, status="Envoyé", discount=10 * index, items=[
+                {"description": product["name"], "quantity": index + 1, "price": product["price"], "tax_rate": 20,
+                 "product_id": product["id"]} for product in products
+            ])
+            with engine.begin() as conn:
+                conn.execute(update(Invoice.__table__).where(Invoice.__table__.c.id == invoice["id"])
+                             .values(date=month.replace(day=day)))
+            invoices.append(invoice)
+    db = SessionLocal()
+    assert product_sales.refresh_tenant(db, user["id"]) == 3
+    yield db, months, invoices
+    db.close()
+
+
+def test_aggregates_and_live_ranges_match_a_direct_query(user, sales):
+    db, months, _ = sales
+    # Bords partiels (mi-mois) autour d'un mois entièrement agrégé
+    date_from, date_to = months[0].replace(day=10), months[2].replace(day=15)
+    expected = direct_sales(db, user["id"], date_from, date_to)
+    assert len(expected) == 2
+    assert rounded(product_sales.sales_by_product(db, user["id"], date_from, date_to)) == expected
+
+    date_from, date_to = months[0], datetime.utcnow()
+    assert rounded(product_sales.sales_by_product(db, user["id"], date_from, date_to)) == \
+        direct_sales(db, user["id"], date_from, date_to)
+
+
+def test_invalidated_month_picks_up_the_edit(client, user, sales):
+    db, months, invoices = sales
+    date_from, date_to = months[0], months[2]
+    edited = invoices[2]  # Mois du milieu, agrégé
+
+    # Modification hors route : l'agrégat reste celui d'avant jusqu'à l'invalidation
+    with engine.begin() as conn:
+        conn.execute(update(Invoice.__table__).where(Invoice.__table__.c.id == edited["id"]).values(status="Annulé"))
+    assert rounded(product_sales.sales_by_product(db, user["id"], date_from, date_to)) != \
+        direct_sales(db, user["id"], date_from, date_to)
+
+    product_sales.invalidate(db, user["id"], months[1])
+    db.commit()
+    assert product_sales.refresh_tenant(db, user["id"]) == 1
+    assert rounded(product_sales.sales_by_product(db, user["id"], date_from, date_to)) == \
+        direct_sales(db, user["id"], date_from, date_to)
+
+    # Par l'API : la route invalide le mois dans sa transaction
+    response = client.put(f"/api/invoices/{invoices[3]['id']}/status?status=Annulé", headers=user["headers"])
+    assert response.status_code == 200
+    db.expire_all()
+    assert db.query(ProductSalesMonth).filter(ProductSalesMonth.user_id == user["id"],
+                                              ProductSalesMonth.month == months[1]).count() == 0
+    product_sales.refresh_tenant(db, user["id"])
+    assert product_sales.sales_by_product(db, user["id"], months[1], months[2]) == {}
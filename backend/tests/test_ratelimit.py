@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+from sqlalchemy import delete
+
+import ratelimit
+from database import engine
+from models import RateLimitBucket
+
+
+@pytest.fixture
+def tight_reads(monkeypatch):
+    # Rafale de 2 lectures, recharge d'un jeton par seconde
+    monkeypatch.setitem(ratelimit.COST_CLASSES, "read", {"rate": 1.0, "burst": 2.0})
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+
+
+def test_cost_classes():
+    assert ratelimit.cost_class("GET", "/api/clients") == "read"
+    assert ratelimit.cost_class("POST", "/api/invoices") == "write"
+    assert ratelimit.cost_class("GET", "/api/dashboard") == "report"
+    assert ratelimit.cost_class("GET", "/api/clients/abc/statement") == "report"
+    assert ratelimit.cost_class("POST", "/api/login") is None
+    assert ratelimit.cost_class("GET", "/metrics") is None
+
+
+@pytest.mark.parametrize("backend", [ratelimit.MemoryBackend, ratelimit.DatabaseBackend])
+def test_token_bucket_refill(tight_reads, backend):
+    limiter = backend()
+    user_id = f"refill-{backend.__name__}"
+    with engine.begin() as conn:
+        conn.execute(delete(RateLimitBucket.__table__).where(RateLimitBucket.__table__.c.user_id == user_id))
+    assert limiter.acquire(user_id, "read", now=1000.0) == 0
+    assert limiter.acquire(user_id, "read", now=1000.0) == 0
+    assert limiter.acquire(user_id, "read", now=1000.0) == pytest.approx(1.0)
+    # Une demi-seconde : un demi-jeton, toujours refusé
+    assert limiter.acquire(user_id, "read", now=1000.5) == pytest.approx(0.5)
+    assert limiter.acquire(user_id, "read", now=1001.0) == 0
+    # Longue pause : plafonné à la rafale
+    assert limiter.acquire(user_id, "read", now=2000.0) == 0
+    assert limiter.acquire(user_id, "read", now=2000.0) == 0
+    assert limiter.acquire(user_id, "read", now=2000.0) > 0
+
+
+def test_429_carries_cors_headers(client, user, tight_reads, monkeypatch):
+    monkeypatch.setattr(ratelimit, "limiter", ratelimit.MemoryBackend())
+    headers = {**user["headers"], "Origin": "http://app.example.fr"}
+    statuses = [client.get("/api/clients", headers=headers) for _ in range(3)]
+    assert [response.status_code for response in statuses] == [200, 200, 429]
+    limited = statuses[-1]
+    assert limited.headers["access-control-allow-origin"] == "*"
+    assert "Retry-After" in limited.headers["access-control-expose-headers"]
+    assert int(limited.headers["retry-after"]) >= 1
+
+
+def test_report_bulkhead_serves_users_round_robin():
+    async def scenario():
+        bulkhead = ratelimit.FairBulkhead(limit=1, per_user=3, max_wait=1)
+        assert await bulkhead.acquire("a")
+        order = []
+
+        async def wait(user_id):
+            assert await bulkhead.acquire(user_id)
+            order.append(user_id)
+
+        waiters = [asyncio.create_task(wait(user_id)) for user_id in ("a", "a", "b")]
+        await asyncio.sleep(0)
+        for _ in range(3):
+            bulkhead.release(order[-1] if order else "a")
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "b", "a"]
@@ -0,0 +1,74 @@
+import pytest
+
+import receipts
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 40 + b"\n%%EOF\n"
+
+
+@pytest.fixture
+def expense(client, user):
+    response = client.post("/api/expenses", json={"title": "Hôtel", "amount": 120, "category": "Déplacement"},
+                           headers=user["headers"])
+    assert response.status_code == 200
+    return response.json()
+
+
+def upload(client, user, expense, content: bytes, content_type: str = "application/pdf"):
+    return client.post(f"/api/expenses/{expense['id']}/receipt",
+                       files={"file": ("facture-hotel.pdf", content, content_type)}, headers=user["headers"])
+
+
+def download(client, user, expense, **headers):
+    return client.get(f"/api/expenses/{expense['id']}/receipt", headers={**user["headers"], **headers})
+
+
+def test_identical_files_share_their_storage(client, user, expense):
+    other = client.post("/api/expenses", json={"title": "Hôtel (copie)", "amount": 120, "category": "Déplacement"},
+                        headers=user["headers"]).json()
+    first = upload(client, user, expense, PDF).json()
+    second = upload(client, user, other, PDF).json()
+    assert first["receipt_path"] == second["receipt_path"]
+    assert receipts.content_path(first["receipt_path"]).read_bytes() == PDF
+    # Aucun fichier temporaire laissé derrière
+    assert list((receipts.RECEIPTS_DIR / "tmp").iterdir()) == []
+
+
+def test_sniffed_type_wins_over_the_declared_one(client, user, expense):
+    stored = upload(client, user, expense, PDF, content_type="image/jpeg").json()
+    assert stored["receipt_content_type"] == "application/pdf"
+    response = download(client, user, expense)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/pdf"
+    assert response.content == PDF
+
+    unknown = upload(client, user, expense, b"MZ\x90\x00 not a receipt", content_type="application/pdf")
+    assert unknown.status_code == 415
+
+
+def test_upload_above_the_limit_is_rejected(client, user, expense, monkeypatch):
+    monkeypatch.setattr(receipts, "RECEIPT_MAX_BYTES", 1024)
+    response = upload(client, user, expense, PDF)
+    assert response.status_code == 413
+    assert download(client, user, expense).status_code == 404
+    assert list((receipts.RECEIPTS_DIR / "tmp").iterdir()) == []
+
+
+def test_range_requests(client, user, expense):
+    upload(client, user, expense, PDF)
+    size = len(PDF)
+
+    partial = download(client, user, expense, Range="bytes=5-14")
+    assert partial.status_code == 206
+    assert partial.headers["content-range"] == f"bytes 5-14/{size}"
+    assert partial.content == PDF[5:15]
+
+    suffix = download(client, user, expense, Range="bytes=-7")
+    assert (suffix.status_code, suffix.headers["content-range"]) == (206, f"bytes {size - 7}-{size - 1}/{size}")
+    assert suffix.content == PDF[-7:]
+
+    unsatisfiable = download(client, user, expense, Range=f"bytes={size}-")
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{size}"
+
+    etag = download(client, user, expense).headers["etag"]
+    assert download(client, user, expense, **{"If-None-Match": etag}).status_code == 304
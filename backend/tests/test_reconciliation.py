@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from conftest import create_invoice
+
+
+def statement(*lines) -> bytes:
+    rows = ["Date;Libellé;Montant"] + [f"{date:%d/%m/%Y};{label};{amount}" for date, label, amount in lines]
+    return "\n".join(rows).encode("utf-8")
+
+
+def upload(client, user, content: bytes):
+    return client.post("/api/bank/imports", files={"file": ("releve.csv", content, "text/csv")},
+                       headers=user["headers"])
+
+
+def test_import_match_and_confirm(client, user, customer):
+    due = (datetime.utcnow() + timedelta(days=10)).replace(microsecond=0)
+    by_reference = create_invoice(client, user, customer, 100, status="Envoyé", due_date=due.isoformat())
+    by_amount = create_invoice(client, user, customer, 250, status="Envoyé", due_date=due.isoformat())
+    content = statement(
+        (due, f"VIR SEPA SOCIETE TEST {by_reference['invoice_number']}", "100,00"),
+        (due - timedelta(days=2), "VIREMENT SOCIETE TEST", "250,00"),
+        (due, "PRLV ASSURANCE", "-45,90"),
+    )
+
+    imported = upload(client, user, content).json()
+    assert (imported["lines"], imported["imported"]) == (3, 3)
+    # Même relevé réimporté : rien de neuf
+    assert upload(client, user, content).json()["duplicates"] == 3
+
+    proposals = client.get("/api/bank/matches", headers=user["headers"]).json()
+    matches = {match["invoice_id"]: match for match in proposals["matches"]}
+    assert matches[by_reference["id"]]["reason"] == "reference+amount"
+    assert matches[by_reference["id"]]["confidence"] == "high"
+    assert matches[by_amount["id"]]["reason"] == "amount+date"
+
+    confirm = [{"transaction_id": match["transaction_id"], "invoice_id": match["invoice_id"]}
+               for match in matches.values()]
+    created = client.post("/api/bank/matches/confirm", json={"matches": confirm}, headers=user["headers"])
+    assert created.status_code == 200
+    assert sorted(payment["amount"] for payment in created.json()) == [100, 250]
+    for invoice in (by_reference, by_amount):
+        current = client.get(f"/api/invoices/{invoice['id']}", headers=user["headers"]).json()
+        assert (current["status"], current["balance_due"]) == ("Payé", 0)
+
+    # Déjà rapprochées : refus, sans double règlement
+    again = client.post("/api/bank/matches/confirm", json={"matches": confirm}, headers=user["headers"])
+    assert again.status_code == 409
+    unmatched = client.get("/api/bank/transactions?status=À rapprocher", headers=user["headers"]).json()
+    assert [transaction["label"] for transaction in unmatched] == ["PRLV ASSURANCE"]
+
+
+def test_confirm_is_all_or_nothing(client, user, customer):
+    invoice = create_invoice(client, user, customer, 80, status="Envoyé")
+    upload(client, user, statement((datetime.utcnow(), "VIREMENT A", "80,00"), (datetime.utcnow(), "VIREMENT B", "80,00")))
+    transactions = client.get("/api/bank/transactions", headers=user["headers"]).json()
+    confirm = [{"transaction_id": transaction["id"], "invoice_id": invoice["id"]} for transaction in transactions]
+    # Le second règlement dépasserait le solde : aucun n'est enregistré
+    response = client.post("/api/bank/matches/confirm", json={"matches": confirm}, headers=user["headers"])
+    assert response.status_code == 400
+    assert client.get(f"/api/invoices/{invoice['id']}/payments", headers=user["headers"]).json() == []
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from starlette.requests import Request
+
+import database
+from database import Replica, replica_router
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    # Réplica factice : la même base SQLite
+    replica = Replica(os.environ["DATABASE_URL"])
+    monkeypatch.setattr(replica_router, "replicas", [replica])
+    replica.check()
+    return replica
+
+
+def test_not_found_keeps_replica_healthy(client, user, replica):
+    response = client.get("/api/clients/unknown/statement", headers=user["headers"])
+    assert response.status_code == 404
+    assert replica.healthy
+
+
+def test_connection_error_marks_replica_unhealthy(replica):
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "state": {}})
+    dependency = database.get_read_db(request, {})
+    db = next(dependency)
+    assert db.info["replica"] is replica
+    with pytest.raises(OperationalError):
+        dependency.throw(OperationalError("SELECT 1", {}, Exception("server closed the connection")))
+    assert not replica.healthy
+
+
+def test_application_error_keeps_replica_healthy(replica):
+    request = Request({"type": "http", "method": "GET", "path": "/", "headers": [], "state": {}})
+    dependency = database.get_read_db(request, {})
+    next(dependency)
+    with pytest.raises(ValueError):
+        dependency.throw(ValueError("bad input"))
+    assert replica.healthy
+
+
+def test_reads_stick_to_primary_after_a_write(client, user, replica, customer):
+    assert replica_router.recently_wrote(user["id"])
@@ -0,0 +1,62 @@
+import json
+from datetime import datetime, timedelta
+
+import scheduler
+from conftest import create_invoice
+from database import SessionLocal
+from models import Invoice, OutboxEvent
+
+
+def status_events(db, invoice_id):
+    events = db.query(OutboxEvent).filter(
+        OutboxEvent.resource_id == invoice_id, OutboxEvent.event_type == "invoice.status_changed"
+    ).all()
+    return [json.loads(event.payload) for event in events]
+
+
+def test_overdue_transition_emits_one_event(client, user, customer):
+    past = (datetime.utcnow() - timedelta(days=3)).replace(microsecond=0).isoformat()
+    invoice = create_invoice(client, user, customer, status="Envoyé", due_date=past)
+    db = SessionLocal()
+    try:
+        assert scheduler.mark_overdue_invoices(db, chunk_size=1) >= 1
+        assert db.get(Invoice, invoice["id"]).status == "En retard"
+        [payload] = status_events(db, invoice["id"])
+        assert (payload["status"], payload["old_status"]) == ("En retard", "Envoyé")
+
+        # Déjà en retard : ni nouvel UPDATE ni nouvel événement
+        scheduler.mark_overdue_invoices(db)
+        assert len(status_events(db, invoice["id"])) == 1
+    finally:
+        db.close()
+
+
+def test_paid_invoice_is_not_marked_overdue(client, user, customer):
+    past = (datetime.utcnow() - timedelta(days=3)).replace(microsecond=0).isoformat()
+    invoice = create_invoice(client, user, customer, status="Payé", due_date=past)
+    db = SessionLocal()
+    try:
+        scheduler.mark_overdue_invoices(db)
+        assert db.get(Invoice, invoice["id"]).status == "Payé"
+        assert status_events(db, invoice["id"]) == []
+    finally:
+        db.close()
+
+
+class DeadConnection:
+    def __init__(self):
+        self.closed = False
+
+    def execute(self, *args, **kwargs):
+        raise ConnectionError("server closed the connection unexpectedly")
+
+    def close(self):
+        self.closed = True
+
+
+def test_leader_lock_is_lost_with_its_connection():
+    lock = scheduler.LeaderLock()
+    connection = DeadConnection()
+    lock._conn = connection
+    assert lock.held is False
+    assert connection.closed and lock._conn is None
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+import jobs
+import scheduler
+import sharding
+from conftest import create_invoice
+from database import SessionLocal, engine
+from models import Client, Invoice, Job, User
+
+
+def set_shard_state(user_id: str, state):
+    with engine.begin() as conn:
+        conn.execute(update(User.__table__).where(User.__table__.c.id == user_id).values(shard_state=state))
+
+
+@pytest.fixture
+def moving(user):
+    """Marks the tenant as being moved; the directory is restored afterwards"""
+    yield lambda: set_shard_state(user["id"], "moving")
+    set_shard_state(user["id"], None)
+
+
+@jobs.handler("test_move_started")
+def write_during_move(context, user_id):
+    context.db.add(Client(user_id=context.user_id, name="Écrit pendant le gel", email="gel@test.fr"))
+    set_shard_state(user_id, "moving")  # Le déplacement commence pendant le job
+    context.db.commit()
+    return {}
+
+
+def test_writable_tenants_excludes_frozen(user, moving):
+    assert sharding.writable_tenants(None, [user["id"]]) == {user["id"]}
+    moving()
+    assert sharding.writable_tenants(None, [user["id"]]) == set()
+
+
+def test_scheduler_skips_frozen_tenant(client, user, customer, moving):
+    past = (datetime.utcnow() - timedelta(days=3)).replace(microsecond=0).isoformat()
+    invoice = create_invoice(client, user, customer, status="Envoyé", due_date=past)
+    moving()
+    scheduler.run_status_transitions()
+    db = SessionLocal()
+    try:
+        assert db.get(Invoice, invoice["id"]).status == "Envoyé"
+        set_shard_state(user["id"], None)
+        scheduler.run_status_transitions()
+        db.expire_all()
+        assert db.get(Invoice, invoice["id"]).status == "En retard"
+    finally:
+        db.close()
+
+
+def test_job_is_requeued_when_move_starts(user, moving):
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.kind == "test_move_started").delete(synchronize_session=False)
+        job = jobs.enqueue(db, "test_move_started", {"user_id": user["id"]}, user_id=user["id"])
+        db.commit()
+        job_id = job.id
+
+        jobs.execute(jobs.claim("worker", ["test_move_started"]), "worker")
+        db.expire_all()
+        requeued = db.get(Job, job_id)
+        # Écriture refusée, tentative non décomptée
+        assert (requeued.status, requeued.attempts) == ("queued", 0)
+        assert requeued.run_after > datetime.utcnow()
+        assert db.query(Client).filter(Client.user_id == user["id"], Client.name == "Écrit pendant le gel").count() == 0
+    finally:
+        db.close()
@@ -0,0 +1,46 @@
+import json
+
+import slowlog
+
+
+def test_redact_keeps_only_the_shape_of_literals():
+    parameters = ("Société Secrète", b"\x00\x01", 42, 1.5, None, True, {"email": "dg@secrete.fr", "ids": ["a", "bc"]})
+    assert slowlog.redact(parameters) == [
+        "<str:15>", "<bytes:2>", 42, 1.5, None, True, {"email": "<str:13>", "ids": ["<str:1>", "<str:2>"]},
+    ]
+
+
+def test_logged_statements_carry_no_literals(client, user, monkeypatch):
+    monkeypatch.setattr(slowlog.slow_query_log, "threshold_ms", 0)
+    monkeypatch.setattr(slowlog.slow_query_log, "explain", False)
+    slowlog.slow_query_log.clear()
+    response = client.post("/api/clients", json={"name": "Société Secrète", "email": "dg@secrete.fr"},
+                           headers=user["headers"])
+    assert response.status_code == 200
+    entries = slowlog.slow_query_log.entries(limit=1000, route="/api/clients")
+    slowlog.slow_query_log.clear()
+
+    assert any(entry["statement"].lstrip().upper().startswith("INSERT INTO CLIENTS") for entry in entries)
+    logged = json.dumps(entries, ensure_ascii=False)
+    assert "Secrète" not in logged and "dg@secrete.fr" not in logged
+    assert "<str:15>" in logged
+
+
+def test_explain_is_sampled_once_per_interval(monkeypatch):
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_EXPLAIN_INTERVAL", 300)
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_EXPLAIN_PER_MINUTE", 100)
+    log = slowlog.SlowQueryLog(threshold_ms=0, explain=True)
+    statement = "SELECT * FROM invoices WHERE user_id = ?"
+    assert log.should_explain(statement, now=1000)
+    assert not log.should_explain(statement, now=1001)
+    assert not log.should_explain(statement, now=1299)
+    # Une autre requête a son propre intervalle
+    assert log.should_explain("SELECT * FROM quotes WHERE user_id = ?", now=1001)
+    assert log.should_explain(statement, now=1300)
+
+
+def test_explain_budget_per_minute(monkeypatch):
+    monkeypatch.setattr(slowlog, "SLOW_QUERY_EXPLAIN_PER_MINUTE", 2)
+    log = slowlog.SlowQueryLog(threshold_ms=0, explain=True)
+    assert [log.should_explain(f"SELECT {n}", now=1000 + n) for n in range(3)] == [True, True, False]
+    assert log.should_explain("SELECT 3", now=1061)
@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def test_server_import_does_not_load_report_libraries():
+    # Processus neuf : les autres tests ont pu importer pandas
+    script = "import sys, server; print(sorted(m for m in ('pandas', 'numpy', 'reportlab') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=BACKEND_DIR, env=os.environ.copy(),
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "[]"
@@ -0,0 +1,70 @@
+import csv
+import io
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from conftest import create_invoice
+from database import engine
+from models import Invoice, Quote
+
+
+def days_ago(days: int) -> datetime:
+    return (datetime.utcnow() - timedelta(days=days)).replace(microsecond=0)
+
+
+def backdate(model, row_id: str, when: datetime):
+    with engine.begin() as conn:
+        conn.execute(update(model.__table__).where(model.__table__.c.id == row_id).values(date=when))
+
+
+def pay(client, user, invoice, amount, when: datetime):
+    response = client.post(f"/api/invoices/{invoice['id']}/payments",
+                           json={"amount": amount, "payment_date": when.isoformat(), "reference": f"VIR {amount}"},
+                           headers=user["headers"])
+    assert response.status_code == 200, response.text
+
+
+def test_running_balance_after_opening_balance(client, user, customer):
+    first = create_invoice(client, user, customer, 1000, status="Envoyé")
+    backdate(Invoice, first["id"], days_ago(60))
+    pay(client, user, first, 400, days_ago(50))
+    draft = create_invoice(client, user, customer, 300)
+    backdate(Invoice, draft["id"], days_ago(40))
+    second = create_invoice(client, user, customer, 500, status="Envoyé")
+    backdate(Invoice, second["id"], days_ago(30))
+    pay(client, user, first, 600, days_ago(20))
+    quote = client.post("/api/quotes", json={"client_id": customer["id"], "items": [
+        {"description": "Option", "quantity": 1, "price": 250, "tax_rate": 0}
+    ]}, headers=user["headers"]).json()
+    backdate(Quote, quote["id"], days_ago(15))
+    pay(client, user, second, 200, days_ago(10))
+
+    url = f"/api/clients/{customer['id']}/statement"
+    params = {"date_from": days_ago(45).isoformat()}
+    body = client.get(url, params=params, headers=user["headers"]).json()
+    # Avant date_from : 1000 facturés, 400 réglés
+    assert body["opening_balance"] == 600
+    assert [(entry["entry_type"], entry["debit"], entry["credit"], entry["balance"]) for entry in body["entries"]] == [
+        ("invoice", 0, 0, 600),     # brouillon : hors solde
+        ("invoice", 500, 0, 1100),
+        ("payment", 0, 600, 500),
+        ("quote", 0, 0, 500),       # pour information
+        ("payment", 0, 200, 300),
+    ]
+    assert body["closing_balance"] == 300
+
+    response = client.get(url, params={**params, "format": "csv"}, headers=user["headers"])
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert (rows[0]["entry_type"], float(rows[0]["balance"])) == ("opening_balance", 600)
+    assert [float(row["balance"]) for row in rows[1:]] == [600, 1100, 500, 500, 300]
+    assert rows[3]["reference"] == first["invoice_number"]
+
+
+def test_without_date_from_everything_is_listed(client, user, customer):
+    invoice = create_invoice(client, user, customer, 80, status="Envoyé")
+    pay(client, user, invoice, 30, datetime.utcnow())
+    body = client.get(f"/api/clients/{customer['id']}/statement", headers=user["headers"]).json()
+    assert body["opening_balance"] == 0
+    assert [entry["balance"] for entry in body["entries"]] == [80, 50]
@@ -0,0 +1,69 @@
+from sqlalchemy import update
+
+import suggest
+from database import SessionLocal
+from models import Client
+
+
+def add_client(client, user, name, email, siret=None):
+    response = client.post("/api/clients", json={"name": name, "email": email, "siret": siret},
+                           headers=user["headers"])
+    assert response.status_code == 200
+    return response.json()
+
+
+def suggested(client, user, entity, q, **params):
+    response = client.get(f"/api/{entity}/suggest", params={"q": q, **params}, headers=user["headers"])
+    assert response.status_code == 200
+    return [row["name"] for row in response.json()]
+
+
+def test_client_suggestions_match_name_email_and_siret(client, user):
+    add_client(client, user, "Société Générale de Conseil", "contact@sgc.fr", "55212022200013")
+    add_client(client, user, "Boulangerie Martin", "martin@pain.fr", "40483304800022")
+    add_client(client, user, "Atelier Bois", "bonjour@atelier-bois.fr")
+
+    # Préfixe de mot, sans accents ni casse
+    assert suggested(client, user, "clients", "societe") == ["Société Générale de Conseil"]
+    assert suggested(client, user, "clients", "conseil") == ["Société Générale de Conseil"]
+    assert suggested(client, user, "clients", "martin@") == ["Boulangerie Martin"]
+    assert suggested(client, user, "clients", "404833") == ["Boulangerie Martin"]
+    assert sorted(suggested(client, user, "clients", "b")) == ["Atelier Bois", "Boulangerie Martin"]
+    assert suggested(client, user, "clients", "zzz") == []
+
+
+def test_suggestions_are_capped(client, user):
+    for index in range(suggest.SUGGEST_MAX_LIMIT + 5):
+        client.post("/api/products", json={"name": f"Prestation {index:02d}", "price": 10},
+                    headers=user["headers"])
+    assert len(suggested(client, user, "products", "prest", limit=3)) == 3
+    assert len(suggested(client, user, "products", "prest")) == suggest.SUGGEST_DEFAULT_LIMIT
+    assert len(suggested(client, user, "products", "prest", limit=1000)) == suggest.SUGGEST_MAX_LIMIT
+
+
+def test_product_suggestions_follow_edits(client, user):
+    product = client.post("/api/products", json={"name": "Audit sécurité", "price": 900, "category": "Conseil"},
+                          headers=user["headers"]).json()
+    assert suggested(client, user, "products", "conseil") == ["Audit sécurité"]
+
+    client.patch(f"/api/products/{product['id']}", json={"name": "Revue de code"}, headers=user["headers"])
+    assert suggested(client, user, "products", "audit") == []
+    assert suggested(client, user, "products", "revue") == ["Revue de code"]
+
+    client.delete(f"/api/products/{product['id']}", headers=user["headers"])
+    assert suggested(client, user, "products", "revue") == []
+
+
+def test_write_from_another_worker_rebuilds_the_index(client, user):
+    created = add_client(client, user, "Ancien Nom", "ancien@test.fr")
+    assert suggested(client, user, "clients", "ancien") == ["Ancien Nom"]
+
+    # Autre worker : même base, cache local de ce processus inchangé
+    db = SessionLocal()
+    try:
+        db.execute(update(Client).where(Client.id == created["id"]).values(name="Nouveau Nom"))
+        suggest.touch(db, user["id"], "clients")
+        db.commit()
+    finally:
+        db.close()
+    assert suggested(client, user, "clients", "nouveau") == ["Nouveau Nom"]
@@ -0,0 +1,44 @@
+import pytest
+
+import versioning
+
+
+def test_parse_if_match():
+    assert versioning.parse_if_match(None) is None
+    assert versioning.parse_if_match("*") is None
+    assert versioning.parse_if_match('"3"') == 3
+    assert versioning.parse_if_match('W/"4"') == 4
+    with pytest.raises(versioning.VersionError):
+        versioning.parse_if_match('"abc"')
+
+
+def test_patch_with_stale_if_match_is_rejected(client, user, customer):
+    url = f"/api/clients/{customer['id']}"
+    etag = client.get(url, headers=user["headers"]).headers["ETag"]
+
+    updated = client.patch(url, json={"phone": "0102030405"}, headers={**user["headers"], "If-Match": etag})
+    assert updated.status_code == 200
+    assert updated.json()["phone"] == "0102030405"
+    assert updated.headers["ETag"] != etag
+
+    stale = client.patch(url, json={"phone": "0607080910"}, headers={**user["headers"], "If-Match": etag})
+    assert stale.status_code == 412
+    assert client.get(url, headers=user["headers"]).json()["phone"] == "0102030405"
+
+
+def test_patch_only_writes_given_fields(client, user, customer):
+    url = f"/api/clients/{customer['id']}"
+    response = client.patch(url, json={"address": "1 rue de Lyon"}, headers=user["headers"])
+    assert response.status_code == 200
+    assert response.json()["name"] == customer["name"]
+    assert response.json()["address"] == "1 rue de Lyon"
+
+
+def test_patch_rejects_null_required_field(client, user, customer):
+    response = client.patch(f"/api/clients/{customer['id']}", json={"name": None}, headers=user["headers"])
+    assert response.status_code == 422
+
+
+def test_patch_unknown_resource(client, user):
+    response = client.patch("/api/clients/unknown", json={"address": "Lyon"}, headers={**user["headers"], "If-Match": '"1"'})
+    assert response.status_code == 404
@@ -0,0 +1,183 @@
+import hashlib
+import hmac
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import update
+
+import webhooks
+from conftest import create_invoice
+from database import SessionLocal, engine
+from models import OutboxEvent, Webhook, WebhookDelivery
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, reason: str = "OK"):
+        self.status_code = status_code
+        self.reason = reason
+        self.text = "internal stack trace"
+
+    def close(self):
+        pass
+
+
+class FakeHttp:
+    def __init__(self, status_code: int = 200, reason: str = "OK"):
+        self.status_code = status_code
+        self.reason = reason
+        self.requests = []
+
+    def post(self, url, data, timeout, allow_redirects, headers):
+        self.requests.append({"url": url, "body": data, "headers": headers, "allow_redirects": allow_redirects})
+        return FakeResponse(self.status_code, self.reason)
+
+
+def test_signature_is_hmac_of_timestamp_and_body():
+    body = b'{"events": []}'
+    signature = webhooks.sign("secret", 1700000000, body)
+    expected = hmac.new(b"secret", b"1700000000." + body, hashlib.sha256).hexdigest()
+    assert signature == f"t=1700000000,v1={expected}"
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://localhost:8000/hook",
+    "http://10.1.2.3/hook",
+    "http://192.168.0.10/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/hook",
+    "http://0.0.0.0/hook",
+    "ftp://example.fr/hook",
+])
+def test_internal_destinations_are_rejected(url):
+    with pytest.raises(webhooks.WebhookError) as error:
+        webhooks.check_destination(url)
+    assert error.value.status_code == 400
+
+
+def test_public_and_allowlisted_destinations(monkeypatch):
+    webhooks.check_destination("https://93.184.216.34/hook")
+    monkeypatch.setattr(webhooks, "WEBHOOK_ALLOWED_HOSTS", {"localhost"})
+    webhooks.check_destination("http://localhost:9000/hook")
+
+
+def test_create_webhook_rejects_internal_url(client, user):
+    response = client.post("/api/webhooks", json={"url": "http://127.0.0.1:5432/", "events": ["*"]},
+                           headers=user["headers"])
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def local_webhook(client, user, customer, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_ALLOWED_HOSTS", {"receiver.local"})
+    response = client.post("/api/webhooks", json={"url": "http://receiver.local/hook", "events": ["invoice.created"]},
+                           headers=user["headers"])
+    assert response.status_code == 200
+    created = response.json()
+    client.post("/api/invoices", json={"client_id": customer["id"], "items": []}, headers=user["headers"])
+    db = SessionLocal()
+    while webhooks.fan_out(db):
+        pass
+    yield db, db.get(Webhook, created["id"]), created["secret"]
+    db.close()
+
+
+def test_delivery_is_signed(local_webhook):
+    db, webhook, secret = local_webhook
+    http = FakeHttp()
+    assert webhooks.deliver_batch(db, http, webhook) == 1
+    request = http.requests[0]
+    assert request["allow_redirects"] is False
+    timestamp = request["headers"][webhooks.SIGNATURE_HEADER].split(",")[0][2:]
+    assert request["headers"][webhooks.SIGNATURE_HEADER] == webhooks.sign(secret, int(timestamp), request["body"])
+    assert [event["type"] for event in json.loads(request["body"])["events"]] == ["invoice.created"]
+
+
+def test_failed_delivery_keeps_status_only(local_webhook, monkeypatch):
+    db, webhook, _ = local_webhook
+    assert webhooks.deliver_batch(db, FakeHttp(500, "Internal Server Error"), webhook) == 0
+    delivery = db.query(WebhookDelivery).filter(WebhookDelivery.webhook_id == webhook.id).one()
+    assert (delivery.status, delivery.last_status_code) == ("pending", 500)
+    assert delivery.last_error == "HTTP 500 Internal Server Error"
+
+    # Allowlist retirée : l'hôte n'est plus contacté
+    monkeypatch.setattr(webhooks, "WEBHOOK_ALLOWED_HOSTS", set())
+    http = FakeHttp()
+    db.expire_all()
+    assert webhooks.deliver_batch(db, http, db.get(Webhook, webhook.id)) == 0
+    assert http.requests == []
+
+
+def deliveries(db, webhook) -> list:
+    db.expire_all()
+    return db.query(WebhookDelivery).filter(WebhookDelivery.webhook_id == webhook.id).all()
+
+
+def test_events_of_a_resource_keep_their_order_across_batches(client, user, customer, local_webhook, monkeypatch):
+    db, webhook, _ = local_webhook
+    webhook.events = "invoice.created,invoice.status_changed"
+    db.commit()
+    assert webhooks.deliver_batch(db, FakeHttp(), webhook) == 1  # Facture du fixture
+
+    invoice = create_invoice(client, user, customer)
+    for status in ("Envoyé", "En retard", "Annulé"):
+        create_invoice(client, user, customer)  # Intercalée, autre ressource
+        response = client.put(f"/api/invoices/{invoice['id']}/status?status={status}", headers=user["headers"])
+        assert response.status_code == 200
+    # Même horodatage partout : seule la séquence départage
+    with engine.begin() as conn:
+        conn.execute(update(OutboxEvent.__table__).where(OutboxEvent.__table__.c.dispatched_at.is_(None))
+                     .values(created_at=datetime(2024, 1, 1)))
+
+    while webhooks.fan_out(db, batch_size=2):
+        pass
+    monkeypatch.setattr(webhooks, "WEBHOOK_BATCH_SIZE", 2)
+    http = FakeHttp()
+    while webhooks.deliver_batch(db, http, webhook):
+        pass
+    assert len(http.requests) == 4
+    events = [event for request in http.requests for event in json.loads(request["body"])["events"]]
+    assert [(event["type"], event["data"]["status"]) for event in events
+            if event["resource"]["id"] == invoice["id"]] == [
+        ("invoice.created", "Brouillon"),
+        ("invoice.status_changed", "Envoyé"),
+        ("invoice.status_changed", "En retard"),
+        ("invoice.status_changed", "Annulé"),
+    ]
+
+
+def test_dead_letter_after_max_attempts_then_replay(local_webhook, monkeypatch):
+    db, webhook, _ = local_webhook
+    monkeypatch.setattr(webhooks, "WEBHOOK_MAX_ATTEMPTS", 2)
+    for attempt in (1, 2):
+        assert webhooks.deliver_batch(db, FakeHttp(503, "Service Unavailable"), webhook) == 0
+        [delivery] = deliveries(db, webhook)
+        assert (delivery.status, delivery.attempts) == ("pending" if attempt == 1 else "dead", attempt)
+    # Lettre morte : plus rien à livrer
+    http = FakeHttp()
+    assert webhooks.deliver_batch(db, http, webhook) == 0
+    assert http.requests == []
+
+    db.refresh(webhook)
+    assert webhooks.replay_dead(db, webhook) == 1
+    db.commit()
+    [delivery] = deliveries(db, webhook)
+    assert (delivery.status, delivery.attempts) == ("pending", 0)
+    assert (webhook.failure_count, webhook.next_attempt_at) == (0, None)
+    assert webhooks.deliver_batch(db, http, webhook) == 1
+    assert deliveries(db, webhook)[0].status == "delivered"
+
+
+def test_gone_deactivates_the_webhook(client, user, local_webhook):
+    db, webhook, _ = local_webhook
+    assert webhooks.deliver_batch(db, FakeHttp(410, "Gone"), webhook) == 0
+    db.refresh(webhook)
+    assert webhook.is_active is False
+    assert [(delivery.status, delivery.last_status_code) for delivery in deliveries(db, webhook)] == [("pending", 410)]
+
+    # Rejeu : réactivé, la file reprend
+    response = client.post(f"/api/webhooks/{webhook.id}/deliveries/replay", headers=user["headers"])
+    assert response.status_code == 200
+    db.refresh(webhook)
+    assert webhook.is_active is True
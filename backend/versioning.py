@@ -0,0 +1,73 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import update
+from typing import Optional
+
+# Verrouillage optimiste : toute écriture sur une ressource éditable
+# (client, produit, dépense, facture, devis) incrémente sa colonne version,
+# exposée en ETag. Avec If-Match, l'écriture n'a lieu que si la version est
+# inchangée, contrôlée dans le WHERE de l'UPDATE : sinon 412 et rien n'est écrit.
+
+class VersionError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+def parse_if_match(value: Optional[str]) -> Optional[int]:
+    """Expected version from an If-Match header ("3", W/"3" or 3); None when absent or *"""
+    if value is None or value.strip() == "*":
+        return None
+    tag = value.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        raise VersionError(400, "Invalid If-Match header")
+
+def _conflict(db: Session, model, resource_id: str, user_id: str):
+    current = db.query(model.version).filter(model.id == resource_id, model.user_id == user_id).scalar()
+    if current is None:
+        raise VersionError(404, f"{model.__name__} not found")
+    raise VersionError(412, f"{model.__name__} was modified (current version {current})")
+
+def patch(db: Session, model, resource_id: str, user_id: str, values: dict, expected_version: int = None):
+    """Write only the given columns in one UPDATE ... RETURNING (caller commits)"""
+    table = model.__table__
+    for name, value in values.items():
+        if value is None and not table.c[name].nullable:
+            raise VersionError(422, f"{name} cannot be null")
+
+    if not values:
+        row = db.query(model).filter(model.id == resource_id, model.user_id == user_id).first()
+        if row is None or (expected_version is not None and row.version != expected_version):
+            _conflict(db, model, resource_id, user_id)
+        return row
+
+    statement = update(model).where(model.id == resource_id, model.user_id == user_id)
+    if expected_version is not None:
+        statement = statement.where(model.version == expected_version)
+    row = db.execute(
+        statement.values(**values, version=model.version + 1).returning(model)
+    ).scalar_one_or_none()
+    if row is None:
+        _conflict(db, model, resource_id, user_id)
+    return row
+
+def claim(db: Session, instance, expected_version: int = None):
+    """Bump the version of a loaded row before changing it, guarded by If-Match (caller commits)"""
+    model = type(instance)
+    statement = update(model).where(model.id == instance.id)
+    if expected_version is not None:
+        statement = statement.where(model.version == expected_version)
+    version = db.execute(
+        statement.values(version=model.version + 1).returning(model.version)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if version is None:
+        _conflict(db, model, instance.id, instance.user_id)
+    set_committed_value(instance, "version", version)
@@ -0,0 +1,441 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert, update, delete, exists, or_, case, func
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from pathlib import Path
+from dotenv import load_dotenv
+import threading
+import requests
+import logging
+import secrets
+import ipaddress
+import hashlib
+import random
+import signal
+import socket
+import hmac
+import json
+import time
+import uuid
+import os
+import typer
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from database import shard_session, shard_names
+from models import Webhook, OutboxEvent, WebhookDelivery, generate_uuid
+
+# Outbox transactionnel : chaque modification écrit son événement dans
+# outbox_events, dans sa propre transaction. Le dispatcher (python webhooks.py
+# dispatch) le répartit entre les webhooks abonnés puis livre chaque webhook
+# par lots, dans l'ordre des événements (outbox_events.sequence, croissante,
+# pas created_at qui peut être égal) : une file par webhook, tenue par un
+# seul dispatcher à la fois, donc l'ordre par ressource est garanti.
+# Livraison au moins une fois : le destinataire dédoublonne sur l'id.
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))  # Événements par requête
+WEBHOOK_BATCHES_PER_CLAIM = int(os.getenv("WEBHOOK_BATCHES_PER_CLAIM", "10"))  # Puis la file est rendue
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))  # secondes
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "10"))  # Puis l'événement part en lettre morte
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", "5"))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv("WEBHOOK_RETRY_MAX_SECONDS", "3600"))
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", "60"))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "4"))  # Webhooks livrés en parallèle
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1"))
+WEBHOOK_FANOUT_BATCH_SIZE = int(os.getenv("WEBHOOK_FANOUT_BATCH_SIZE", "1000"))
+WEBHOOK_RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "30"))
+# Hôtes exemptés du contrôle d'adresse (récepteurs de test locaux), séparés par des virgules
+WEBHOOK_ALLOWED_HOSTS = {host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()}
+
+EVENT_TYPES = {
+    "invoice.created", "invoice.updated", "invoice.status_changed", "invoice.paid",
+    "quote.created", "quote.updated", "quote.status_changed", "quote.converted",
+    "payment.created", "payment.deleted",
+}
+SIGNATURE_HEADER = "X-InvoiceFlow-Signature"
+
+INVOICE_FIELDS = ("id", "invoice_number", "client_id", "quote_id", "recurring_id", "status", "date", "due_date",
+                  "amount", "tax_amount", "discount", "amount_paid", "balance_due")
+QUOTE_FIELDS = ("id", "quote_number", "client_id", "status", "date", "expiry_date", "amount", "tax_amount", "discount")
+PAYMENT_FIELDS = ("id", "invoice_id", "client_id", "amount", "payment_date", "method", "reference")
+
+# ============ OUTBOX ============
+def _fields(resource, fields: tuple) -> dict:
+    if isinstance(resource, dict):
+        return {field: resource.get(field) for field in fields}
+    return {field: getattr(resource, field) for field in fields}
+
+def event(user_id: str, event_type: str, resource_type: str, resource_id: str, data: dict) -> dict:
+    return {
+        "id": generate_uuid(),
+        "user_id": user_id,
+        "event_type": event_type,
+        "resource_type": resource_type,
+        "resource_id": resource_id,
+        "payload": json.dumps(data, default=str),
+        "created_at": datetime.utcnow(),
+    }
+
+def invoice_event(event_type: str, invoice, **extra) -> dict:
+    data = _fields(invoice, INVOICE_FIELDS)
+    return event(_user_id(invoice), event_type, "invoice", data["id"], {**data, **extra})
+
+def quote_event(event_type: str, quote, **extra) -> dict:
+    data = _fields(quote, QUOTE_FIELDS)
+    return event(_user_id(quote), event_type, "quote", data["id"], {**data, **extra})
+
+def payment_event(event_type: str, payment, **extra) -> dict:
+    data = _fields(payment, PAYMENT_FIELDS)
+    # Ressource : la facture, pour ordonner règlements et changements de statut
+    return event(_user_id(payment), event_type, "invoice", data["invoice_id"], {**data, **extra})
+
+def invoice_paid_event(invoice, payment_id: str = None) -> dict:
+    data = _fields(invoice, ("id", "invoice_number", "client_id", "amount"))
+    return event(_user_id(invoice), "invoice.paid", "invoice", data["id"], {
+        **data,
+        "payment_id": payment_id,  # Règlement qui solde la facture, None si marquée payée sans montant
+    })
+
+def _user_id(resource) -> str:
+    return resource["user_id"] if isinstance(resource, dict) else resource.user_id
+
+def emit(db: Session, events: list):
+    """Write events to the outbox (caller commits, with the change they describe)"""
+    if not events:
+        return
+    if db.get_bind(OutboxEvent.__mapper__).dialect.name != "postgresql":
+        # Sans IDENTITY : numérotés à la suite, l'écrivain unique de SQLite évite les doublons
+        last = db.query(func.coalesce(func.max(OutboxEvent.sequence), 0)).scalar()
+        events = [{**outbox_event, "sequence": last + offset} for offset, outbox_event in enumerate(events, 1)]
+    db.execute(insert(OutboxEvent), events)
+
+# ============ FAN-OUT ============
+def _subscribed(webhook: Webhook, event_type: str) -> bool:
+    events = {name.strip() for name in (webhook.events or "*").split(",")}
+    return "*" in events or event_type in events
+
+def fan_out(db: Session, batch_size: int = WEBHOOK_FANOUT_BATCH_SIZE) -> int:
+    """Turn new outbox events into one delivery per subscribed webhook"""
+    now = datetime.utcnow()
+    events = db.query(
+        OutboxEvent.id, OutboxEvent.sequence, OutboxEvent.user_id, OutboxEvent.event_type, OutboxEvent.created_at
+    ).filter(OutboxEvent.dispatched_at.is_(None)).order_by(OutboxEvent.sequence).limit(batch_size).all()
+    if not events:
+        db.rollback()
+        return 0
+    # Marquées d'abord : un autre dispatcher qui les a prises entre-temps fait échouer ce lot
+    claimed = db.execute(update(OutboxEvent).where(
+        OutboxEvent.id.in_([row.id for row in events]),
+        OutboxEvent.dispatched_at.is_(None)
+    ).values(dispatched_at=now).execution_options(synchronize_session=False)).rowcount
+    if claimed != len(events):
+        db.rollback()
+        return 0
+
+    webhooks_by_user = {}
+    for webhook in db.query(Webhook).filter(
+        Webhook.user_id.in_({row.user_id for row in events}),
+        Webhook.is_active.is_(True)
+    ):
+        webhooks_by_user.setdefault(webhook.user_id, []).append(webhook)
+    deliveries = [{
+        "id": generate_uuid(),
+        "user_id": row.user_id,
+        "webhook_id": webhook.id,
+        "event_id": row.id,
+        "sequence": row.sequence,
+        "status": "pending",
+        "attempts": 0,
+        "created_at": row.created_at,
+    } for row in events for webhook in webhooks_by_user.get(row.user_id, []) if _subscribed(webhook, row.event_type)]
+    if deliveries:
+        db.execute(insert(WebhookDelivery), deliveries)
+    db.commit()
+    return len(events)
+
+# ============ DESTINATIONS ============
+# Une URL de webhook ne doit pas viser le réseau interne (SSRF) : l'hôte est
+# résolu et toute adresse non publique est refusée, à l'enregistrement puis
+# avant chaque envoi, le DNS pouvant changer entre-temps.
+class WebhookError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def check_destination(url: str):
+    """Raise WebhookError unless the URL is http(s) and resolves to public addresses only"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise WebhookError(400, "Webhook URL must be http(s)")
+    host = parts.hostname.lower()
+    if host in WEBHOOK_ALLOWED_HOSTS:
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        raise WebhookError(400, f"Webhook host {host} cannot be resolved")
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split("%")[0])
+        ip = getattr(ip, "ipv4_mapped", None) or ip
+        # is_global exclut bouclage, réseaux privés, lien local, réservés et non spécifiés
+        if not ip.is_global or ip.is_multicast:
+            raise WebhookError(400, f"Webhook host {host} resolves to a non-public address")
+
+# ============ DELIVERY ============
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def retry_delay(failures: int) -> float:
+    delay = min(WEBHOOK_RETRY_MAX_SECONDS, WEBHOOK_RETRY_BASE_SECONDS * 2 ** max(0, failures - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def lease_webhook(db: Session, webhook_id: str, dispatcher_id: str, now: datetime) -> bool:
+    """Take or renew a webhook's queue: a single dispatcher delivers it at a time"""
+    claimed = db.execute(update(Webhook).where(
+        Webhook.id == webhook_id,
+        or_(Webhook.locked_by == dispatcher_id, Webhook.locked_until.is_(None), Webhook.locked_until < now)
+    ).values(
+        locked_by=dispatcher_id, locked_until=now + timedelta(seconds=WEBHOOK_LEASE_SECONDS)
+    ).execution_options(synchronize_session=False)).rowcount
+    db.commit()
+    return claimed > 0
+
+def due_webhooks(db: Session, now: datetime, limit: int) -> list:
+    pending = exists().where(WebhookDelivery.webhook_id == Webhook.id, WebhookDelivery.status == "pending")
+    webhook_ids = [webhook_id for (webhook_id,) in db.query(Webhook.id).filter(
+        Webhook.is_active.is_(True),
+        or_(Webhook.next_attempt_at.is_(None), Webhook.next_attempt_at <= now),
+        or_(Webhook.locked_until.is_(None), Webhook.locked_until < now),
+        pending
+    ).limit(limit)]
+    db.rollback()
+    return webhook_ids
+
+def deliver_batch(db: Session, http: requests.Session, webhook: Webhook) -> int:
+    """POST the webhook's oldest pending events; returns how many were delivered"""
+    rows = db.query(WebhookDelivery, OutboxEvent).join(OutboxEvent, OutboxEvent.id == WebhookDelivery.event_id).filter(
+        WebhookDelivery.webhook_id == webhook.id,
+        WebhookDelivery.status == "pending"
+    ).order_by(WebhookDelivery.sequence).limit(WEBHOOK_BATCH_SIZE).all()
+    if not rows:
+        return 0
+    url, secret = webhook.url, webhook.secret
+    body = json.dumps({
+        "id": generate_uuid(),
+        "webhook_id": webhook.id,
+        "events": [{
+            "id": outbox_event.id,
+            "type": outbox_event.event_type,
+            "created_at": outbox_event.created_at.isoformat(),
+            "resource": {"type": outbox_event.resource_type, "id": outbox_event.resource_id},
+            "data": json.loads(outbox_event.payload),
+        } for _, outbox_event in rows],
+    }).encode()
+    delivery_ids = [delivery.id for delivery, _ in rows]
+    # Pas de transaction ouverte pendant l'appel HTTP
+    db.commit()
+
+    timestamp = int(time.time())
+    status_code, error = None, None
+    try:
+        check_destination(url)
+        # Pas de redirection suivie : elle pourrait mener vers une adresse interne
+        response = http.post(url, data=body, timeout=WEBHOOK_TIMEOUT, allow_redirects=False, headers={
+            "Content-Type": "application/json",
+            SIGNATURE_HEADER: sign(secret, timestamp, body),
+        })
+        status_code = response.status_code
+        response.close()
+        if not 200 <= status_code < 300:
+            # Code et motif seulement : le corps de la réponse n'est pas conservé
+            error = f"HTTP {status_code} {response.reason or ''}".strip()
+    except WebhookError as e:
+        error = e.detail
+    except requests.RequestException as e:
+        error = str(e)[:2000] or e.__class__.__name__
+
+    now = datetime.utcnow()
+    deliveries = WebhookDelivery.__table__.c
+    if error is None:
+        db.execute(update(WebhookDelivery.__table__).where(deliveries.id.in_(delivery_ids)).values(
+            status="delivered", attempts=deliveries.attempts + 1, last_status_code=status_code,
+            last_error=None, delivered_at=now
+        ))
+        db.execute(update(Webhook).where(Webhook.id == webhook.id).values(
+            failure_count=0, next_attempt_at=None
+        ).execution_options(synchronize_session=False))
+        db.commit()
+        return len(delivery_ids)
+
+    logger.warning(f"Webhook {webhook.id} delivery of {len(delivery_ids)} events failed: {error}")
+    db.execute(update(WebhookDelivery.__table__).where(deliveries.id.in_(delivery_ids)).values(
+        attempts=deliveries.attempts + 1, last_status_code=status_code, last_error=error,
+        # Lettre morte : la file passe aux événements suivants
+        status=case((deliveries.attempts + 1 >= WEBHOOK_MAX_ATTEMPTS, "dead"), else_="pending")
+    ))
+    failures = (webhook.failure_count or 0) + 1
+    db.execute(update(Webhook).where(Webhook.id == webhook.id).values(
+        failure_count=failures,
+        next_attempt_at=now + timedelta(seconds=retry_delay(failures)),
+        # 410 Gone : le destinataire demande l'arrêt
+        is_active=status_code != 410
+    ).execution_options(synchronize_session=False))
+    db.commit()
+    return 0
+
+def deliver_webhook(shard: str, webhook_id: str, dispatcher_id: str, http: requests.Session) -> int:
+    db = shard_session(shard)
+    delivered = 0
+    try:
+        if not lease_webhook(db, webhook_id, dispatcher_id, datetime.utcnow()):
+            return 0
+        try:
+            for _ in range(WEBHOOK_BATCHES_PER_CLAIM):
+                webhook = db.get(Webhook, webhook_id)
+                if webhook is None or not webhook.is_active:
+                    break
+                count = deliver_batch(db, http, webhook)
+                # Échec (reprise plus tard) ou file vide
+                if not count or not lease_webhook(db, webhook_id, dispatcher_id, datetime.utcnow()):
+                    break
+                delivered += count
+                db.expire_all()
+        finally:
+            db.rollback()
+            db.execute(update(Webhook).where(
+                Webhook.id == webhook_id, Webhook.locked_by == dispatcher_id
+            ).values(locked_by=None, locked_until=None).execution_options(synchronize_session=False))
+            db.commit()
+    finally:
+        db.close()
+    return delivered
+
+def prune(before: datetime) -> int:
+    """Delete delivered deliveries and fully dispatched events older than the retention"""
+    removed = 0
+    for shard in shard_names():
+        db = shard_session(shard)
+        try:
+            removed += db.execute(delete(WebhookDelivery).where(
+                WebhookDelivery.status == "delivered", WebhookDelivery.delivered_at < before
+            )).rowcount
+            removed += db.execute(delete(OutboxEvent).where(
+                OutboxEvent.dispatched_at < before,
+                ~exists().where(WebhookDelivery.event_id == OutboxEvent.id)
+            )).rowcount
+            db.commit()
+        finally:
+            db.close()
+    return removed
+
+class Dispatcher:
+    """Fans out the outbox and delivers webhooks, one thread per webhook being delivered"""
+
+    def __init__(self, concurrency: int = WEBHOOK_CONCURRENCY, poll_interval: float = WEBHOOK_POLL_INTERVAL):
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        # Connexions HTTP gardées ouvertes entre les lots (keep-alive)
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=concurrency)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self._stop = threading.Event()
+
+    def stop(self, *args):
+        self._stop.set()
+
+    def run_once(self, executor: ThreadPoolExecutor) -> int:
+        work = 0
+        for shard in shard_names():
+            db = shard_session(shard)
+            try:
+                work += fan_out(db)
+                webhook_ids = due_webhooks(db, datetime.utcnow(), self.concurrency * 4)
+            finally:
+                db.close()
+            futures = [executor.submit(deliver_webhook, shard, webhook_id, self.id, self.http) for webhook_id in webhook_ids]
+            for future in futures:
+                try:
+                    work += future.result()
+                except Exception as e:
+                    logger.error(f"Webhook dispatcher {self.id}: {e}")
+        return work
+
+    def run(self):
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="webhook") as executor:
+            while not self._stop.is_set():
+                try:
+                    if not self.run_once(executor):
+                        self._stop.wait(self.poll_interval)
+                except Exception as e:
+                    # Base indisponible : on réessaie au prochain tour
+                    logger.error(f"Webhook dispatcher {self.id}: {e}")
+                    self._stop.wait(self.poll_interval)
+        self.http.close()
+
+# ============ SUBSCRIPTIONS ============
+def create_webhook(db: Session, user_id: str, url: str, events: list) -> Webhook:
+    """Register an endpoint; its signing secret is only shown in this response (caller commits)"""
+    check_destination(url)
+    events = sorted({name.strip() for name in events if name.strip()}) or ["*"]
+    unknown = [name for name in events if name != "*" and name not in EVENT_TYPES]
+    if unknown:
+        raise WebhookError(400, f"Unknown event types: {', '.join(unknown)}")
+    webhook = Webhook(id=generate_uuid(), user_id=user_id, url=url, secret=secrets.token_hex(32), events=",".join(events))
+    db.add(webhook)
+    return webhook
+
+def describe(webhook: Webhook, with_secret: bool = False) -> dict:
+    return {
+        "id": webhook.id,
+        "url": webhook.url,
+        "events": webhook.events.split(","),
+        "is_active": webhook.is_active,
+        "failure_count": webhook.failure_count,
+        "next_attempt_at": webhook.next_attempt_at,
+        "created_at": webhook.created_at,
+        "secret": webhook.secret if with_secret else None,
+    }
+
+def replay_dead(db: Session, webhook: Webhook) -> int:
+    """Send dead-lettered events again, in their original order (caller commits)"""
+    replayed = db.execute(update(WebhookDelivery).where(
+        WebhookDelivery.webhook_id == webhook.id, WebhookDelivery.status == "dead"
+    ).values(status="pending", attempts=0).execution_options(synchronize_session=False)).rowcount
+    webhook.is_active = True
+    webhook.failure_count = 0
+    webhook.next_attempt_at = None
+    return replayed
+
+app = typer.Typer(help="Outbox dispatch and webhook delivery")
+
+@app.command()
+def dispatch(
+    concurrency: int = typer.Option(WEBHOOK_CONCURRENCY, help="Webhooks delivered in parallel"),
+    poll_interval: float = typer.Option(WEBHOOK_POLL_INTERVAL, help="Seconds to wait when there is nothing to send"),
+):
+    """Deliver webhooks until SIGTERM/SIGINT"""
+    dispatcher = Dispatcher(concurrency, poll_interval)
+    signal.signal(signal.SIGTERM, dispatcher.stop)
+    signal.signal(signal.SIGINT, dispatcher.stop)
+    logger.info(f"Webhook dispatcher {dispatcher.id}: {concurrency} threads")
+    dispatcher.run()
+
+@app.command("prune")
+def prune_command(days: int = typer.Option(WEBHOOK_RETENTION_DAYS, help="Keep delivered events this many days")):
+    """Delete old delivered events"""
+    typer.echo(f"Removed {prune(datetime.utcnow() - timedelta(days=days)):,} rows")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    app()
@@ -0,0 +1,323 @@
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import requests
+import typer
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+# Poids relatifs des scénarios dans le mélange de charge
+DEFAULT_MIX = {
+    "dashboard": 20,
+    "list_invoices": 25,
+    "create_invoice": 20,
+    "convert_quote": 10,
+    "report_financial": 15,
+    "report_cashflow": 10,
+}
+
+BENCH_EMAIL = "tenant00000@datagen.invoiceflow.fr"
+BENCH_PASSWORD = "bench123"
+
+app = typer.Typer(help="InvoiceFlow backend load and performance benchmark")
+
+def seed_database(database_url: str, invoices: int, seed: int = 42, workers: int = 1) -> dict:
+    """Generate a single bench tenant with `invoices` invoices, return the IDs the scenarios use"""
+    sys.path.insert(0, str(BACKEND_DIR))
+    from datagen import generate
+    generate(database_url, tenants=1, invoices_per_tenant=invoices, workers=workers, seed=seed,
+             reset=True, password=BENCH_PASSWORD)
+
+    from sqlalchemy import create_engine, select
+    from models import Client, Product, Quote
+    engine = create_engine(database_url)
+    with engine.connect() as conn:
+        dataset = {
+            "client_ids": list(conn.execute(select(Client.id)).scalars()),
+            "product_ids": list(conn.execute(select(Product.id)).scalars()),
+            "quote_ids": list(conn.execute(select(Quote.id).limit(10_000)).scalars()),
+        }
+    engine.dispose()
+    return dataset
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(database_url: str, port: int, workers: int) -> subprocess.Popen:
+    # Même lanceur qu'en production (serve.py : gunicorn + workers uvicorn)
+    env = {**os.environ, "DATABASE_URL": database_url, "SCHEDULER_ENABLED": "false", "HOST": "127.0.0.1",
+           "PORT": str(port), "WEB_CONCURRENCY": str(workers), "RATE_LIMIT_ENABLED": "false"}
+    process = subprocess.Popen([sys.executable, "serve.py"], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/api/health", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError("Backend exited during startup")
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Backend did not become healthy in time")
+
+class Scenarios:
+    """One HTTP call per scenario; returns the response for status checking"""
+
+    def __init__(self, session: requests.Session, api_url: str, dataset: dict, rng: random.Random):
+        self.session = session
+        self.api_url = api_url
+        self.dataset = dataset
+        self.rng = rng
+
+    def dashboard(self):
+        return self.session.get(f"{self.api_url}/dashboard")
+
+    def list_invoices(self):
+        return self.session.get(f"{self.api_url}/invoices")
+
+    def create_invoice(self):
+        items = [{"description": "Prestation", "quantity": self.rng.randint(1, 5), "price": 120.0,
+                  "product_id": self.rng.choice(self.dataset["product_ids"])} for _ in range(self.rng.randint(1, 4))]
+        return self.session.post(f"{self.api_url}/invoices", json={
+            "client_id": self.rng.choice(self.dataset["client_ids"]), "items": items
+        })
+
+    def convert_quote(self):
+        return self.session.post(f"{self.api_url}/quotes/{self.rng.choice(self.dataset['quote_ids'])}/convert")
+
+    def report_financial(self):
+        return self.session.get(f"{self.api_url}/reports/financial",
+                                params={"period": self.rng.choice(["month", "quarter", "year"])})
+
+    def report_cashflow(self):
+        return self.session.get(f"{self.api_url}/reports/cashflow")
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def run_load(base_url: str, dataset: dict, mix: dict, concurrency: int, duration: float, seed: int) -> dict:
+    api_url = f"{base_url}/api"
+    token = requests.post(f"{api_url}/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD}).json()["access_token"]
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(worker_id: int):
+        rng = random.Random(seed + worker_id)
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {token}"
+        scenarios = Scenarios(session, api_url, dataset, rng)
+        local_latencies = defaultdict(list)
+        local_errors = defaultdict(int)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                ok = getattr(scenarios, name)().status_code < 400
+            except requests.RequestException:
+                ok = False
+            local_latencies[name].append(time.perf_counter() - start)
+            if not ok:
+                local_errors[name] += 1
+        with lock:
+            for name, values in local_latencies.items():
+                latencies[name].extend(values)
+            for name, count in local_errors.items():
+                errors[name] += count
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    for name in names:
+        values = sorted(latencies[name])
+        routes[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    total = sum(route["count"] for route in routes.values())
+    return {
+        "duration_s": round(elapsed, 2),
+        "requests": total,
+        "errors": sum(route["errors"] for route in routes.values()),
+        "throughput_rps": round(total / elapsed, 2),
+        "routes": routes,
+    }
+
+def find_regressions(result: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - max_regression):
+        regressions.append(f"throughput {result['throughput_rps']} < baseline {baseline['throughput_rps']}")
+    for name, route in result["routes"].items():
+        reference = baseline.get("routes", {}).get(name)
+        if not reference or not reference["count"] or not route["count"]:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if route[key] > reference[key] * (1 + max_regression):
+                regressions.append(f"{name} {key} {route[key]} > baseline {reference[key]}")
+    return regressions
+
+@app.command()
+def load(
+    scale: str = typer.Option("1k", help="Dataset size: 1k, 100k or 1m invoices"),
+    concurrency: int = typer.Option(8, help="Concurrent simulated clients"),
+    duration: float = typer.Option(30.0, help="Load duration in seconds"),
+    workers: int = typer.Option(1, help="uvicorn worker processes"),
+    database_url: str = typer.Option(None, help="Database to seed and serve (default: temporary SQLite file)"),
+    url: str = typer.Option(None, help="Bench an already running backend instead of starting one"),
+    no_seed: bool = typer.Option(False, help="Reuse the existing dataset (requires --dataset-file)"),
+    dataset_file: Path = typer.Option(None, help="Where to save/load the seeded IDs"),
+    mix: str = typer.Option(None, help='Scenario weights as JSON, e.g. \'{"dashboard": 1}\''),
+    seed: int = typer.Option(42, help="Random seed for data and load"),
+    output: Path = typer.Option(None, help="Write the JSON report to this file"),
+    baseline: Path = typer.Option(None, help="Previous JSON report to compare against"),
+    max_regression: float = typer.Option(0.15, help="Allowed relative regression before failing"),
+):
+    if scale not in SCALES:
+        raise typer.BadParameter(f"scale must be one of {', '.join(SCALES)}")
+    database_url = database_url or f"sqlite:///{Path(tempfile.gettempdir()) / f'invoiceflow-bench-{scale}.db'}"
+
+    if no_seed:
+        dataset = json.loads(dataset_file.read_text())
+    else:
+        typer.echo(f"Seeding {SCALES[scale]} invoices into {database_url}...", err=True)
+        started = time.perf_counter()
+        dataset = seed_database(database_url, SCALES[scale], seed)
+        typer.echo(f"Seeded in {time.perf_counter() - started:.1f}s", err=True)
+        if dataset_file:
+            dataset_file.write_text(json.dumps(dataset))
+
+    process = None
+    if url is None:
+        port = free_port()
+        process = start_server(database_url, port, workers)
+        url = f"http://127.0.0.1:{port}"
+    try:
+        result = run_load(url, dataset, json.loads(mix) if mix else DEFAULT_MIX, concurrency, duration, seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = {"scale": scale, "invoices": SCALES[scale], "concurrency": concurrency, "workers": workers,
+              "database": database_url.split("://")[0], **result}
+    text = json.dumps(report, indent=2)
+    if output:
+        output.write_text(text)
+    typer.echo(text)
+
+    if baseline:
+        regressions = find_regressions(report, json.loads(baseline.read_text()), max_regression)
+        for regression in regressions:
+            typer.echo(f"❌ Regression: {regression}", err=True)
+        if regressions:
+            raise typer.Exit(code=1)
+
+READ_MIX = {"dashboard": 40, "report_financial": 30, "report_cashflow": 30}
+
+@app.command()
+def scaling(
+    scale: str = typer.Option("1k", help="Dataset size: 1k, 100k or 1m invoices"),
+    max_workers: int = typer.Option(os.cpu_count() or 1, help="Highest worker count to try"),
+    clients_per_worker: int = typer.Option(4, help="Concurrent simulated clients per worker"),
+    duration: float = typer.Option(20.0, help="Load duration per step in seconds"),
+    database_url: str = typer.Option(None, help="Database to seed and serve (default: temporary SQLite file)"),
+    mix: str = typer.Option(None, help="Scenario weights as JSON (default: read-only mix)"),
+    seed: int = typer.Option(42, help="Random seed for data and load"),
+    output: Path = typer.Option(None, help="Write the JSON report to this file"),
+):
+    """Throughput at 1, 2, 4... workers, with scaling efficiency against one worker"""
+    if scale not in SCALES:
+        raise typer.BadParameter(f"scale must be one of {', '.join(SCALES)}")
+    database_url = database_url or f"sqlite:///{Path(tempfile.gettempdir()) / f'invoiceflow-bench-{scale}.db'}"
+    dataset = seed_database(database_url, SCALES[scale], seed)
+    mix_weights = json.loads(mix) if mix else READ_MIX
+
+    steps = sorted({1, max_workers} | {2 ** i for i in range(1, max_workers.bit_length()) if 2 ** i < max_workers})
+    results = []
+    for workers in steps:
+        port = free_port()
+        process = start_server(database_url, port, workers)
+        try:
+            result = run_load(f"http://127.0.0.1:{port}", dataset, mix_weights, workers * clients_per_worker,
+                              duration, seed)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        baseline_rps = results[0]["throughput_rps"] if results else result["throughput_rps"]
+        results.append({
+            "workers": workers,
+            "throughput_rps": result["throughput_rps"],
+            "errors": result["errors"],
+            "speedup": round(result["throughput_rps"] / baseline_rps, 2) if baseline_rps else 0.0,
+            "efficiency": round(result["throughput_rps"] / (baseline_rps * workers), 2) if baseline_rps else 0.0,
+        })
+        typer.echo(f"{workers:>3} workers: {result['throughput_rps']:>8} req/s "
+                   f"(x{results[-1]['speedup']}, efficiency {results[-1]['efficiency']})", err=True)
+
+    text = json.dumps({"scale": scale, "cpus": os.cpu_count(), "steps": results}, indent=2)
+    if output:
+        output.write_text(text)
+    typer.echo(text)
+
+@app.command()
+def import_time(
+    module: str = typer.Option("server", help="Module whose cold import is measured"),
+    runs: int = typer.Option(5, help="Fresh interpreters to start; the median is reported"),
+    budget_ms: float = typer.Option(800.0, help="Fail when the median import exceeds this"),
+):
+    """Measure cold import time of the backend in fresh interpreters"""
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{Path(tempfile.gettempdir()) / 'invoiceflow-import.db'}",
+           "SCHEDULER_ENABLED": "false"}
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    timings = sorted(
+        float(subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=env, check=True,
+                             capture_output=True, text=True).stdout.strip().splitlines()[-1]) * 1000
+        for _ in range(runs)
+    )
+    median = timings[len(timings) // 2]
+    typer.echo(json.dumps({"module": module, "runs": runs, "median_ms": round(median, 1),
+                           "max_ms": round(timings[-1], 1), "budget_ms": budget_ms}, indent=2))
+    for heavy in ("pandas", "numpy"):
+        loaded = subprocess.run([sys.executable, "-c", f"import sys, {module}; print('{heavy}' in sys.modules)"],
+                                cwd=BACKEND_DIR, env=env, capture_output=True, text=True).stdout.strip()
+        if loaded == "True":
+            typer.echo(f"❌ {heavy} is imported at startup; import it inside the function that needs it", err=True)
+            raise typer.Exit(code=1)
+    if median > budget_ms:
+        typer.echo(f"❌ Import time {median:.0f} ms exceeds budget {budget_ms:.0f} ms", err=True)
+        raise typer.Exit(code=1)
+
+if __name__ == "__main__":
+    app()